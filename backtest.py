@@ -1,14 +1,18 @@
 import logging
 import random
 
-from kuegi_bot.backtest_engine import BackTest
+from kuegi_bot.backtest_engine import BackTest, StreamingBackTest, AbortCriteria
 from kuegi_bot.bots.MultiStrategyBot import MultiStrategyBot
 from kuegi_bot.bots.strategies.MACross import MACross
 from kuegi_bot.bots.strategies.entry_filters import DayOfWeekFilter
 from kuegi_bot.bots.strategies.SfpStrat import SfpStrategy
 from kuegi_bot.bots.strategies.exit_modules import SimpleBE, ParaTrail, MaxSLDiff
 from kuegi_bot.bots.strategies.kuegi_strat import KuegiStrategy
-from kuegi_bot.utils.helper import load_bars, prepare_plot
+from kuegi_bot.utils.helper import load_bars, load_path_bars, stream_bars, prepare_plot
+from kuegi_bot.utils import plotting
+from kuegi_bot.utils.intrabar_path import compress_bars, compare_backtests
+from kuegi_bot.walk_forward import WalkForward, grid_params
+from kuegi_bot.optimizer import Optimizer, ParamSpace, TPESearch, SuccessiveHalving
 from kuegi_bot.utils import log
 from kuegi_bot.indicators.kuegi_channel import KuegiChannel
 from kuegi_bot.utils.trading_classes import Symbol
@@ -76,12 +80,32 @@ def checkDayFilterByDay(bars,symbol= None):
 
         b= BackTest(bot, bars,symbol).run()
 
+
+def checkPathDivergence(bars,path_resolution= 5,symbol= None):
+    # same bot on full M1 subbars and on the compact intrabar path
+    results= []
+    for testbars in [bars, compress_bars(bars, path_resolution)]:
+        bot = MultiStrategyBot(logger=logger, directionFilter=0)
+        bot.add_strategy(SfpStrategy()
+                         )
+        results.append(BackTest(bot, testbars,symbol).run())
+    divergence= compare_backtests(results[0],results[1])
+    logger.info("path %i divergence: %i/%i positions match (%.1f%%) | fill diff: %.3f%% | equity diff: %.2f%% "
+                "| maxDD diff: %.2f%% | UW days diff: %.1f" %
+                (path_resolution, divergence["matchingPositions"], divergence["positions"],
+                 100*divergence["positionMatchRate"], divergence["avgFillDiffPercent"],
+                 divergence["equityDiffPercent"], divergence["maxDDDiffPercent"], divergence["uwDaysDiff"]))
+    return divergence
+
 #bars_p = load_bars(30 * 12, 240,0,'phemex')
 #bars_n = load_bars(30 * 12, 240,0,'binance')
 #bars_ns = load_bars(30 * 24, 240,0,'binanceSpot')
 bars_b = load_bars(30 * 18, 240,0,'bybit',"ETHUSD")
 #bars_m = load_bars(30 * 12, 240,0,'bitmex')
 
+# compact intrabar path instead of M1 subbars (5 minute pivots, 0 = only OHLC order). cached after the first run
+#bars_b = load_path_bars(30 * 48, 240,0,'bybit',path_resolution=5)
+
 #bars_b = load_bars(30 * 12, 60,0,'bybit')
 #bars_m = load_bars(30 * 24, 60,0,'bitmex')
 
@@ -107,7 +131,43 @@ checkDayFilterByDay(bars,symbol=symbol)
 #'''
 
 '''
-# profiling stats
+# walk forward: optimize on 90 days, trade the next 30 days with the best params, roll on by 30 days
+def wfBot(params):
+    bot = MultiStrategyBot(logger=logger, directionFilter=0)
+    bot.add_strategy(SfpStrategy(min_rej_length=params[0], range_length=params[1]))
+    return bot
+
+WalkForward(bars_full, wfBot, train_bars=6*90, test_bars=6*30, symbol=symbol, logger=logger
+            ).run(grid_params(min=[10,30], max=[30,60], steps=[5,10]))
+
+#'''
+
+'''
+# smarter search than the full grid: latin hypercube, successive halving or tpe. results go to the trial db,
+# running it again with the same file resumes. configs with more than 30% drawdown get stopped early
+space= ParamSpace(min=[10,30], max=[30,60], steps=[1,5])
+opt= Optimizer(bars, wfBot, TPESearch(space, count=60, startup=16, batch_size=8), symbol=symbol,
+               abort=AbortCriteria(max_dd=0.3), trial_db="results/sfp_tpe.jsonl", logger=logger).run()
+#opt= Optimizer(bars, wfBot, SuccessiveHalving(space, count=81, eta=3, min_budget=0.1), symbol=symbol).run()
+for trial in opt.best(10):
+    logger.info("%s: rel %.2f profit %.2f%% maxDD %.2f%%" % (trial.params, trial.score, 100*trial.profit, 100*trial.maxDD))
+
+#'''
+
+'''
+checkPathDivergence(bars,path_resolution=5,symbol=symbol)
+checkPathDivergence(bars,path_resolution=0,symbol=symbol)
+
+#'''
+
+'''
+# time breakdown of the hot paths (bot, strategies, indicators), logged at the end of the run
+b= BackTest(bot, bars, profile=True).run()
+
+#'''
+
+'''
+# full profiling stats
 # run it `python -m cProfile -o profile.data backtest.py`
 
 import pstats
@@ -143,6 +203,10 @@ bot.add_strategy(SfpStrategy(
                  )
 b= BackTest(bot, bars_b).run()
 
+#long histories with constant memory: bars are read from the history files while the test runs
+b= StreamingBackTest(bot, stream_bars(30 * 48, 240,0,'bybit',path_resolution=5),
+                     on_position=lambda pos: logger.info("closed %s" % pos.id)).run()
+
 #binance is not inverse: needs different symbol:
 
 b= BackTest(bot, bars_n,
@@ -155,4 +219,7 @@ bot.create_performance_plot().show()
 # chart with signals:
 b.prepare_plot().show()
 
+# long backtests: bars and lines are decimated to max_points, write to a file instead of opening the browser
+plotting.write_plot(b.prepare_plot(max_points=4000), "results/chart.html")
+
 #'''
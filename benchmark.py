@@ -0,0 +1,32 @@
+import argparse
+import sys
+
+from kuegi_bot.benchmark import Benchmark, STAGES
+
+# benchmarks of the backtest pipeline on synthetic data (no history files or network needed)
+# `python benchmark.py --save` stores the baseline, later runs compare against it and fail on regressions
+
+parser = argparse.ArgumentParser(description="benchmark load/aggregate/indicator/backtest on synthetic M1 data")
+parser.add_argument("--days", type=float, nargs="+", default=[14, 60, 180], help="history sizes in days")
+parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+parser.add_argument("--timeframe", type=int, default=240, help="minutes per bar")
+parser.add_argument("--repeats", type=int, default=3)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--no-memory", action="store_true", help="skip the peak memory runs")
+parser.add_argument("--baseline", default="results/benchmark_baseline.json")
+parser.add_argument("--save", action="store_true", help="store the results as new baseline")
+parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before it is a regression")
+args = parser.parse_args()
+
+benchmark = Benchmark(days=args.days, timeframe=args.timeframe, repeats=args.repeats, seed=args.seed,
+                      stages=args.stages, memory=not args.no_memory).run()
+if args.save:
+    benchmark.save_baseline(args.baseline)
+else:
+    try:
+        regressions = benchmark.compare(args.baseline, args.tolerance)
+    except FileNotFoundError:
+        print("no baseline at %s, run with --save to create one" % args.baseline)
+        regressions = []
+    if len(regressions) > 0:
+        sys.exit(1)
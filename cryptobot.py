@@ -1,6 +1,4 @@
 import atexit
-import json
-import os
 import signal
 import sys
 import threading
@@ -15,6 +13,10 @@ from kuegi_bot.bots.strategies.kuegi_strat import KuegiStrategy
 from kuegi_bot.bots.strategies.exit_modules import SimpleBE, ParaTrail, ExitModule
 from kuegi_bot.trade_engine import LiveTrading
 from kuegi_bot.utils import log
+from kuegi_bot.utils import json_codec, metrics, session_recording
+from kuegi_bot.utils.dashboard import DashboardPublisher, DashboardServer
+from kuegi_bot.utils.http_transport import get_transport
+from kuegi_bot.utils.session_replay import ReplayServer
 from kuegi_bot.utils.telegram import TelegramBot
 from kuegi_bot.utils.dotdict import dotdict
 from kuegi_bot.utils.helper import load_settings_from_args
@@ -109,7 +111,11 @@ def start_bot(botSettings,telegram:TelegramBot=None):
     else:
         logger.error("only multistrat bot supported")
     live = LiveTrading(settings=botSettings, trading_bot=bot,telegram=telegram)
-    t = threading.Thread(target=live.run_loop)
+    if botSettings.EXCHANGE == 'simulated' and not botSettings.SIM_SPEED:
+        # stepped simulation: as fast as the bot can handle the bars
+        t = threading.Thread(target=live.run_simulation)
+    else:
+        t = threading.Thread(target=live.run_loop)
     t.bot: LiveTrading = live
     t.originalSettings= originalSettings
     t.start()
@@ -120,6 +126,9 @@ def stop_all_and_exit():
     logger.info("closing bots")
     for t in activeThreads:
         t.bot.exit()
+    if telegram_bot is not None:
+        telegram_bot.close()
+    session_recording.stop_recording()
 
     logger.info("bye")
     atexit.unregister(stop_all_and_exit)
@@ -131,44 +140,96 @@ def term_handler(signum, frame):
     stop_all_and_exit()
 
 
-def write_dashboard(dashboardFile):
-    result = {}
+def dashboard_data(engine: LiveTrading):
+    if not engine.alive:
+        return {"alive": False}
+    bot = engine.bot
+    data = {
+        'alive': engine.alive,
+        "last_time": bot.last_time,
+        "last_tick": str(bot.last_tick_time),
+        "equity": engine.account.equity,
+        "risk_reference": bot.risk_reference,
+        "max_equity": bot.max_equity,
+        "time_of_max_equity": bot.time_of_max_equity,
+        "latency": engine.latency.to_json()
+    }
+    data['positions'] = []
+    for pos in bot.open_positions:
+        data['positions'].append(bot.open_positions[pos].to_json())
+    data['moduleData'] = {}
+    data['moduleData'][engine.bars[0].tstamp] = ExitModule.get_data_for_json(engine.bars[0])
+    data['moduleData'][engine.bars[1].tstamp] = ExitModule.get_data_for_json(engine.bars[1])
+    return data
+
+
+def write_dashboard(publisher: DashboardPublisher):
+    ''' only bots that ticked since the last call get serialized again '''
+    ids = []
     for thread in activeThreads:
+        engine: LiveTrading = thread.bot
+        ids.append(engine.id)
+        # a bot that failed to start has no bot/exchange, it's only published as dead
+        version = (engine.alive, engine.bot.state_version if engine.alive else None)
+        if publisher.is_current(engine.id, version):
+            continue
         try:
-            engine: LiveTrading = thread.bot
-            if engine.alive:
-                bot= engine.bot
-                result[engine.id] = {
-                    'alive': engine.alive,
-                    "last_time": bot.last_time,
-                    "last_tick": str(bot.last_tick_time),
-                    "equity": engine.account.equity,
-                    "risk_reference":bot.risk_reference,
-                    "max_equity":bot.max_equity,
-                    "time_of_max_equity":bot.time_of_max_equity
-                }
-                data = result[engine.id]
-                data['positions'] = []
-                for pos in engine.bot.open_positions:
-                    data['positions'].append(engine.bot.open_positions[pos].to_json())
-                data['moduleData'] = {}
-                data['moduleData'][engine.bars[0].tstamp] = ExitModule.get_data_for_json(engine.bars[0])
-                data['moduleData'][engine.bars[1].tstamp] = ExitModule.get_data_for_json(engine.bars[1])
-
-            else:
-                result[engine.id] = {"alive": False}
+            publisher.set(engine.id, version, dashboard_data(engine))
         except Exception as e:
             logger.error("exception in writing dashboard: " + traceback.format_exc())
             thread.bot.alive= False
+    publisher.publish(ids)
+
+
+def collect_metrics():
+    ''' state of the bots and stats of the engine and exchange layers, read on every scrape of the metrics endpoint '''
+    alive = metrics.Gauge("kuegi_bot_alive", "1 if the bot is running", ["bot"])
+    equity = metrics.Gauge("kuegi_bot_equity", "equity of the account", ["bot"])
+    maxEquity = metrics.Gauge("kuegi_bot_max_equity", "highest equity of the bot", ["bot"])
+    drawdown = metrics.Gauge("kuegi_bot_drawdown_r", "drawdown from the max equity in R (risk reference)", ["bot"])
+    openPositions = metrics.Gauge("kuegi_bot_open_positions", "positions of the bot that are open or pending",
+                                  ["bot"])
+    ticks = metrics.Counter("kuegi_ticks_total", "ticks handled by the engine per trigger", ["bot", "origin"])
+    spans = metrics.Histogram("kuegi_tick_span_seconds", "latency of the stages of a tick (queued is the loop lag)",
+                              ["bot", "span"])
+    wsMessages = metrics.Counter("kuegi_ws_messages_total", "websocket messages per topic", ["bot", "topic"])
+    orderRequests = metrics.Counter("kuegi_order_requests_total", "finished order requests to the exchange",
+                                    ["bot", "action", "result"])
+    result = [alive, equity, maxEquity, drawdown, openPositions, ticks, spans, wsMessages, orderRequests]
+    for thread in activeThreads:
+        engine: LiveTrading = thread.bot
+        alive.set(engine.alive, bot=engine.id)
+        if not engine.alive:
+            continue
+        bot = engine.bot
+        equity.set(engine.account.equity, bot=engine.id)
+        maxEquity.set(bot.max_equity, bot=engine.id)
+        drawdown.set((bot.max_equity - engine.account.equity) / bot.risk_reference if bot.risk_reference else None,
+                     bot=engine.id)
+        openPositions.set(len(bot.open_positions), bot=engine.id)
+        latency = engine.latency.to_json()
+        for origin, count in latency["ticks"].items():
+            ticks.set(count, bot=engine.id, origin=origin)
+        for span, data in latency["spans"].items():
+            spans.set(data, bot=engine.id, span=span)
+        for (action, outcome), count in list(engine.exchange.order_requests.items()):
+            orderRequests.set(count, bot=engine.id, action=action, result=outcome)
+        router = getattr(getattr(engine.exchange, "ws", None), "router", None)
+        if router is not None:
+            for topic, data in router.stats_to_json()["topics"].items():
+                wsMessages.set(data["count"], bot=engine.id, topic=topic)
+
+    restLatency = metrics.Histogram("kuegi_rest_request_seconds", "latency of the REST requests per endpoint",
+                                    ["endpoint"])
+    restErrors = metrics.Counter("kuegi_rest_errors_total", "failed REST requests per endpoint", ["endpoint"])
+    for endpoint, data in get_transport().stats_to_json().items():
+        restLatency.set(data, endpoint=endpoint)
+        restErrors.set(data["errors"], endpoint=endpoint)
+    return result + [restLatency, restErrors]
 
-    try:
-        os.makedirs(os.path.dirname(dashboardFile))
-    except Exception:
-        pass
-    with open(dashboardFile, 'w') as file:
-        json.dump(result, file, sort_keys=False, indent=4)
 
 def run(settings):
+    global telegram_bot
     signal.signal(signal.SIGTERM, term_handler)
     signal.signal(signal.SIGINT, term_handler)
     atexit.register(stop_all_and_exit)
@@ -176,8 +237,29 @@ def run(settings):
     if not settings:
         print("error: no settings defined. nothing to do. exiting")
         sys.exit()
+    if settings.JSON_DECODER is not None:
+        logger.info("using %s to decode websocket messages" % json_codec.set_default_decoder(settings.JSON_DECODER).name)
+    if settings.REPLAY_FILE is not None:
+        # runs the bots against a recorded session instead of the exchanges
+        replay = ReplayServer(settings.REPLAY_FILE,
+                              speed=settings.REPLAY_SPEED if settings.REPLAY_SPEED is not None else 1).start()
+        replay.redirect(get_transport())
+        logger.info("replaying %s on port %i" % (settings.REPLAY_FILE, replay.port))
+    if settings.RECORD_FILE is not None:
+        session_recording.start_recording(settings.RECORD_FILE)
+        logger.info("recording session to " + settings.RECORD_FILE)
+    if settings.METRICS_PORT is not None:
+        metrics.get_registry().register_collector(collect_metrics)
+        metricsServer = metrics.MetricsServer(host=settings.METRICS_HOST or "127.0.0.1",
+                                              port=settings.METRICS_PORT).start()
+        logger.info("serving metrics on port %i" % metricsServer.port)
+    dashboard = DashboardPublisher(settings.DASHBOARD_FILE)
+    if settings.DASHBOARD_PORT is not None:
+        dashboardServer = DashboardServer(dashboard, host=settings.DASHBOARD_HOST or "127.0.0.1",
+                                          port=settings.DASHBOARD_PORT).start()
+        logger.info("serving dashboard on port %i" % dashboardServer.port)
     if settings.TELEGRAM_BOT is not None:
-      telegram_bot:TelegramBot = TelegramBot(logger=logger,settings=dotdict(settings.TELEGRAM_BOT))
+      telegram_bot = TelegramBot(logger=logger,settings=dotdict(settings.TELEGRAM_BOT))
     else:
       telegram_bot= None
     logger.info("###### loading %i bots #########" % len(settings.bots))
@@ -215,6 +297,8 @@ def run(settings):
                 for thread in activeThreads:
                     if not thread.is_alive() or not thread.bot.alive:
                         logger.info("%s died. stopping" % thread.bot.id)
+                        metrics.get_registry().counter("kuegi_bot_restarts_total", "bots restarted after they died",
+                                                       ["bot"]).inc(bot=thread.bot.id)
                         if telegram_bot is not None:
                             telegram_bot.send_log(thread.bot.id+" died. restarting")
                         toRestart.append(thread.originalSettings)
@@ -236,7 +320,7 @@ def run(settings):
                     sleep(10)
                     activeThreads.append(start_bot(botSettings=usedSettings, telegram=telegram_bot))
 
-                write_dashboard(settings.DASHBOARD_FILE)
+                write_dashboard(dashboard)
             except Exception as e:
                 logger.error("exception in main loop:\n "+ traceback.format_exc())
     else:
@@ -244,6 +328,7 @@ def run(settings):
 
 
 activeThreads: List[threading.Thread] = []
+telegram_bot: TelegramBot = None
 logger = None
 
 if __name__ == '__main__':
@@ -40,39 +40,125 @@
 
 })();
 
-function refresh() {
-    $.getJSON('dashboard.json', function(data) {
-        var template = Handlebars.templates.openPositions;
-        var container= $('#positions')[0];
-        container.innerHTML= '';
-        for (let id in data) {
-            var bot= data[id];
-            bot.id= id;
-            bot.drawdown = ((bot.max_equity - bot.equity)/bot.risk_reference).toFixed(1)+"R"
-            bot.uwdays= ((Date.now()-bot.time_of_max_equity*1000)/(1000*60*60*24)).toFixed(1)
-            bot.equity = bot.equity.toFixed(3)
-            bot.max_equity = bot.max_equity.toFixed(3)
-            var totalPos= 0;
-            bot.positions.forEach(function(pos) {
-                if(pos.status == "open") {
-                    totalPos += pos.amount;
+var bots = {};
+
+function renderBot(id) {
+    var container= $('#positions')[0];
+    var element= document.getElementById("bot_" + id);
+    if(!bots.hasOwnProperty(id)) {
+        if(element) {
+            element.remove();
+        }
+        return;
+    }
+    if(!element) {
+        element= document.createElement("div");
+        element.id= "bot_" + id;
+        container.appendChild(element);
+    }
+    // the template gets a formatted copy, the state keeps the raw values for the next diff
+    var bot= $.extend(true, {}, bots[id]);
+    bot.id= id;
+    if(bot.alive === false) {
+        element.innerHTML= '<div class="botContainer"><p><b>' + id + '</b> not alive</p></div>';
+        return;
+    }
+    bot.drawdown = ((bot.max_equity - bot.equity)/bot.risk_reference).toFixed(1)+"R"
+    bot.uwdays= ((Date.now()-bot.time_of_max_equity*1000)/(1000*60*60*24)).toFixed(1)
+    bot.equity = bot.equity.toFixed(3)
+    bot.max_equity = bot.max_equity.toFixed(3)
+    var totalPos= 0;
+    bot.positions.forEach(function(pos) {
+        if(pos.status == "open") {
+            totalPos += pos.amount;
+        }
+
+        pos.connectedOrders.forEach(function(order) {
+            if(order.id.includes("_SL_")) {
+                pos.currentStop= order.stop_price;
+                pos.worstCase= (pos.currentStop - pos.filled_entry)/(pos.wanted_entry-pos.initial_stop);
+            }
+            if(Math.abs(pos.amount) > 10) {
+                pos.initialRisk= pos.amount/pos.initial_stop - pos.amount/pos.wanted_entry;
+            } else {
+                pos.initialRisk= pos.amount*(pos.wanted_entry-pos.initial_stop);
+            }
+        });
+    });
+    bot.totalPos = totalPos;
+    element.innerHTML= Handlebars.templates.openPositions(bot);
+}
+
+function setSnapshot(data) {
+    var old= bots;
+    bots= data;
+    for (let id in old) {
+        if(!bots.hasOwnProperty(id)) {
+            renderBot(id);
+        }
+    }
+    for (let id in bots) {
+        renderBot(id);
+    }
+}
+
+function applyDiff(diff) {
+    var id= diff.bot;
+    if(diff.removed) {
+        delete bots[id];
+    } else if(diff.full) {
+        bots[id]= diff.full;
+    } else {
+        var bot= bots[id];
+        if(!bot) {
+            return;
+        }
+        $.extend(bot, diff.set);
+        for (let posId in diff.positions) {
+            var pos= diff.positions[posId];
+            var idx= bot.positions.findIndex(function(p) { return p.id == posId; });
+            if(pos === null) {
+                if(idx >= 0) {
+                    bot.positions.splice(idx, 1);
                 }
+            } else if(idx >= 0) {
+                bot.positions[idx]= pos;
+            } else {
+                bot.positions.push(pos);
+            }
+        }
+    }
+    renderBot(id);
+}
 
-                pos.connectedOrders.forEach(function(order) {
-                    if(order.id.includes("_SL_")) {
-                        pos.currentStop= order.stop_price;
-                        pos.worstCase= (pos.currentStop - pos.filled_entry)/(pos.wanted_entry-pos.initial_stop);
-                    }
-                    if(Math.abs(pos.amount) > 10) {
-                        pos.initialRisk= pos.amount/pos.initial_stop - pos.amount/pos.wanted_entry;
-                    } else {
-                        pos.initialRisk= pos.amount*(pos.wanted_entry-pos.initial_stop);
-                    }
-                });
-            });
-            bot.totalPos = totalPos;
-            var div= template(bot);
-            container.insertAdjacentHTML('beforeend',div);
+function refresh() {
+    // with ifModified the etag is sent along, unchanged data comes back as 304 without a body
+    $.ajax({url: 'dashboard.json', dataType: 'json', ifModified: true}).done(function(data, status) {
+        if(status === "notmodified" || !data) {
+            return;
         }
+        setSnapshot(data);
     });
-}
\ No newline at end of file
+}
+
+function start() {
+    refresh();
+    if(!window.EventSource) {
+        setInterval(refresh, 10000);
+        return;
+    }
+    // the bot process pushes a snapshot and then only the changes of the bots.
+    // without it (dashboard.json from a plain webserver) we fall back to polling
+    var source= new EventSource('events');
+    source.addEventListener('snapshot', function(e) {
+        setSnapshot(JSON.parse(e.data));
+    });
+    source.addEventListener('diff', function(e) {
+        applyDiff(JSON.parse(e.data));
+    });
+    source.onerror= function() {
+        if(source.readyState === EventSource.CLOSED) {
+            setInterval(refresh, 10000);
+        }
+    };
+}
@@ -2,15 +2,20 @@ import logging
 import math
 import os
 import csv
+from array import array
+
+import numpy as np
 
 import plotly.graph_objects as go
 
-from typing import List
+from typing import List, Iterable
 from datetime import datetime
 
 from kuegi_bot.bots.trading_bot import TradingBot
 from kuegi_bot.utils.trading_classes import OrderInterface, Bar, Account, Order, Symbol, AccountPosition, PositionStatus
-from kuegi_bot.utils import log
+from kuegi_bot.utils import log, plotting
+from kuegi_bot.utils.order_matcher import OrderMatcher
+from kuegi_bot.backtest_result import BacktestMetrics, BacktestResult, trades_to_arrays
 
 class SilentLogger(object):
 
@@ -27,39 +32,76 @@ class SilentLogger(object):
         pass
 
 
+class AbortCriteria:
+    ''' stops a backtest as soon as it is clearly rejected. max_dd and equity_floor are fractions of the initial
+    equity, min_trades closed positions are needed within the first min_trades_days days '''
+
+    def __init__(self, max_dd: float = None, equity_floor: float = None, min_trades: int = None,
+                 min_trades_days: float = None):
+        self.max_dd = max_dd
+        self.equity_floor = equity_floor
+        self.min_trades = min_trades
+        self.min_trades_days = min_trades_days
+
+    def check(self, backtest, first_tstamp, bar: Bar):
+        ''' returns the reason to abort or None '''
+        if self.max_dd is not None and backtest.maxDD > self.max_dd * backtest.initialEquity:
+            return "maxDD %.2f%%" % (100 * backtest.maxDD / backtest.initialEquity)
+        if self.equity_floor is not None and backtest.account.equity < self.equity_floor * backtest.initialEquity:
+            return "equity %.2f%%" % (100 * backtest.account.equity / backtest.initialEquity)
+        if self.min_trades is not None and self.min_trades_days is not None and not backtest.min_trades_checked \
+                and bar.tstamp - first_tstamp >= self.min_trades_days * 60 * 60 * 24:
+            # only once when the mark is reached, later trades can't change the outcome anymore
+            backtest.min_trades_checked = True
+            trades = backtest.closed_trades()
+            if trades < self.min_trades:
+                return "only %i trades after %.0f days" % (trades, self.min_trades_days)
+        return None
+
+
 class BackTest(OrderInterface):
 
-    def __init__(self, bot: TradingBot, bars: list,symbol:Symbol=None,market_slipage_percent= 0.15):
+    def __init__(self, bot: TradingBot, bars: list,symbol:Symbol=None,market_slipage_percent= 0.15,
+                 abort: AbortCriteria = None, profile: bool = False):
         self.bars: List[Bar] = bars
+        self.abort = abort
+        self.aborted = False
+        self.abort_reason = None
         self.logger= bot.logger
         self.bot = bot
         self.bot.prepare(SilentLogger(),self)
 
-        self.market_slipage_percent = market_slipage_percent
-        self.maker_fee = -0.00025
-        self.taker_fee = 0.00075
-
         if symbol is not None:
             self.symbol= symbol
         else:
             self.symbol: Symbol = Symbol(symbol="XBTUSD", isInverse=True, tickSize=0.5, lotSize=1, makerFee=-0.00025,
                                          takerFee=0.00075)
+        self.matcher = OrderMatcher(self.symbol, self.logger, maker_fee=-0.00025, taker_fee=0.00075,
+                                    market_slipage_percent=market_slipage_percent)
 
         self.account: Account = None
         self.initialEquity = 100  # BTC
 
         self.hh = self.initialEquity
         self.maxDD = 0
-        self.max_underwater = 0
-        self.underwater = 0
+        self.max_underwater = 0  # seconds
+        self.underwater_since = None
         self.maxExposure= 0
         self.lastHHPosition = 0
 
         self.current_bars = []
 
+        # with profile the hot paths of bot and backtest are timed and the breakdown is logged at the end of run
+        self.profiler = None
+        if profile:
+            self.profiler = self.bot.enable_profiling()
+            self.profiler.wrap(self, "handle_open_orders", "backtest.handle_open_orders")
+
         self.reset()
 
     def reset(self):
+        if self.profiler is not None:
+            self.profiler.reset()
         self.account = Account()
         self.account.open_position.walletBalance = self.initialEquity
         self.account.open_position.quantity = 0
@@ -69,8 +111,14 @@ class BackTest(OrderInterface):
         self.maxDD = 0
         self.max_underwater = 0
         self.lastHHPosition = 0
-        self.underwater = 0
+        self.underwater_since = None
         self.maxExposure= 0
+        self.aborted = False
+        self.abort_reason = None
+        self.min_trades_checked = False
+        self.equity_tstamps = array('d')  # equity after every bar, oldest first
+        self.equity_values = array('d')
+        self.result: BacktestResult = None
         self.bot.reset()
 
         self.current_bars = []
@@ -113,78 +161,14 @@ class BackTest(OrderInterface):
 
     # ----------
     def handle_order_execution(self, order: Order, intrabar: Bar):
-        amount = order.amount - order.executed_amount
-        order.executed_amount = order.amount
-        fee = self.taker_fee
-        if order.limit_price:
-            price = order.limit_price
-            fee = self.maker_fee
-        elif order.stop_price:
-            price = int(order.stop_price * (1 + math.copysign(self.market_slipage_percent,
-                                                              order.amount) / 100) / self.symbol.tickSize) * self.symbol.tickSize
-        else:
-            price = intrabar.open * (1 + math.copysign(self.market_slipage_percent, order.amount) / 100)
-        price = min(intrabar.high,
-                    max(intrabar.low, price))  # only prices within the bar. might mean less slipage
-        order.executed_price = price
-        self.account.open_position.quantity += amount
-        delta = amount * (price if not self.symbol.isInverse else -1 / price)
-        self.account.open_position.walletBalance -= delta
-        self.account.open_position.walletBalance -= math.fabs(delta) * fee
-
-        order.active = False
-        order.execution_tstamp = intrabar.tstamp
-        order.final_reason = 'executed'
-        self.account.order_history.append(order)
-        self.account.open_orders.remove(order)
-        self.logger.debug(
-            "executed order %s | %.0f %.2f | %.2f@ %.1f" % (
-            order.id, self.account.usd_equity, self.account.open_position.quantity, order.executed_amount,
-            order.executed_price))
+        self.matcher.execute(self.account, order, intrabar)
 
     def handle_open_orders(self, intrabarToCheck: Bar) -> bool:
-        something_changed = False
-        to_execute = []
-        for order in self.account.open_orders:
-            if order.limit_price is None and order.stop_price is None:
-                to_execute.append(order)
-                something_changed = True
-                continue
-
-            if order.stop_price and not order.stop_triggered:
-                if (order.amount > 0 and order.stop_price < intrabarToCheck.high) or (
-                        order.amount < 0 and order.stop_price > intrabarToCheck.low):
-                    order.stop_triggered = True
-                    something_changed = True
-                    if order.limit_price is None:
-                        # execute stop market
-                        to_execute.append(order)
-                    elif ((order.amount > 0 and order.limit_price > intrabarToCheck.close) or (
-                            order.amount < 0 and order.limit_price < intrabarToCheck.close)):
-                        # close below/above limit: got definitly executed
-                        to_execute.append(order)
-
-            else:  # means order.limit_price and (order.stop_price is None or order.stop_triggered):
-                # check for limit execution
-                if (order.amount > 0 and order.limit_price > intrabarToCheck.low) or (
-                        order.amount < 0 and order.limit_price < intrabarToCheck.high):
-                    to_execute.append(order)
-
-        prevPos = self.account.open_position.quantity
-        for order in to_execute:
-            something_changed = True
-            self.handle_order_execution(order, intrabarToCheck)
-
-        # update equity = balance + current value of open position
-        posValue = self.account.open_position.quantity * (
-            intrabarToCheck.close if not self.symbol.isInverse else -1 / intrabarToCheck.close)
-        self.account.equity = self.account.open_position.walletBalance + posValue
-        self.account.usd_equity = self.account.equity * intrabarToCheck.close
-
-        self.update_stats()
+        something_changed = self.matcher.match(self.account, intrabarToCheck)
+        self.update_stats(intrabarToCheck.tstamp)
         return something_changed
 
-    def update_stats(self):
+    def update_stats(self, tstamp):
 
         if math.fabs(self.account.open_position.quantity) < 1 or self.lastHHPosition * self.account.open_position.quantity < 0:
             self.hh = max(self.hh, self.account.equity)  # only update HH on closed positions, no open equity
@@ -195,49 +179,80 @@ class BackTest(OrderInterface):
 
         exposure= abs(self.account.open_position.quantity)* (1/self.current_bars[0].close if self.symbol.isInverse else self.current_bars[0].close)
         self.maxExposure= max(self.maxExposure,exposure)
+        # time since the equity went below the HH, not the number of updates: compact paths have less ticks per bar
         if self.account.equity < self.hh:
-            self.underwater += 1
+            if self.underwater_since is None:
+                self.underwater_since = tstamp
+            self.max_underwater = max(self.max_underwater, tstamp - self.underwater_since)
         else:
-            self.underwater = 0
-        self.max_underwater = max(self.max_underwater, self.underwater)
+            self.underwater_since = None
 
     def run(self):
         self.reset()
         self.logger.info(
             "starting backtest with " + str(len(self.bars)) + " bars and " + str(self.account.equity) + " equity")
+        last_bar = self.bars[0]
         for i in range(len(self.bars)):
             if i == len(self.bars) - 1 or i < self.bot.min_bars_needed():
                 continue  # ignore last bar and first 5
 
             # slice bars. TODO: also slice intrabar to simulate tick
             self.current_bars = self.bars[-(i + 1):]
-            # add one bar with 1 tick on open to show to bot that the old one is closed
-            next_bar = self.bars[-i - 2]
-            forming_bar = Bar(tstamp=next_bar.tstamp, open=next_bar.open, high=next_bar.open,
-                              low=next_bar.open, close=next_bar.open,
-                              volume=0, subbars=[])
-            self.current_bars.insert(0, forming_bar)
-            self.current_bars[0].did_change = True
-            self.current_bars[1].did_change = True
-            # self.bot.on_tick(self.current_bars, self.account)
-            for subbar in reversed(next_bar.subbars):
-                # check open orders & update account
-                self.handle_open_orders(subbar)
-                open= len(self.account.open_orders)
-                forming_bar.add_subbar(subbar)
-                self.bot.on_tick(self.current_bars, self.account)
-                if open != len(self.account.open_orders):
-                    self.handle_open_orders(subbar) # got new ones
-                self.current_bars[1].did_change = False
-
-            next_bar.bot_data = forming_bar.bot_data
-            for b in self.current_bars:
-                b.did_change = False
+            self.process_bar(self.bars[-i - 2])
+            if self.check_abort(self.bars[-1].tstamp, self.bars[-i - 2]):
+                last_bar = self.bars[-i - 2]
+                break
 
+        # without abort last_bar is the one after the last processed bar, so the position is closed on its open.
+        # after an abort it's the bar that was just processed, close on its last tick
+        self.finish(self.bars[-1].tstamp, last_bar, last_bar.subbars[0] if self.aborted else None)
+        return self
+
+    def closed_trades(self) -> int:
+        return len([pos for pos in self.bot.position_history if pos.status == PositionStatus.CLOSED])
+
+    def check_abort(self, first_tstamp, bar: Bar) -> bool:
+        if self.abort is None:
+            return False
+        self.abort_reason = self.abort.check(self, first_tstamp, bar)
+        self.aborted = self.abort_reason is not None
+        return self.aborted
+
+    def process_bar(self, next_bar: Bar):
+        ''' runs the subbars of next_bar through the bot. current_bars must contain the closed bars before '''
+        # add one bar with 1 tick on open to show to bot that the old one is closed
+        forming_bar = Bar(tstamp=next_bar.tstamp, open=next_bar.open, high=next_bar.open,
+                          low=next_bar.open, close=next_bar.open,
+                          volume=0, subbars=[])
+        self.current_bars.insert(0, forming_bar)
+        self.current_bars[0].did_change = True
+        self.current_bars[1].did_change = True
+        # self.bot.on_tick(self.current_bars, self.account)
+        for subbar in reversed(next_bar.subbars):
+            # check open orders & update account
+            self.handle_open_orders(subbar)
+            open= len(self.account.open_orders)
+            forming_bar.add_subbar(subbar)
+            self.bot.on_tick(self.current_bars, self.account)
+            if open != len(self.account.open_orders):
+                self.handle_open_orders(subbar) # got new ones
+            self.current_bars[1].did_change = False
+
+        next_bar.bot_data = forming_bar.bot_data
+        for b in self.current_bars:
+            b.did_change = False
+        self.equity_tstamps.append(next_bar.tstamp)
+        self.equity_values.append(self.account.equity)
+
+    def finish(self, first_tstamp, last_bar: Bar, close_tick: Bar = None):
+        ''' close_tick: where an open position gets closed, defaults to the open of last_bar '''
         if self.account.open_position.quantity != 0:
             self.send_order(Order(orderId="endOfTest", amount=-self.account.open_position.quantity))
-            self.handle_open_orders(self.bars[0].subbars[-1])
+            self.handle_open_orders(close_tick if close_tick is not None else last_bar.subbars[-1])
 
+        metrics = BacktestMetrics(closed_positions=len(self.bot.position_history),
+                                  open_positions=len(self.bot.open_positions),
+                                  aborted=self.aborted)
         if len(self.bot.position_history) > 0:
             daysInPos = 0
             maxDays= 0
@@ -246,48 +261,64 @@ class BackTest(OrderInterface):
                 if pos.status != PositionStatus.CLOSED:
                     continue
                 if pos.exit_tstamp is None:
-                    pos.exit_tstamp = self.bars[0].tstamp
+                    pos.exit_tstamp = last_bar.tstamp
                 daysInPos += pos.daysInPos()
                 maxDays= max(maxDays,pos.daysInPos())
                 minDays= min(minDays,pos.daysInPos())
             daysInPos /= len(self.bot.position_history)
 
             profit = self.account.equity - self.initialEquity
-            uw_updates_per_day = 1440  # every minute
-            total_days= (self.bars[0].tstamp - self.bars[-1].tstamp)/(60*60*24)
+            total_days= (last_bar.tstamp - first_tstamp)/(60*60*24)
             rel= profit / (self.maxDD if self.maxDD > 0 else 1)
             rel_per_year = rel / (total_days/365)
-            self.logger.info("finished | closed pos: " + str(len(self.bot.position_history))
-                        + " | open pos: " + str(len(self.bot.open_positions))
-                        + " | profit: " + ("%.2f" % (100 * profit / self.initialEquity))
-                        + " | HH: " + ("%.2f" % (100 * (self.hh / self.initialEquity - 1)))
-                        + " | maxDD: " + ("%.2f" % (100 * self.maxDD / self.initialEquity))
-                        + " | maxExp: " + ("%.2f" % (self.maxExposure / self.initialEquity))
-                        + " | rel: " + ("%.2f" % (rel_per_year))
-                        + " | UW days: " + ("%.1f" % (self.max_underwater / uw_updates_per_day))
+
+            metrics.profit = 100 * profit / self.initialEquity
+            metrics.hh = 100 * (self.hh / self.initialEquity - 1)
+            metrics.max_dd = 100 * self.maxDD / self.initialEquity
+            metrics.max_exposure = self.maxExposure / self.initialEquity
+            metrics.rel = rel_per_year
+            metrics.uw_days = self.max_underwater / (60 * 60 * 24)
+            metrics.min_pos_days = minDays
+            metrics.avg_pos_days = daysInPos
+            metrics.max_pos_days = maxDays
+            metrics.total_days = total_days
+            self.logger.info(("aborted (" + self.abort_reason + ")" if self.aborted else "finished")
+                        + " | closed pos: " + str(metrics.closed_positions)
+                        + " | open pos: " + str(metrics.open_positions)
+                        + " | profit: " + ("%.2f" % metrics.profit)
+                        + " | HH: " + ("%.2f" % metrics.hh)
+                        + " | maxDD: " + ("%.2f" % metrics.max_dd)
+                        + " | maxExp: " + ("%.2f" % metrics.max_exposure)
+                        + " | rel: " + ("%.2f" % metrics.rel)
+                        + " | UW days: " + ("%.1f" % metrics.uw_days)
                         + " | pos days: " + ("%.1f/%.1f/%.1f" % (minDays,daysInPos,maxDays))
                         )
         else:
-            self.logger.info("finished with no trades")
+            self.logger.info(("aborted (" + self.abort_reason + ")" if self.aborted else "finished")
+                             + " with no trades")
+
+        self.result = BacktestResult(metrics, trades_to_arrays(self.bot.position_history),
+                                     np.array(self.equity_tstamps, dtype=float),
+                                     np.array(self.equity_values, dtype=float))
+        if self.profiler is not None:
+            self.logger.info(self.profiler.report())
 
         #self.write_results_to_files()
-        return self
 
-    def prepare_plot(self):
+    def prepare_plot(self, max_points: int = plotting.MAX_POINTS):
+        ''' chart of the bars with the trades and the bot data. bars and lines are decimated to max_points,
+        None for full resolution '''
         barcenter= (self.bars[0].tstamp - self.bars[1].tstamp)/2
         self.logger.info("running timelines")
         time = list(map(lambda b: datetime.fromtimestamp(b.tstamp+barcenter), self.bars))
-        open = list(map(lambda b: b.open, self.bars))
-        high = list(map(lambda b: b.high, self.bars))
-        low = list(map(lambda b: b.low, self.bars))
-        close = list(map(lambda b: b.close, self.bars))
 
         self.logger.info("creating plot")
-        fig = go.Figure(data=[go.Candlestick(x=time, open=open, high=high, low=low, close=close, name=self.symbol.symbol)])
+        fig = go.Figure(data=[plotting.candlestick(self.bars, self.symbol.symbol, max_points, center=True)])
 
         self.logger.info("adding bot data")
         self.bot.add_to_plot(fig, self.bars, time)
 
+        fig = plotting.decimate_figure(fig, max_points)
         fig.update_layout(xaxis_rangeslider_visible=False)
         return fig
 
@@ -331,3 +362,61 @@ class BackTest(OrderInterface):
                     self.bars[0].close,
                     position.exit_equity
                 ])
+
+
+class StreamingBackTest(BackTest):
+    ''' BackTest on a stream of bars (oldest first, f.e. helper.stream_bars) instead of a list.
+    only the last min_bars_needed + extra_lookback bars are kept (extra_lookback covers what strategies and exit
+    modules look back beyond min_bars_needed) and the processed order history is dropped, so the bars (with their
+    subbars) don't need to fit in memory. what still grows with the length of the test: the closed positions of
+    the bot (needed for the metrics) and the equity per bar (16 bytes per bar in equity_tstamps/equity_values).
+    closed positions and the equity per bar are passed to the callbacks as they happen.
+    an open position is closed on the last tick of the last bar (BackTest closes on the open of the bar after its
+    last processed bar) '''
+
+    def __init__(self, bot: TradingBot, bar_source: Iterable[Bar], symbol: Symbol = None,
+                 market_slipage_percent=0.15, extra_lookback: int = 100, on_position=None, on_equity=None,
+                 abort: AbortCriteria = None, profile: bool = False):
+        self.source = iter(bar_source)
+        self.window = bot.min_bars_needed() + extra_lookback
+        self.on_position = on_position
+        self.on_equity = on_equity
+        self.consumed = False
+        # same start as BackTest: the bot gets the first min_bars_needed bars for init
+        first = []
+        for bar in self.source:
+            first.insert(0, bar)
+            if len(first) > bot.min_bars_needed():
+                break
+        super().__init__(bot, first, symbol, market_slipage_percent, abort, profile)
+
+    def run(self):
+        if self.consumed:
+            self.logger.error("bar stream already consumed, create a new StreamingBackTest")
+            return self
+        self.consumed = True
+        self.logger.info("starting streaming backtest with " + str(self.account.equity) + " equity")
+        first_tstamp = self.bars[-1].tstamp
+        reported = 0
+        for next_bar in self.source:
+            self.current_bars = self.bars[:]
+            self.process_bar(next_bar)
+            self.bars.insert(0, next_bar)
+            del self.bars[self.window:]
+            # the bot has seen these orders already
+            del self.account.order_history[:self.bot.known_order_history]
+            self.bot.known_order_history = 0
+
+            if self.on_position is not None:
+                for position in self.bot.position_history[reported:]:
+                    self.on_position(position)
+            reported = len(self.bot.position_history)
+            if self.on_equity is not None:
+                self.on_equity(next_bar.tstamp, self.account.equity)
+            if self.check_abort(first_tstamp, next_bar):
+                break
+
+        # there is no next bar, close on the last tick of the last processed bar
+        self.finish(first_tstamp, self.bars[0], self.bars[0].subbars[0])
+        return self
+
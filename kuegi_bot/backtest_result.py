@@ -0,0 +1,96 @@
+import os
+from dataclasses import dataclass, asdict, fields
+from typing import List
+
+import numpy as np
+
+from kuegi_bot.utils.trading_classes import Position
+
+
+@dataclass
+class BacktestMetrics:
+    ''' the numbers of the "finished" log line of a backtest. percentages are relative to the initial equity '''
+    closed_positions: int = 0
+    open_positions: int = 0
+    profit: float = 0  # %
+    hh: float = 0  # %
+    max_dd: float = 0  # %
+    max_exposure: float = 0  # times initial equity
+    rel: float = 0  # profit per maxDD and year
+    uw_days: float = 0
+    min_pos_days: float = 0
+    avg_pos_days: float = 0
+    max_pos_days: float = 0
+    total_days: float = 0
+    aborted: bool = False
+
+
+TRADE_COLUMNS = ["signal_tstamp", "entry_tstamp", "exit_tstamp", "amount", "wanted_entry", "initial_stop",
+                 "filled_entry", "filled_exit", "exit_equity"]
+
+
+def trades_to_arrays(positions: List[Position]) -> dict:
+    ''' the positions as columns: one float array per TRADE_COLUMNS entry (missing values are nan) plus id and
+    status as string arrays '''
+    result = {}
+    for column in TRADE_COLUMNS:
+        result[column] = np.array([getattr(pos, column) if getattr(pos, column) is not None else np.nan
+                                   for pos in positions], dtype=float)
+    result["id"] = np.array([pos.id for pos in positions], dtype=str)
+    result["status"] = np.array([pos.status.value for pos in positions], dtype=str)
+    return result
+
+
+class BacktestResult:
+    ''' structured result of a backtest: metrics, the trades as columns and the equity after every bar
+    (oldest first) '''
+
+    def __init__(self, metrics: BacktestMetrics, trades: dict, equity_tstamps: np.ndarray, equity: np.ndarray,
+                 params=None):
+        self.metrics = metrics
+        self.trades = trades
+        self.equity_tstamps = equity_tstamps
+        self.equity = equity
+        self.params = params
+
+
+def save_results(results: List[BacktestResult], filename: str):
+    ''' writes many results at once as columns to one compressed npz: metrics/<name> has one entry per result,
+    trades/<column> and equity/<tstamp|value> are concatenated with the index of the result in */run.
+    params/values holds the params of the results (if all results have params of the same length) '''
+    directory = os.path.dirname(filename)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    columns = {}
+    for field in fields(BacktestMetrics):
+        columns["metrics/" + field.name] = np.array([getattr(r.metrics, field.name) for r in results])
+    for column in TRADE_COLUMNS + ["id", "status"]:
+        parts = [r.trades[column] for r in results]
+        columns["trades/" + column] = np.concatenate(parts) if len(parts) > 0 else np.array([])
+    columns["trades/run"] = np.concatenate([np.full(len(r.trades["id"]), idx) for idx, r in enumerate(results)]) \
+        if len(results) > 0 else np.array([], dtype=int)
+    columns["equity/tstamp"] = np.concatenate([r.equity_tstamps for r in results]) if len(results) > 0 \
+        else np.array([])
+    columns["equity/value"] = np.concatenate([r.equity for r in results]) if len(results) > 0 else np.array([])
+    columns["equity/run"] = np.concatenate([np.full(len(r.equity), idx) for idx, r in enumerate(results)]) \
+        if len(results) > 0 else np.array([], dtype=int)
+    params = [r.params for r in results]
+    if len(params) > 0 and all(p is not None and len(p) == len(params[0]) for p in params):
+        columns["params/values"] = np.array(params, dtype=float)
+    np.savez_compressed(filename, **columns)
+
+
+def load_results(filename: str) -> dict:
+    ''' the columns written by save_results, f.e. table["metrics/rel"] '''
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
+
+
+def rank(table: dict, by: str = "rel", count: int = None) -> np.ndarray:
+    ''' indices of the runs sorted by the metric (best first) '''
+    order = np.argsort(-table["metrics/" + by], kind="stable")
+    return order[:count] if count is not None else order
+
+
+def metrics_to_json(metrics: BacktestMetrics) -> dict:
+    return asdict(metrics)
@@ -0,0 +1,194 @@
+import gc
+import json
+import logging
+import math
+import os
+import random
+import time
+import tracemalloc
+from typing import List
+
+from kuegi_bot.backtest_engine import BackTest
+from kuegi_bot.bots.MultiStrategyBot import MultiStrategyBot
+from kuegi_bot.bots.strategies.SfpStrat import SfpStrategy
+from kuegi_bot.bots.strategies.kuegi_strat import KuegiStrategy
+from kuegi_bot.indicators.indicator import clean_range
+from kuegi_bot.indicators.kuegi_channel import KuegiChannel
+from kuegi_bot.utils import log
+from kuegi_bot.utils.helper import history_bar
+from kuegi_bot.utils.trading_classes import Bar, process_low_tf_bars
+
+# volatility per M1 bar of the regimes and the chance to switch the regime per bar
+VOLATILITY_REGIMES = [0.0004, 0.001, 0.0025]
+REGIME_SWITCH_CHANCE = 1 / 720
+
+STAGES = ["load", "aggregate", "indicator", "clean_range", "backtest"]
+
+
+def synthetic_m1_history(days: float, seed: int = 0, start: int = 1577836800, price: float = 10000) -> List[dict]:
+    ''' deterministic M1 bars in the format of the bybit history files (oldest first): a random walk with 4 ticks
+    per bar whose volatility switches between the regimes at random. the same seed always gives the same bars '''
+    rnd = random.Random(seed)
+    regime = 1
+    result = []
+    for idx in range(int(days * 1440)):
+        if rnd.random() < REGIME_SWITCH_CHANCE:
+            regime = rnd.randrange(len(VOLATILITY_REGIMES))
+        volatility = VOLATILITY_REGIMES[regime]
+        open = price
+        high = low = price
+        for _ in range(4):
+            price *= math.exp(rnd.gauss(0, volatility / 2))
+            high = max(high, price)
+            low = min(low, price)
+        result.append({"open_time": start + idx * 60, "open": round(open, 1), "high": round(high, 1),
+                       "low": round(low, 1), "close": round(price, 1),
+                       "volume": round(rnd.random() * 100 * (regime + 1), 3)})
+    return result
+
+
+def synthetic_m1_bars(days: float, seed: int = 0) -> List[Bar]:
+    ''' the synthetic history as M1 bars, newest first like the input of process_low_tf_bars '''
+    bars = [history_bar(b, 'bybit', 1) for b in synthetic_m1_history(days, seed)]
+    bars.reverse()
+    return bars
+
+
+def benchmark_bot(logger) -> MultiStrategyBot:
+    bot = MultiStrategyBot(logger=logger, directionFilter=0)
+    bot.add_strategy(KuegiStrategy().withChannel(max_look_back=13, threshold_factor=0.8, buffer_factor=0.05,
+                                                 max_dist_factor=2, max_swing_length=3)
+                     .withRM(risk_factor=1, max_risk_mul=2, risk_type=1, atr_factor=2))
+    bot.add_strategy(SfpStrategy().withChannel(max_look_back=13, threshold_factor=0.8, buffer_factor=0.05,
+                                               max_dist_factor=2, max_swing_length=3)
+                     .withRM(risk_factor=1, max_risk_mul=2, risk_type=1, atr_factor=2))
+    return bot
+
+
+class Benchmark:
+    ''' times the stages of a backtest (load -> aggregate -> indicator/clean_range -> backtest) on synthetic data of
+    several history sizes. per stage and size: best time of the repeats, M1 bars per second and the peak memory
+    (measured in an extra run, tracemalloc would distort the times).
+    results can be saved as baseline and compared against it later '''
+
+    def __init__(self, days: List[float] = None, timeframe: int = 240, repeats: int = 3, seed: int = 0,
+                 stages: List[str] = None, memory: bool = True, logger=None):
+        self.days = days if days is not None else [14, 60, 180]
+        self.timeframe = timeframe
+        self.repeats = repeats
+        self.seed = seed
+        self.stages = stages if stages is not None else STAGES
+        self.memory = memory
+        self.logger = logger if logger is not None else log.setup_custom_logger()
+        self.results = {}
+
+    def stage_function(self, stage: str, raw: str, m1_bars: List[Bar]):
+        ''' the work of a stage, everything it needs is prepared before (so only the stage gets measured) '''
+        if stage == "load":
+            return lambda: [history_bar(b, 'bybit', 1) for b in json.loads(raw)]
+        if stage == "aggregate":
+            return lambda: process_low_tf_bars(m1_bars, self.timeframe)
+        if stage == "indicator":
+            def indicator():
+                bars = process_low_tf_bars(m1_bars, self.timeframe)
+                start = time.perf_counter()
+                KuegiChannel(max_look_back=13, threshold_factor=0.8, buffer_factor=0.05, max_dist_factor=2,
+                             max_swing_length=3).on_tick(bars)
+                return time.perf_counter() - start
+            return indicator
+        if stage == "clean_range":
+            def ranges():
+                bars = process_low_tf_bars(m1_bars, self.timeframe)
+                start = time.perf_counter()
+                for idx in range(len(bars) - 20):
+                    clean_range(bars, idx, 20)
+                return time.perf_counter() - start
+            return ranges
+        if stage == "backtest":
+            def backtest():
+                bars = process_low_tf_bars(m1_bars, self.timeframe)
+                bot = benchmark_bot(log.setup_custom_logger("benchmark_bot", log_level=logging.ERROR))
+                start = time.perf_counter()
+                BackTest(bot, bars).run()
+                return time.perf_counter() - start
+            return backtest
+        raise ValueError("unknown benchmark stage " + stage)
+
+    def measure(self, function, repeats: int):
+        ''' best time of the repeats. functions that prepare their own input return the time of the real work '''
+        best = None
+        for _ in range(repeats):
+            gc.collect()
+            start = time.perf_counter()
+            inner = function()
+            duration = time.perf_counter() - start
+            if isinstance(inner, float):
+                duration = inner
+            best = duration if best is None else min(best, duration)
+        return best
+
+    @staticmethod
+    def peak_memory(function) -> float:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function()
+            return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        finally:
+            tracemalloc.stop()
+
+    def run(self):
+        for days in self.days:
+            history = synthetic_m1_history(days, self.seed)
+            raw = json.dumps(history)
+            del history
+            m1_bars = [history_bar(b, 'bybit', 1) for b in json.loads(raw)]
+            m1_bars.reverse()
+            for stage in self.stages:
+                function = self.stage_function(stage, raw, m1_bars)
+                seconds = self.measure(function, self.repeats)
+                result = {"seconds": seconds,
+                          "bars_per_second": len(m1_bars) / seconds if seconds > 0 else 0,
+                          "peak_mb": self.peak_memory(function) if self.memory else None}
+                self.results[Benchmark.key(stage, days)] = result
+                self.logger.info("%-12s %5gd: %8.3fs | %10.0f M1 bars/s | peak: %s" %
+                                 (stage, days, seconds, result["bars_per_second"],
+                                  ("%.1f MB" % result["peak_mb"]) if result["peak_mb"] is not None else "-"))
+        return self
+
+    @staticmethod
+    def key(stage: str, days: float) -> str:
+        return "%s@%gd" % (stage, days)
+
+    def save_baseline(self, filename: str):
+        directory = os.path.dirname(filename)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, 'w') as file:
+            json.dump({"seed": self.seed, "timeframe": self.timeframe, "results": self.results}, file, indent=4)
+
+    def compare(self, filename: str, tolerance: float = 0.2, min_seconds: float = 0.005) -> List[str]:
+        ''' the regressions against the baseline: stages that got more than tolerance slower or need more than
+        tolerance more memory. slowdowns below min_seconds are noise, stages missing in the baseline are ignored '''
+        with open(filename) as file:
+            baseline = json.load(file)
+        if baseline.get("seed") != self.seed or baseline.get("timeframe") != self.timeframe:
+            self.logger.warn("baseline was measured with other data (seed/timeframe), comparing anyway")
+        regressions = []
+        for key, result in self.results.items():
+            base = baseline["results"].get(key)
+            if base is None:
+                continue
+            change = result["seconds"] / base["seconds"] - 1 if base["seconds"] > 0 else 0
+            line = "%-20s %8.3fs vs %8.3fs (%+.0f%%)" % (key, result["seconds"], base["seconds"], 100 * change)
+            if change > tolerance and result["seconds"] - base["seconds"] > min_seconds:
+                regressions.append(key + " got slower: " + line)
+            if result["peak_mb"] is not None and base.get("peak_mb") is not None and base["peak_mb"] > 0:
+                memChange = result["peak_mb"] / base["peak_mb"] - 1
+                line += " | peak %.1f vs %.1f MB (%+.0f%%)" % (result["peak_mb"], base["peak_mb"], 100 * memChange)
+                if memChange > tolerance:
+                    regressions.append(key + " needs more memory: " + line)
+            self.logger.info(line)
+        for regression in regressions:
+            self.logger.warn("REGRESSION " + regression)
+        return regressions
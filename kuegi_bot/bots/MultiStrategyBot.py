@@ -5,6 +5,7 @@ import plotly.graph_objects as go
 from kuegi_bot.bots.trading_bot import TradingBot
 from kuegi_bot.utils.trading_classes import Position,  Account, Bar, Symbol
 from kuegi_bot.utils.telegram import TelegramBot
+from kuegi_bot.utils.profiling import Profiler
 from typing import List
 
 
@@ -116,6 +117,13 @@ class MultiStrategyBot(TradingBot):
     def min_bars_needed(self):
         return reduce(lambda x, y: max(x, y.min_bars_needed()), self.strategies, 5)
 
+    def enable_profiling(self, profiler: Profiler = None) -> Profiler:
+        profiler = super().enable_profiling(profiler)
+        for strat in self.strategies:
+            for method in ["prep_bars", "open_orders", "manage_open_order", "manage_open_position"]:
+                profiler.wrap(strat, method, strat.myId() + "." + method)
+        return profiler
+
     def prep_bars(self, bars: list):
         newbar= self.is_new_bar
         if not self.got_data_for_position_sync(bars):
@@ -154,11 +162,11 @@ class MultiStrategyBot(TradingBot):
                                             self.open_positions)
                     break
 
-        for order in to_cancel:
-            self.order_interface.cancel_order(order)
+        if len(to_cancel) > 0:
+            self.order_interface.cancel_orders(to_cancel)
 
-        for order in to_update:
-            self.order_interface.update_order(order)
+        if len(to_update) > 0:
+            self.order_interface.update_orders(to_update)
 
         pos_ids_to_cancel = []
         for p in self.open_positions.values():
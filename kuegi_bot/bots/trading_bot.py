@@ -1,19 +1,24 @@
 import time
 
 from kuegi_bot.bots.strategies.exit_modules import ExitModule
+from kuegi_bot.indicators.indicator import Indicator
 from kuegi_bot.utils.trading_classes import Bar, Position, Symbol, OrderInterface, Account, OrderType, Order, \
     PositionStatus
+from kuegi_bot.backtest_result import trades_to_arrays
+from kuegi_bot.utils.performance_stats import performance_stats
+from kuegi_bot.utils import plotting
+from kuegi_bot.utils.position_journal import PositionJournal, read_journal
+from kuegi_bot.utils.profiling import Profiler
+from kuegi_bot.utils.state_store import StateStore
 
 import plotly.graph_objects as go
 
+from copy import copy
 from typing import List
 from datetime import datetime
 from random import randint
 from enum import Enum
 
-import os
-import json
-import csv
 
 
 class PositionDirection(Enum):
@@ -21,7 +26,34 @@ class PositionDirection(Enum):
     SHORT = "short"
 
 
+def find_indicators(obj, found: list = None, visited: set = None) -> List[Indicator]:
+    ''' all indicators reachable from obj (the bot, its strategies, their modules, ...) '''
+    if found is None:
+        found = []
+        visited = set()
+    if id(obj) in visited or isinstance(obj, (Bar, Position, Order, Account, OrderInterface)):
+        return found
+    visited.add(id(obj))
+    if isinstance(obj, Indicator):
+        found.append(obj)
+    if isinstance(obj, dict):
+        children = list(obj.values())
+    elif isinstance(obj, (list, tuple)):
+        children = obj
+    elif hasattr(obj, "__dict__") and type(obj).__module__.startswith("kuegi_bot"):
+        children = list(vars(obj).values())
+    else:
+        children = []
+    for child in children:
+        find_indicators(child, found, visited)
+    return found
+
+
 class TradingBot:
+    PROFILED_METHODS = ["on_tick", "prep_bars", "manage_open_orders", "open_orders", "sync_executions",
+                        "sync_positions_with_open_orders", "save_open_positions", "read_open_positions",
+                        "position_closed"]
+
     def __init__(self, logger, directionFilter: int = 0):
         self.myId = "GenericBot"
         self.logger = logger
@@ -38,6 +70,10 @@ class TradingBot:
         self.max_equity= 0
         self.time_of_max_equity= 0
         self.position_history: List[Position] = []
+        self.state_version = 0  # increased whenever the state got saved, f.e. for the dashboard
+        self.journal: PositionJournal = None
+        self.state_store: StateStore = None
+        self.profiler: Profiler = None
         self.reset()
 
     def uid(self) -> str:
@@ -50,6 +86,16 @@ class TradingBot:
     def min_bars_needed(self):
         return 5
 
+    def enable_profiling(self, profiler: Profiler = None) -> Profiler:
+        ''' times the hot paths of the bot and the on_tick of its indicators. without this call nothing is measured '''
+        if self.profiler is None:
+            self.profiler = profiler if profiler is not None else Profiler()
+        for method in TradingBot.PROFILED_METHODS:
+            self.profiler.wrap(self, method)
+        for indicator in find_indicators(self):
+            self.profiler.wrap(indicator, "on_tick", "indicator " + type(indicator).__name__ + ".on_tick")
+        return self.profiler
+
     def reset(self):
         self.last_time = 0
         self.open_positions = {}
@@ -59,6 +105,9 @@ class TradingBot:
     def _get_pos_file(self):
         return self.symbol.symbol + "_" + self.unique_id + ".json" if self.unique_id is not None else None
 
+    def _get_journal_file(self):
+        return 'positionHistory/' + self.symbol.symbol + "_" + self.unique_id + ".journal"
+
     def init(self, bars: List[Bar], account: Account, symbol: Symbol, unique_id: str = ""):
         '''init open position etc.'''
         self.symbol = symbol
@@ -395,57 +444,53 @@ class TradingBot:
     #####################################################
 
     def save_open_positions(self, bars:List[Bar]):
+        self.state_version += 1
         if self.unique_id is None:
             return
-        base = 'openPositions/'
-        try:
-            os.makedirs(base)
-        except Exception:
-            pass
-        with open(base + self._get_pos_file(), 'w') as file:
-            pos_json = []
-            for pos in self.open_positions:
-                pos_json.append(self.open_positions[pos].to_json())
-            moduleData = {}
-            for idx in range(5):
-                moduleData[bars[idx].tstamp]=ExitModule.get_data_for_json(bars[idx])
-
-            data = {"last_time": self.last_time,
-                    "last_tick": str(self.last_tick_time),
-                    "positions": pos_json,
-                    "moduleData":moduleData,
-                    "risk_reference":self.risk_reference,
-                    "max_equity":self.max_equity,
-                    "time_of_max_equity":self.time_of_max_equity}
-            json.dump(data, file, sort_keys=False, indent=4)
-
+        pos_json = []
+        for pos in self.open_positions:
+            pos_json.append(self.open_positions[pos].to_json())
+        moduleData = {}
+        for idx in range(5):
+            moduleData[bars[idx].tstamp]=ExitModule.get_data_for_json(bars[idx])
+
+        data = {"last_time": self.last_time,
+                "last_tick": str(self.last_tick_time),
+                "positions": pos_json,
+                "moduleData":moduleData,
+                "risk_reference":self.risk_reference,
+                "max_equity":self.max_equity,
+                "time_of_max_equity":self.time_of_max_equity}
+        self._get_state_store().save(data)
+
+    def _get_state_store(self) -> StateStore:
+        if self.state_store is None:
+            self.state_store = StateStore('openPositions/' + self._get_pos_file())
+        return self.state_store
 
     def read_open_positions(self,bars: List[Bar]):
         if self.unique_id is not None:
-            base = 'openPositions/'
-            try:
-                os.makedirs(base)
-            except Exception:
-                pass
             try:
-                with open(base + self._get_pos_file(), 'r') as file:
-                    data = json.load(file)
-                    self.last_time = data["last_time"]
-                    if "max_equity" in data.keys():
-                        self.max_equity= data["max_equity"]
-                        self.time_of_max_equity= data["time_of_max_equity"]
-                    for pos_json in data["positions"]:
-                        pos: Position = Position.from_json(pos_json)
-                        self.open_positions[pos.id] = pos
-                    if "moduleData" in data.keys():
-                        for idx in range(5):
-                            if str(bars[idx].tstamp) in data["moduleData"].keys():
-                                moduleData = data['moduleData'][str(bars[idx].tstamp)]
-                                ExitModule.set_data_from_json(bars[idx], moduleData)
-
-                    self.logger.info("done loading " + str(
-                        len(self.open_positions)) + " positions from " + self._get_pos_file() + " last time " + str(
-                        self.last_time))
+                data = self._get_state_store().load()
+                if data is None:
+                    self.logger.info("no saved positions in " + self._get_pos_file())
+                    return
+                self.last_time = data["last_time"]
+                if "max_equity" in data.keys():
+                    self.max_equity= data["max_equity"]
+                    self.time_of_max_equity= data["time_of_max_equity"]
+                for pos_json in data["positions"]:
+                    pos: Position = Position.from_json(pos_json)
+                    self.open_positions[pos.id] = pos
+                if "moduleData" in data.keys():
+                    for idx in range(5):
+                        if str(bars[idx].tstamp) in data["moduleData"].keys():
+                            moduleData = data['moduleData'][str(bars[idx].tstamp)]
+                            ExitModule.set_data_from_json(bars[idx], moduleData)
+
+                self.logger.info("done loading " + str(
+                    len(self.open_positions)) + " positions from " + self._get_pos_file() + " last time " + str(
+                    self.last_time))
             except Exception as e:
                 self.logger.warn("Error loading open positions: " + str(e))
                 self.open_positions = {}
@@ -457,8 +502,8 @@ class TradingBot:
             if self.position_id_from_order_id(order.id) == positionId:
                 to_cancel.append(order)
 
-        for o in to_cancel:
-            self.order_interface.cancel_order(o)
+        if len(to_cancel) > 0:
+            self.order_interface.cancel_orders(to_cancel)
 
     def position_closed(self, position: Position, account: Account):
         if position.exit_tstamp == 0:
@@ -472,35 +517,20 @@ class TradingBot:
 
         if self.unique_id is None:
             return
-        base = 'positionHistory/'
-        filename = base + self._get_pos_file()
-        size = 0
-        try:
-            os.makedirs(base)
-        except Exception:
-            pass
-        try:
-            size = os.path.getsize(filename)
-        except Exception:
-            pass
-        with open(filename, 'a') as file:
-            writer = csv.writer(file)
-            if size == 0:
-                csv_columns = ['signalTStamp', 'size', 'wantedEntry', 'initialStop', 'openTime', 'openPrice',
-                               'closeTime',
-                               'closePrice', 'equityOnExit']
-                writer.writerow(csv_columns)
-            writer.writerow([
-                datetime.fromtimestamp(position.signal_tstamp).isoformat(),
-                position.amount,
-                position.wanted_entry,
-                position.initial_stop,
-                datetime.fromtimestamp(position.entry_tstamp).isoformat(),
-                position.filled_entry,
-                datetime.fromtimestamp(position.exit_tstamp).isoformat(),
-                position.filled_exit,
-                position.exit_equity
-            ])
+        if self.journal is None:
+            self.journal = PositionJournal(self._get_journal_file(), self.logger)
+        self.journal.append(position)
+
+    def load_position_history(self, start: float = None, end: float = None) -> dict:
+        ''' the journaled positions (closed between start and end) as arrays per column '''
+        return read_journal(self._get_journal_file(), start, end)
+
+    def close(self):
+        ''' writes what is left in the position journal and a last snapshot of the state '''
+        if self.journal is not None:
+            self.journal.close()
+        if self.state_store is not None:
+            self.state_store.close()
 
     def on_tick(self, bars: List[Bar], account: Account):
         """checks price and levels to manage current orders and set new ones"""
@@ -546,18 +576,6 @@ class TradingBot:
 
     def create_performance_plot(self,bars:List[Bar]):
         self.logger.info("preparing stats")
-        stats = {
-            "dd": 0,
-            "maxDD": 0,
-            "hh": 1,
-            "underwaterDays": 0,
-            "percWin": 0,
-            "avgResult": 0,
-            "tradesInRange": 0,
-            "maxWinner": 0,
-            "maxLoser": 0
-        }
-
         yaxis = {
             "equity": 'y1',
             "dd": 'y2',
@@ -571,79 +589,28 @@ class TradingBot:
             "maxLoser": 'y4'
         }
 
-        months_in_range = 1
-        alpha = 0.3
-        firstPos = self.position_history[0]
-        if firstPos.status != PositionStatus.CLOSED:
-            for pos in self.position_history:
-                if pos.status == PositionStatus.CLOSED:
-                    firstPos= pos
-                    break
-        lastHHTstamp = firstPos.signal_tstamp
-        startEquity = firstPos.exit_equity - firstPos.amount * (1 / firstPos.filled_entry - 1 / firstPos.filled_exit)
-
-        stats_range = []
-        # temporarily add filled exit to have position in the result
+        # open positions are shown with their result at the current close
+        actual_history = []
         for pos in self.position_history:
             if pos.status == PositionStatus.OPEN:
-                pos.filled_exit= bars[0].close
-
-        actual_history = list(
-            filter(lambda p1: p1.filled_entry is not None and p1.filled_exit is not None, self.position_history))
-        for pos in actual_history:
-            # update range
-            stats_range.append(pos)
-            range_start = pos.exit_tstamp - months_in_range * 30 * 60 * 60 * 60
-            while stats_range[0].exit_tstamp < range_start:
-                stats_range.pop(0)
-
-            avg = 0.0
-            stats['tradesInRange'] = alpha * len(stats_range) + stats['tradesInRange'] * (1 - alpha)
-            winners = 0.0
-            maxWinner = 0
-            maxLoser = 0
-            for p in stats_range:
-                # BEWARE: assumes inverse swap
-                result = p.amount / p.filled_entry - p.amount / p.filled_exit
-                maxLoser = min(result, maxLoser)
-                maxWinner = max(result, maxWinner)
-                avg += result / len(stats_range)
-                if result > 0:
-                    winners += 1.0
-
-            stats['percWin'] = alpha * (100.0 * winners / len(stats_range)) + stats['percWin'] * (1 - alpha)
-            stats['avgResult'] = alpha * avg + stats['avgResult'] * (1 - alpha)
-            stats['maxWinner'] = alpha * maxWinner + stats['maxWinner'] * (1 - alpha)
-            stats['maxLoser'] = alpha * (-maxLoser) + stats['maxLoser'] * (1 - alpha)
-
-            if stats['hh'] < pos.exit_equity:
-                stats['hh'] = pos.exit_equity
-                lastHHTstamp = pos.exit_tstamp
-
-            stats['underwaterDays'] = (pos.exit_tstamp - lastHHTstamp) / (60 * 60 * 24)
-            dd = stats['hh'] - pos.exit_equity
-            if dd > stats['maxDD']:
-                stats['maxDD'] = dd
-            stats['dd'] = dd
-            stats['equity'] = pos.exit_equity
-
-            pos.stats = stats.copy()
-            pos.stats['equity'] = pos.exit_equity - startEquity
-            pos.stats['hh'] = pos.stats['hh'] - startEquity
+                pos = copy(pos)
+                pos.filled_exit = bars[0].close
+            if pos.filled_entry is not None and pos.filled_exit is not None:
+                actual_history.append(pos)
+        trades = trades_to_arrays(actual_history)
+        is_inverse = self.symbol.isInverse if self.symbol is not None else True
+        stats = performance_stats(trades, is_inverse=is_inverse)
 
         self.logger.info("creating equityline")
         time = list(map(lambda p1: datetime.fromtimestamp(p1.exit_tstamp), actual_history))
 
-        # undo temporarily filled exit
-        for pos in self.position_history:
-            if pos.status == PositionStatus.OPEN:
-                pos.filled_exit= None
-
         data = []
         for key in yaxis.keys():
-            sub_data = list(map(lambda p1: p1.stats[key], actual_history))
+            last = stats[key][-1]
+            if key in ["equity", "hh"]:
+                last += trades["exit_equity"][0] - stats["equity"][0]  # absolute value in the name
             data.append(
-                go.Scatter(x=time, y=sub_data, mode='lines', yaxis=yaxis[key], name=key + ":" + "%.1f" % (stats[key])))
+                go.Scatter(x=time, y=stats[key], mode='lines', yaxis=yaxis[key], name=key + ":" + "%.1f" % last))
 
         layout = go.Layout(
             xaxis=dict(
@@ -654,7 +621,7 @@ class TradingBot:
             ),
             yaxis2=dict(
                 domain=[0.4, 1],
-                range=[0, 2 * stats['maxDD']],
+                range=[0, 2 * stats['maxDD'][-1]],
                 overlaying='y',
                 side='right'
             ),
@@ -688,50 +655,4 @@ class TradingBot:
 
     def add_to_plot(self, fig, bars, time):
         self.logger.info("adding trades")
-        # trades
-
-        for pos in self.open_positions.values():
-            if pos.status == PositionStatus.OPEN:
-                fig.add_shape(go.layout.Shape(
-                    type="line",
-                    x0=datetime.fromtimestamp(pos.entry_tstamp),
-                    y0=pos.filled_entry,
-                    x1=datetime.fromtimestamp(bars[0].tstamp),
-                    y1=bars[0].close,
-                    line=dict(
-                        color="Green" if pos.amount > 0 else "Red",
-                        width=2,
-                        dash="dash"
-                    )
-                ))
-
-        for pos in self.position_history:
-            if pos.status == PositionStatus.CLOSED:
-                fig.add_shape(go.layout.Shape(
-                    type="line",
-                    x0=datetime.fromtimestamp(pos.entry_tstamp),
-                    y0=pos.filled_entry,
-                    x1=datetime.fromtimestamp(pos.exit_tstamp),
-                    y1=pos.filled_exit,
-                    line=dict(
-                        color="Green" if pos.amount > 0 else "Red",
-                        width=2,
-                        dash="solid"
-                    )
-                ))
-
-            if pos.status == PositionStatus.MISSED:
-                fig.add_shape(go.layout.Shape(
-                    type="line",
-                    x0=datetime.fromtimestamp(pos.signal_tstamp),
-                    y0=pos.wanted_entry,
-                    x1=datetime.fromtimestamp(pos.exit_tstamp),
-                    y1=pos.wanted_entry,
-                    line=dict(
-                        color="Blue",
-                        width=1,
-                        dash="dot"
-                    )
-                ))
-
-        fig.update_shapes(dict(xref='x', yref='y'))
+        plotting.add_trades(fig, list(self.open_positions.values()), self.position_history, bars)
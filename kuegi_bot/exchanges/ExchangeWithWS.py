@@ -5,7 +5,9 @@ import math
 import websocket
 from time import sleep
 
-from kuegi_bot.utils.trading_classes import Order, Account, Bar, ExchangeInterface, process_low_tf_bars
+from kuegi_bot.utils import metrics
+from kuegi_bot.utils.session_recording import open_websocket
+from kuegi_bot.utils.trading_classes import Order, Account, Bar, BarBuffer, ExchangeInterface, process_low_tf_bars
 
 
 class KuegiWebsocket(object):
@@ -22,6 +24,7 @@ class KuegiWebsocket(object):
         self.api_key = api_key
         self.api_secret = api_secret
 
+        self.url = wsURL
         self.exited = False
         self.auth = False
         # We can subscribe right in the connection querystring, so let's build that.
@@ -37,12 +40,12 @@ class KuegiWebsocket(object):
         """Connect to the websocket in a thread."""
         self.logger.debug("Starting thread")
 
-        self.ws = websocket.WebSocketApp(wsURL,
-                                         on_message=self.on_message,
-                                         on_close=self.__on_close,
-                                         on_open=self.__on_open,
-                                         on_error=self.on_error,
-                                         keep_running=True)
+        self.ws = open_websocket(wsURL,
+                                 on_message=self.on_message,
+                                 on_close=self.__on_close,
+                                 on_open=self.__on_open,
+                                 on_error=self.on_error,
+                                 keep_running=True)
 
         self.wst = threading.Thread(target=lambda: self.ws.run_forever(ping_interval=5))
         self.wst.daemon = True
@@ -85,6 +88,9 @@ class KuegiWebsocket(object):
     def __on_close(self):
         """Called on websocket close."""
         self.logger.info('Websocket Closed')
+        if not self.exited:
+            metrics.get_registry().counter("kuegi_ws_disconnects_total", "websockets closed unexpectedly",
+                                           ["url"]).inc(url=self.url)
         self.exit()
 
     def exit(self):
@@ -94,6 +100,8 @@ class KuegiWebsocket(object):
 
 
 class ExchangeWithWS(ExchangeInterface):
+    # number of bars (in MINUTES_PER_BAR) kept from the websocket if KLINE_RETENTION_BARS is not set
+    DEFAULT_KLINE_RETENTION_BARS = 200
 
     def __init__(self, settings, logger, ws: KuegiWebsocket, on_tick_callback=None):
         super().__init__(settings, logger, on_tick_callback)
@@ -103,7 +111,7 @@ class ExchangeWithWS(ExchangeInterface):
 
         self.orders = {}
         self.positions = {}
-        self.bars: List[Bar] = []
+        self.bars: BarBuffer = self.create_bar_buffer(settings)
         self.last = 0
         self.symbol_info = self.get_instrument()
         self.init()
@@ -130,6 +138,20 @@ class ExchangeWithWS(ExchangeInterface):
             self.exit()
             raise Exception('Error！Couldn not auth the WebSocket!.')
 
+    @staticmethod
+    def subbar_minutes(settings) -> int:
+        return 1 if settings.MINUTES_PER_BAR <= 60 else 60
+
+    @staticmethod
+    def create_bar_buffer(settings) -> BarBuffer:
+        retention = settings.KLINE_RETENTION_BARS
+        if retention is None or retention <= 0:
+            retention = ExchangeWithWS.DEFAULT_KLINE_RETENTION_BARS
+        subbar_minutes = ExchangeWithWS.subbar_minutes(settings)
+        subbars_per_bar = math.ceil(settings.MINUTES_PER_BAR / subbar_minutes)
+        # +1 bar cause the current one is still forming
+        return BarBuffer(capacity=subbars_per_bar * (retention + 1), resolution_minutes=subbar_minutes)
+
     def normalizePrice(self, price, roundUp):
         if price is None:
             return None
@@ -165,13 +187,14 @@ class ExchangeWithWS(ExchangeInterface):
         pass
 
     def exit(self):
+        super().exit()
         self.ws.exit()
 
     def get_orders(self) -> List[Order]:
         return list(self.orders.values())
 
     def recent_bars(self, timeframe_minutes, start_offset_minutes) -> List[Bar]:
-        return self._aggregate_bars(self.bars, timeframe_minutes, start_offset_minutes)
+        return process_low_tf_bars(self.bars.newest_first(), timeframe_minutes, start_offset_minutes)
 
     def _aggregate_bars(self, bars: List[Bar], timeframe_minutes, start_offset_minutes) -> List[Bar]:
         """ bars need to be ordered newest bar = index 0 """
@@ -4,16 +4,20 @@ from typing import List
 
 import binance_f
 from binance_f import RequestClient
+from binance_f.exception.binanceapiexception import BinanceApiException
 from binance_f.model import OrderSide, OrderType, TimeInForce, CandlestickInterval, SubscribeMessageType
 from binance_f.model.accountupdate import Balance, Position
 from binance_f.model.candlestickevent import Candlestick
 
+from kuegi_bot.exchanges.ExchangeWithWS import ExchangeWithWS
 from kuegi_bot.exchanges.binance.binance_websocket import BinanceWebsocket
 from kuegi_bot.utils.trading_classes import ExchangeInterface, Order, Bar, Account, AccountPosition, \
-    process_low_tf_bars, Symbol
+    process_low_tf_bars, Symbol, BarBuffer
 
 
 class BinanceInterface(ExchangeInterface):
+    # batch cancel takes up to 10 orders
+    MAX_BATCH_SIZE = 10
 
     def __init__(self, settings, logger, on_tick_callback=None):
         super().__init__(settings, logger, on_tick_callback)
@@ -29,9 +33,10 @@ class BinanceInterface(ExchangeInterface):
         # for binance the key is the internal id (not the exchange id) cause we can't update order but have to cancel
         # and reopen with same id. that leads to different exchange id, but we need to know its the same.
         self.orders = {}
+        self.canceled_for_update = set()  # ids of orders an update canceled but didn't resend yet
         self.positions = {}
         self.symbol_object: Symbol = None
-        self.candles: List[Candlestick] = []
+        self.candles: BarBuffer = ExchangeWithWS.create_bar_buffer(settings)
         self.last = 0
         self.listen_key = ""
         self.lastUserDataKeep = None
@@ -78,20 +83,10 @@ class BinanceInterface(ExchangeInterface):
                 # 'data': <binance_f.model.candlestickevent.Candlestick object at 0x0000016B89856760>}
                 if event.symbol == self.symbol:
                     candle: Candlestick = event.data
-                    if len(self.candles) > 0:
-                        if self.candles[0].startTime >= candle.startTime > self.candles[-1].startTime:
-                            # somewhere inbetween to replace
-                            for idx in range(0, len(self.candles)):
-                                if candle.startTime == self.candles[idx].startTime:
-                                    self.candles[idx] = candle
-                                    break
-                        elif candle.startTime > self.candles[0].startTime:
-                            self.candles.insert(0, candle)
-                            gotTick = True
-                    else:
-                        self.candles.append(candle)
+                    # fixes known bars in place, bars older than the retention are ignored
+                    if self.candles.upsert(self.convertBarevent(candle)):
                         gotTick = True
-                    self.last = self.candles[0].close
+                    self.last = self.candles.newest().close
             elif event.eventType == "ACCOUNT_UPDATE":
                 # {'eventType': 'ACCOUNT_UPDATE', 'eventTime': 1587063874367, 'transactionTime': 1587063874365,
                 # 'balances': [<binance_f.model.accountupdate.Balance object at 0x000001FAF470E100>,...],
@@ -209,13 +204,14 @@ class BinanceInterface(ExchangeInterface):
                                                                    self.positions[self.symbol].avgEntryPrice))
 
     def exit(self):
+        super().exit()
         self.ws.exit()
         self.client.close_user_data_stream()
 
     def internal_cancel_order(self, order: Order):
+        self.client.cancel_order(symbol=self.symbol, origClientOrderId=order.id)
         if order.id in self.orders.keys():
             self.orders[order.id].active = False
-        self.client.cancel_order(symbol=self.symbol, origClientOrderId=order.id)
 
     def internal_send_order(self, order: Order):
         if order.stop_price is not None and (self.last - order.stop_price)*order.amount >= 0:
@@ -250,11 +246,40 @@ class BinanceInterface(ExchangeInterface):
             newClientOrderId=order.id)
         order.exchange_id = resultOrder.orderId
 
-    def internal_update_order(self, order: Order):
-        self.cancel_order(order)  # stupid binance can't update orders
-        self.on_tick_callback(True)  # triggers a reset of the tick-delay.
-        # otherwise we risk a tick to be calced after the cancel, before the new order
-        self.send_order(order)
+    def internal_cancel_orders(self, orders: List[Order]):
+        self.client.cancel_list_orders(symbol=self.symbol, origClientOrderIdList=[order.id for order in orders])
+        for order in orders:
+            if order.id in self.orders.keys():
+                self.orders[order.id].active = False
+
+    def _is_open(self, orderId: str) -> bool:
+        return orderId in self.orders.keys() and self.orders[orderId].active
+
+    def _update_idempotent(self, orders: List[Order], attempt: int):
+        # stupid binance can't update orders: cancel and resend. a retry continues where the last attempt failed:
+        # orders that got canceled already are not canceled again and a resend that reached the exchange is not
+        # sent twice
+        ids = set([order.id for order in orders])
+        if attempt == 1:
+            self.canceled_for_update -= ids
+        toCancel = [order for order in orders if order.id not in self.canceled_for_update and self._is_open(order.id)]
+        try:
+            if len(toCancel) == 1:
+                self.internal_cancel_order(toCancel[0])
+            elif len(toCancel) > 1:
+                self.internal_cancel_orders(toCancel)
+        except BinanceApiException as e:
+            if "-2011" not in str(e.error_message):  # unknown order: it is gone already
+                raise e
+            self.logger.info("orders to update are already gone on the exchange: %s" % str(e.error_message))
+            for order in toCancel:
+                if order.id in self.orders.keys():
+                    self.orders[order.id].active = False
+        self.canceled_for_update |= set([order.id for order in toCancel])
+        # canceled orders are inactive, an open one with the same id is the resend of a former attempt
+        resent = set([orderId for orderId in self.canceled_for_update & ids if self._is_open(orderId)])
+        self._send_idempotent(orders, attempt, resent)
+        self.canceled_for_update -= ids
 
     def get_orders(self) -> List[Order]:
         return list(self.orders.values())
@@ -270,10 +295,7 @@ class BinanceInterface(ExchangeInterface):
         return process_low_tf_bars(subbars, timeframe_minutes, start_offset_minutes)
 
     def recent_bars(self, timeframe_minutes, start_offset_minutes) -> List[Bar]:
-        subbars = []
-        for b in self.candles:
-            subbars.append(self.convertBarevent(b))
-        return process_low_tf_bars(subbars, timeframe_minutes, start_offset_minutes)
+        return process_low_tf_bars(self.candles.newest_first(), timeframe_minutes, start_offset_minutes)
 
     @staticmethod
     def convertBar(apiBar: binance_f.model.candlestick.Candlestick):
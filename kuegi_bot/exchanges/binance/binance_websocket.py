@@ -7,15 +7,20 @@ import websocket
 from binance_f.impl.utils import JsonWrapper
 from binance_f.model import SubscribeMessageType, AccountUpdate, OrderUpdate, ListenKeyExpired, CandlestickEvent
 
+from kuegi_bot.exchanges.message_router import MessageRouter
+from kuegi_bot.utils.session_recording import open_websocket
+
 
 def get_current_timestamp():
     return int(round(time.time() * 1000))
 
 
-def parse_json_from_string(value):
-    value = value.replace("False", "false")
-    value = value.replace("True", "true")
-    return JsonWrapper(json.loads(value))
+def topic_of(message):
+    if ("status" in message and message["status"] != "ok") or message.get("err-code", 0) != 0:
+        return "error"
+    if "result" in message and "id" in message:
+        return "response"
+    return message.get("e")
 
 
 class BinanceWebsocket:
@@ -34,6 +39,13 @@ class BinanceWebsocket:
         self.api_secret = api_secret
 
         self.exited = False
+        # payload event type -> parser of the binance_f model
+        self.router = MessageRouter(logger, topic_of=topic_of, source=wsURL)
+        self.router.register("error", self.__on_error_reply)
+        self.router.register("response", lambda message: self.__forward(SubscribeMessageType.RESPONSE, message["id"]))
+        for event, model in [("ACCOUNT_UPDATE", AccountUpdate), ("ORDER_TRADE_UPDATE", OrderUpdate),
+                             ("listenKeyExpired", ListenKeyExpired), ("kline", CandlestickEvent)]:
+            self.router.register(event, self.__payload_handler(model))
         # We can subscribe right in the connection querystring, so let's build that.
         # Subscribe to all pertinent endpoints
         self.logger.info("Connecting to %s" % wsURL)
@@ -52,12 +64,12 @@ class BinanceWebsocket:
         """Connect to the websocket in a thread."""
         self.logger.debug("Starting thread")
 
-        self.ws = websocket.WebSocketApp(wsURL,
-                                         on_message=self.__on_message,
-                                         on_close=self.__on_close,
-                                         on_open=self.__on_open,
-                                         on_error=self.__on_error,
-                                         keep_running=True)
+        self.ws = open_websocket(wsURL,
+                                 on_message=self.__on_message,
+                                 on_close=self.__on_close,
+                                 on_open=self.__on_open,
+                                 on_error=self.__on_error,
+                                 keep_running=True)
 
         self.wst = threading.Thread(target=lambda: self.ws.run_forever())
         self.wst.daemon = True
@@ -75,35 +87,21 @@ class BinanceWebsocket:
 
     def __on_message(self, message):
         """Handler for parsing WS messages."""
-        wrapper = parse_json_from_string(message)
-        # parse wrapper based on type
-        responseType = None
-        result = None
-        if wrapper.contain_key("status") and wrapper.get_string("status") != "ok":
-            error_code = wrapper.get_string_or_default("err-code", "Unknown error")
-            error_msg = wrapper.get_string_or_default("err-msg", "Unknown error")
-            self.__on_error(error_code + ": " + error_msg)
-        elif wrapper.contain_key("err-code") and wrapper.get_int("err-code") != 0:
-            error_code = wrapper.get_string_or_default("err-code", "Unknown error")
-            error_msg = wrapper.get_string_or_default("err-msg", "Unknown error")
-            self.__on_error(error_code + ": " + error_msg)
-        elif wrapper.contain_key("result") and wrapper.contain_key("id"):
-            responseType = SubscribeMessageType.RESPONSE
-            result = wrapper.get_int("id")
-        else:
-            responseType = SubscribeMessageType.PAYLOAD
-            if wrapper.get_string("e") == "ACCOUNT_UPDATE":
-                result = AccountUpdate.json_parse(wrapper)
-            elif wrapper.get_string("e") == "ORDER_TRADE_UPDATE":
-                result = OrderUpdate.json_parse(wrapper)
-            elif wrapper.get_string("e") == "listenKeyExpired":
-                result = ListenKeyExpired.json_parse(wrapper)
-            elif wrapper.get_string("e") == "kline":
-                result = CandlestickEvent.json_parse(wrapper)
+        self.router.route(message)
+
+    def __payload_handler(self, model):
+        return lambda message: self.__forward(SubscribeMessageType.PAYLOAD, model.json_parse(JsonWrapper(message)))
 
+    def __forward(self, responseType, result):
         if self.callback is not None and result is not None:
             self.callback(responseType, result)
 
+    def __on_error_reply(self, message):
+        wrapper = JsonWrapper(message)
+        error_code = wrapper.get_string_or_default("err-code", "Unknown error")
+        error_msg = wrapper.get_string_or_default("err-msg", "Unknown error")
+        self.__on_error(error_code + ": " + error_msg)
+
     def __on_error(self, error):
         """Called on fatal websocket errors. We exit on these."""
         if not self.exited:
@@ -8,8 +8,10 @@ import base64
 import uuid
 from kuegi_bot.exchanges.bitmex.auth import APIKeyAuthWithExpires
 from kuegi_bot.utils import constants, errors
+from kuegi_bot.utils.http_transport import HttpTransport, get_transport
 from kuegi_bot.exchanges.bitmex.ws.ws_thread import BitMEXWebsocket
 from kuegi_bot.utils.trading_classes import Order
+from typing import List
 
 
 # https://www.bitmex.com/api/explorer/
@@ -17,7 +19,7 @@ class BitMEX(object):
     """BitMEX API Connector."""
 
     def __init__(self,logger,settings, symbol=None, apiKey=None, apiSecret=None,
-                  shouldWSAuth=True, postOnly=False, timeout=7,socketCallback= None):
+                  shouldWSAuth=True, postOnly=False, timeout=7,socketCallback= None, transport: HttpTransport = None):
         """Init connector."""
         self.logger = logger
         base_url= "https://testnet.bitmex.com/api/v1/"
@@ -33,12 +35,10 @@ class BitMEX(object):
         self.apiSecret = apiSecret
         self.retries = 0  # initialize counter
 
-        # Prepare HTTPS session
-        self.session = requests.Session()
-        # These headers are always sent
-        self.session.headers.update({'user-agent': 'kuegi-bot-'})
-        self.session.headers.update({'content-type': 'application/json'})
-        self.session.headers.update({'accept': 'application/json'})
+        # pooled keep-alive sessions are shared with the other clients, so headers are sent per request
+        self.transport = transport if transport is not None else get_transport()
+        self.headers = {'content-type': 'application/json',
+                        'accept': 'application/json'}
 
         # Create websocket for streaming data
         self.ws = BitMEXWebsocket(settings=settings,logger=logger,callback=socketCallback)
@@ -143,7 +143,8 @@ class BitMEX(object):
     def create_bulk_orders(self, orders):
         """Create multiple orders."""
         for order in orders:
-            order['clOrdID'] = self.orderIDPrefix + base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
+            if 'clOrdID' not in order or order['clOrdID'] is None:
+                order['clOrdID'] = base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
             order['symbol'] = self.symbol
             if self.postOnly:
                 order['execInst'] = 'ParticipateDoNotInitiate'
@@ -209,9 +210,8 @@ class BitMEX(object):
         try:
             if not silent:
                 self.logger.info("sending req %s to %s: %s" % (verb, url, json.dumps(postdict or query or '')))
-            req = requests.Request(verb, url, json=postdict, auth=auth, params=query)
-            prepped = self.session.prepare_request(req)
-            response = self.session.send(prepped, timeout=timeout)
+            response = self.transport.request(verb, url, endpoint=path, timeout=timeout, json=postdict, auth=auth,
+                                              params=query, headers=self.headers)
             # Make non-200s throw
             response.raise_for_status()
 
@@ -231,7 +231,7 @@ class BitMEX(object):
             # 404, can be thrown if order canceled or does not exist.
             elif response.status_code == 404:
                 if verb == 'DELETE':
-                    self.logger.error("Order not found: %s" % postdict['orderID'])
+                    self.logger.error("Order not found: %s" % json.dumps(postdict))
                     return
                 self.logger.error("Unable to contact the BitMEX API (404). " +
                                   "Request: %s \n %s" % (url, json.dumps(postdict)))
@@ -305,8 +305,24 @@ class BitMEX(object):
     @authentication_required
     def place_order(self, order: Order):
         """Place an order."""
+        return self._curl_bitmex(path="order", postdict=self._order_to_postdict(order), verb="POST")
 
-        endpoint = "order"
+    @authentication_required
+    def place_orders(self, orders: List[Order]):
+        """Place multiple orders in one request."""
+        return self.create_bulk_orders([self._order_to_postdict(order) for order in orders])
+
+    @authentication_required
+    def update_orders(self, orders: List[Order]):
+        """update multiple orders in one request."""
+        return self.amend_bulk_orders([self._amend_postdict(order) for order in orders])
+
+    @authentication_required
+    def cancel_orders(self, orderIDs: List[str]):
+        """Cancel multiple orders in one request."""
+        return self._curl_bitmex(path="order", postdict={'clOrdID': orderIDs}, verb="DELETE")
+
+    def _order_to_postdict(self, order: Order):
         execInst= None
         type= 'Limit'
         if order.limit_price is not None:
@@ -322,7 +338,7 @@ class BitMEX(object):
             else:
                 type= 'Market'
 
-        postdict = {
+        return {
             'symbol': self.symbol,
             'orderQty': order.amount,
             'price': order.limit_price,
@@ -331,20 +347,20 @@ class BitMEX(object):
             'clOrdID': order.id,
             'ordType': type
         }
-        return self._curl_bitmex(path=endpoint, postdict=postdict, verb="POST")
-
-    @authentication_required
-    def update_order(self, order: Order):
-        """update an order."""
 
-        endpoint = "order"
-        postdict = {
+    @staticmethod
+    def _amend_postdict(order: Order):
+        return {
             'orderQty': order.amount,
             'price': order.limit_price,
             'stopPx': order.stop_price,
             'origClOrdID': order.id
         }
-        return self._curl_bitmex(path=endpoint, postdict=postdict, verb="PUT")
+
+    @authentication_required
+    def update_order(self, order: Order):
+        """update an order."""
+        return self._curl_bitmex(path="order", postdict=self._amend_postdict(order), verb="PUT")
 
 
     @authentication_required
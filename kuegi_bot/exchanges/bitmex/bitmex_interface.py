@@ -9,6 +9,8 @@ from kuegi_bot.utils.trading_classes import Order, Account, Bar, ExchangeInterfa
 
 
 class BitmexInterface(ExchangeInterface):
+    MAX_BATCH_SIZE = 10
+
     def __init__(self,settings,logger,on_tick_callback=None):
         super().__init__(settings,logger,on_tick_callback)
         self.symbol = settings.SYMBOL
@@ -29,6 +31,7 @@ class BitmexInterface(ExchangeInterface):
             self.h1Bars.append(self.barDictToBar(b,60))
 
     def exit(self):
+        super().exit()
         self.bitmex.exit()
 
     def internal_cancel_order(self, order:Order):
@@ -40,6 +43,15 @@ class BitmexInterface(ExchangeInterface):
     def internal_update_order(self, order:Order):
         self.bitmex.update_order(order)
 
+    def internal_cancel_orders(self, orders: List[Order]):
+        self.bitmex.cancel_orders([order.id for order in orders])
+
+    def internal_send_orders(self, orders: List[Order]):
+        self.bitmex.place_orders(orders)
+
+    def internal_update_orders(self, orders: List[Order]):
+        self.bitmex.update_orders(orders)
+
     def get_orders(self) -> List[Order]:
         mexOrders= self.bitmex.open_orders()
         result :List[Order]= []
@@ -1,4 +1,3 @@
-import websocket
 import threading
 import traceback
 import ssl
@@ -6,7 +5,10 @@ from time import sleep
 import json
 import decimal
 import logging
+from collections import OrderedDict
 from kuegi_bot.exchanges.bitmex.auth import generate_expires, generate_signature
+from kuegi_bot.exchanges.message_router import MessageRouter
+from kuegi_bot.utils.session_recording import open_websocket
 from kuegi_bot.utils.math import toNearest
 from future.utils import iteritems
 from future.standard_library import hooks
@@ -14,6 +16,91 @@ with hooks():  # Python 2/3 compat
     from urllib.parse import urlparse, urlunparse
 
 
+class WSTable:
+    '''rows of one websocket table, indexed by the tuple of the table's key fields (sent with the partial).
+    rows are kept in insertion order, so the oldest ones can be evicted in O(1) once the table exceeds maxLen.
+    tables without keys (f.e. trade) get a running number as key.
+    if keepOpen is set, only rows for which keepOpen(row) is false get evicted (so open orders are never lost)'''
+
+    def __init__(self, maxLen=None, keepOpen=None):
+        self.keys = []
+        self.maxLen = maxLen
+        self.keepOpen = keepOpen
+        self.rows = OrderedDict()
+        self.evictable = OrderedDict()  # keys of rows that may get evicted, oldest first
+        self.nextId = 0
+
+    def key_of(self, data):
+        if len(self.keys) == 0:
+            self.nextId += 1
+            return self.nextId
+        return tuple(data[key] for key in self.keys)
+
+    def insert(self, rows):
+        for row in rows:
+            key = self.key_of(row)
+            self.rows[key] = row
+            self.__mark(key, row)
+        self.__evict()
+
+    def find(self, data):
+        if len(self.keys) == 0:
+            return None
+        return self.rows.get(self.key_of(data))
+
+    def update(self, data):
+        item = self.find(data)
+        if item is not None:
+            item.update(data)
+            self.__mark(self.key_of(data), item)
+            self.__evict()
+        return item
+
+    def delete(self, data):
+        if len(self.keys) == 0:
+            return None
+        key = self.key_of(data)
+        self.evictable.pop(key, None)
+        return self.rows.pop(key, None)
+
+    def values(self):
+        return list(self.rows.values())
+
+    def clear(self):
+        self.rows = OrderedDict()
+        self.evictable = OrderedDict()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __mark(self, key, row):
+        if self.keepOpen is None or not self.keepOpen(row):
+            self.evictable[key] = True
+        else:
+            self.evictable.pop(key, None)
+
+    def __evict(self):
+        if self.maxLen is None:
+            return
+        while len(self.rows) > self.maxLen and len(self.evictable) > 0:
+            key, _ = self.evictable.popitem(last=False)
+            self.rows.pop(key, None)
+
+
+def topic_of(message):
+    if 'subscribe' in message:
+        return "subscribe"
+    if 'status' in message:
+        return "status"
+    if 'action' in message:
+        return message.get('table')
+    return None
+
+
+def is_open_order(order):
+    return order.get('ordStatus') not in ['Filled', 'Canceled', 'Rejected']
+
+
 # Connects to BitMEX websocket for streaming realtime data.
 # The Marketmaker still interacts with this as if it were a REST Endpoint, but now it can get
 # much more realtime data without heavily polling the API.
@@ -71,7 +158,7 @@ class BitMEXWebsocket():
     # Data methods
     #
     def get_instrument(self, symbol):
-        instruments = self.data['instrument']
+        instruments = self.data['instrument'].values()
         matchingInstruments = [i for i in instruments if i['symbol'] == symbol]
         if len(matchingInstruments) == 0:
             raise Exception("Unable to find instrument or index with symbol: " + symbol)
@@ -105,17 +192,17 @@ class BitMEXWebsocket():
         return {k: toNearest(float(v or 0), instrument['tickSize']) for k, v in iteritems(ticker)}
 
     def funds(self):
-        return self.data['margin'][0]
+        return self.data['margin'].values()[0]
 
     def market_depth(self, symbol):
         raise NotImplementedError('orderBook is not subscribed; use askPrice and bidPrice on instrument')
         # return self.data['orderBook25'][0]
 
     def open_orders(self):
-        return self.data['order']
+        return self.data['order'].values()
 
     def position(self, symbol):
-        positions = self.data['position']
+        positions = self.data['position'].values()
         pos = [p for p in positions if p['symbol'] == symbol]
         if len(pos) == 0:
             # No position found; stub it
@@ -123,12 +210,13 @@ class BitMEXWebsocket():
         return pos[0]
 
     def recent_trades_and_clear(self):
-        result= self.data['trade']
-        self.data['trade']= []
+        table= self.data['trade']
+        result= table.values()
+        table.clear()
         return result
 
     def recent_H1_bars(self):
-        return self.data['tradeBin1h']
+        return self.data['tradeBin1h'].values()
 
     #
     # Lifecycle methods
@@ -150,15 +238,16 @@ class BitMEXWebsocket():
         '''Connect to the websocket in a thread.'''
         self.logger.debug("Starting thread")
 
+        self.router.source = wsURL
         ssl_defaults = ssl.get_default_verify_paths()
         sslopt_ca_certs = {'ca_certs': ssl_defaults.cafile}
-        self.ws = websocket.WebSocketApp(wsURL,
-                                         on_message=self.__on_message,
-                                         on_close=self.__on_close,
-                                         on_open=self.__on_open,
-                                         on_error=self.__on_error,
-                                         header=self.__get_auth()
-                                         )
+        self.ws = open_websocket(wsURL,
+                                 on_message=self.__on_message,
+                                 on_close=self.__on_close,
+                                 on_open=self.__on_open,
+                                 on_error=self.__on_error,
+                                 header=self.__get_auth()
+                                 )
 
         self.wst = threading.Thread(target=lambda: self.ws.run_forever(sslopt=sslopt_ca_certs))
         self.wst.daemon = True
@@ -208,86 +297,80 @@ class BitMEXWebsocket():
 
     def __on_message(self, message):
         '''Handler for parsing WS messages.'''
-        message = json.loads(message)
-        self.logger.debug(json.dumps(message))
-
-        table = message['table'] if 'table' in message else None
-        action = message['action'] if 'action' in message else None
+        self.logger.debug(message)
         try:
-            if 'subscribe' in message:
-                if message['success']:
-                    self.logger.debug("Subscribed to %s." % message['subscribe'])
-                else:
-                    self.error("Unable to subscribe to %s. Error: \"%s\" Please check and restart." %
-                               (message['request']['args'][0], message['error']))
-            elif 'status' in message:
-                if message['status'] == 400:
-                    self.error(message['error'])
-                if message['status'] == 401:
-                    self.error("API Key incorrect, please check and restart.")
-            elif action:
-
-                if table not in self.data:
-                    self.data[table] = []
-
-                if table not in self.keys:
-                    self.keys[table] = []
-
-                # There are four possible actions from the WS:
-                # 'partial' - full table image
-                # 'insert'  - new row
-                # 'update'  - update row
-                # 'delete'  - delete row
-                if action == 'partial':
-                    self.logger.debug("%s: partial" % table)
-                    self.data[table] += message['data']
-                    # Keys are communicated on partials to let you know how to uniquely identify
-                    # an item. We use it for updates.
-                    self.keys[table] = message['keys']
-                elif action == 'insert':
-                    self.logger.debug('%s: inserting %s' % (table, message['data']))
-                    self.data[table] += message['data']
-
-                    # Limit the max length of the table to avoid excessive memory usage.
-                    # Don't trim orders because we'll lose valuable state if we do.
-                    if table not in ['order', 'orderBookL2'] and len(self.data[table]) > BitMEXWebsocket.MAX_TABLE_LEN:
-                        self.data[table] = self.data[table][(BitMEXWebsocket.MAX_TABLE_LEN // 2):]
-
-                elif action == 'update':
-                    self.logger.debug('%s: updating %s' % (table, message['data']))
-                    # Locate the item in the collection and update it.
-                    for updateData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], updateData)
-                        if not item:
-                            continue  # No item found to update. Could happen before push
-
-                        # Log executions
-                        if table == 'order':
-                            is_canceled = 'ordStatus' in updateData and updateData['ordStatus'] == 'Canceled'
-                            if 'cumQty' in updateData and not is_canceled:
-                                contExecuted = updateData['cumQty'] - item['cumQty']
-                                if contExecuted > 0 and item['price'] is not None:
-                                    instrument = self.get_instrument(item['symbol'])
-                                    self.logger.info("Execution: %s %d Contracts of %s at %.*f" %
-                                             (item['side'], contExecuted, item['symbol'],
-                                              instrument['tickLog'], item['price']))
-
-                        # Update this item.
-                        item.update(updateData)
-
-                elif action == 'delete':
-                    self.logger.debug('%s: deleting %s' % (table, message['data']))
-                    # Locate the item in the collection and remove it.
-                    for deleteData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], deleteData)
-                        self.data[table].remove(item)
-                else:
-                    raise Exception("Unknown action: %s" % action)
-                if self.callback is not None:
-                    self.callback(table)
+            self.router.route(message)
         except:
             self.logger.error(traceback.format_exc())
 
+    def __on_subscribe(self, message):
+        if message['success']:
+            self.logger.debug("Subscribed to %s." % message['subscribe'])
+        else:
+            self.error("Unable to subscribe to %s. Error: \"%s\" Please check and restart." %
+                       (message['request']['args'][0], message['error']))
+
+    def __on_status(self, message):
+        if message['status'] == 400:
+            self.error(message['error'])
+        if message['status'] == 401:
+            self.error("API Key incorrect, please check and restart.")
+
+    def __on_table(self, message):
+        table = message.get('table')
+        action = message.get('action')
+        if not action:
+            return  # f.e. the welcome info
+        if table not in self.data:
+            self.data[table] = self.__create_table(table)
+        data = self.data[table]
+
+        # There are four possible actions from the WS:
+        # 'partial' - full table image
+        # 'insert'  - new row
+        # 'update'  - update row
+        # 'delete'  - delete row
+        if action == 'partial':
+            self.logger.debug("%s: partial" % table)
+            # Keys are communicated on partials to let you know how to uniquely identify
+            # an item. We use it for updates.
+            data.keys = message['keys']
+            data.insert(message['data'])
+        elif action == 'insert':
+            self.logger.debug('%s: inserting %s' % (table, message['data']))
+            data.insert(message['data'])
+
+        elif action == 'update':
+            self.logger.debug('%s: updating %s' % (table, message['data']))
+            # Locate the item in the collection and update it.
+            for updateData in message['data']:
+                item = data.find(updateData)
+                if not item:
+                    continue  # No item found to update. Could happen before push
+
+                # Log executions
+                if table == 'order':
+                    is_canceled = 'ordStatus' in updateData and updateData['ordStatus'] == 'Canceled'
+                    if 'cumQty' in updateData and not is_canceled:
+                        contExecuted = updateData['cumQty'] - item['cumQty']
+                        if contExecuted > 0 and item['price'] is not None:
+                            instrument = self.get_instrument(item['symbol'])
+                            self.logger.info("Execution: %s %d Contracts of %s at %.*f" %
+                                     (item['side'], contExecuted, item['symbol'],
+                                      instrument['tickLog'], item['price']))
+
+                # Update this item.
+                data.update(updateData)
+
+        elif action == 'delete':
+            self.logger.debug('%s: deleting %s' % (table, message['data']))
+            for deleteData in message['data']:
+                data.delete(deleteData)
+        else:
+            raise Exception("Unknown action: %s" % action)
+        if self.callback is not None:
+            self.callback(table)
+
     def __on_open(self):
         self.logger.debug("Websocket Opened.")
 
@@ -299,22 +382,26 @@ class BitMEXWebsocket():
         if not self.exited:
             self.error(error)
 
+    def __create_table(self, table):
+        # Limit the max length of the tables to avoid excessive memory usage.
+        # Don't drop open orders because we'll lose valuable state if we do.
+        if table == 'order':
+            return WSTable(maxLen=BitMEXWebsocket.MAX_TABLE_LEN, keepOpen=is_open_order)
+        elif table == 'orderBookL2':
+            return WSTable()
+        else:
+            return WSTable(maxLen=BitMEXWebsocket.MAX_TABLE_LEN)
+
     def __reset(self):
         self.data = {}
-        self.keys = {}
+        self.router = MessageRouter(self.logger, topic_of=topic_of)
+        self.router.register("subscribe", self.__on_subscribe)
+        self.router.register("status", self.__on_status)
+        self.router.register_fallback(self.__on_table)
         self.exited = False
         self._error = None
 
 
-def findItemByKeys(keys, table, matchData):
-    for item in table:
-        matched = True
-        for key in keys:
-            if item[key] != matchData[key]:
-                matched = False
-        if matched:
-            return item
-
 if __name__ == "__main__":
     # create console handler and set level to debug
     logger = logging.getLogger()
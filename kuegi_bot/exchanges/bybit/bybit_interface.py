@@ -1,3 +1,4 @@
+import time
 from datetime import datetime
 
 from typing import List
@@ -6,6 +7,7 @@ import bybit
 from bravado.http_future import HttpFuture
 
 from kuegi_bot.exchanges.bybit.bybit_websocket import BybitWebsocket
+from kuegi_bot.utils.http_transport import get_transport
 from kuegi_bot.utils.trading_classes import Order, Bar, TickerData, AccountPosition, \
     Symbol, process_low_tf_bars, parse_utc_timestamp
 from ..ExchangeWithWS import ExchangeWithWS
@@ -17,6 +19,20 @@ class ByBitInterface(ExchangeWithWS):
         self.bybit = bybit.bybit(test=settings.IS_TEST,
                                  api_key=settings.API_KEY,
                                  api_secret=settings.API_SECRET)
+        # bravado brings its own session, at least give it the pooled adapters. timing is recorded in _execute
+        self.transport = get_transport()
+        http_client = getattr(self.bybit.swagger_spec, 'http_client', None)
+        if http_client is not None and getattr(http_client, 'session', None) is not None:
+            self.transport.adopt_session(http_client.session)
+        # topic (or the part before the first ".") -> handler(topic, msgs), returns True if it was a new tick
+        self.topic_handlers = {
+            'order': self.on_order_msgs,
+            'stop_order': self.on_order_msgs,
+            'execution': self.on_execution_msgs,
+            'position': self.on_position_msgs,
+            'klineV2': self.on_kline_msgs,
+            'instrument_info': self.on_instrument_msgs
+        }
         host = "wss://stream-testnet.bybit.com/realtime" if settings.IS_TEST else "wss://stream.bybit.com/realtime"
         super().__init__(settings, logger,
                          ws=BybitWebsocket(wsURL=host,
@@ -181,121 +197,136 @@ class ByBitInterface(ExchangeWithWS):
 
     def socket_callback(self, topic):
         try:
+            handler = self.topic_handlers.get(topic)
+            if handler is None:
+                handler = self.topic_handlers.get(topic.split('.', 1)[0])
+            if handler is None:
+                self.logger.error('got unkown topic in callback: ' + topic)
+                return
             gotTick = False
             msgs = self.ws.get_data(topic)
             while len(msgs) > 0:
-                if topic == 'order' or topic == 'stop_order':
-                    # {'order_id': '96319991-c6ac-4ad5-bdf8-a5a79b624951', 'order_link_id': '', 'symbol': 'BTCUSD',
-                    # 'side': 'Buy', 'order_type': 'Limit', 'price': '7325.5', 'qty': 1, 'time_in_force':
-                    # 'GoodTillCancel', 'order_status': 'Filled', 'leaves_qty': 0, 'cum_exec_qty': 1,
-                    # 'cum_exec_value': '0.00013684', 'cum_exec_fee': '0.00000011', 'timestamp':
-                    # '2019-12-26T20:02:19.576Z', 'take_profit': '0', 'stop_loss': '0', 'trailing_stop': '0',
-                    # 'last_exec_price': '7307.5'}
-                    for o in msgs:
-                        if o['symbol'] != self.symbol:
-                            continue  # ignore orders not of my symbol
-                        order = self.orderDictToOrder(o)
-                        prev: Order = self.orders[
-                            order.exchange_id] if order.exchange_id in self.orders.keys() else None
-                        if prev is not None:
-                            if prev.tstamp > order.tstamp or abs(prev.executed_amount) > abs(order.executed_amount):
-                                # already got newer information, probably the info of the stop order getting
-                                # triggered, when i already got the info about execution
-                                self.logger.info("ignoring delayed update for %s " % prev.id)
-                                continue
-                            # ws removes stop price when executed
-                            if order.stop_price is None:
-                                order.stop_price = prev.stop_price
-                            if order.limit_price is None:
-                                order.limit_price = prev.limit_price
-                        prev = order
-                        if not prev.active and prev.execution_tstamp == 0:
-                            prev.execution_tstamp = datetime.utcnow().timestamp()
-                        self.orders[order.exchange_id] = prev
-
-                        self.logger.info("received order update: %s" % (str(order)))
-                elif topic == 'execution':
-                    # {'symbol': 'BTCUSD', 'side': 'Buy', 'order_id': '96319991-c6ac-4ad5-bdf8-a5a79b624951',
-                    # 'exec_id': '22add7a8-bb15-585f-b068-3a8648f6baff', 'order_link_id': '', 'price': '7307.5',
-                    # 'order_qty': 1, 'exec_type': 'Trade', 'exec_qty': 1, 'exec_fee': '0.00000011', 'leaves_qty': 0,
-                    # 'is_maker': False, 'trade_time': '2019-12-26T20:02:19.576Z'}
-                    for execution in msgs:
-                        if execution['order_id'] in self.orders.keys():
-                            sideMulti = 1 if execution['side'] == "Buy" else -1
-                            order = self.orders[execution['order_id']]
-                            order.executed_amount = (execution['order_qty'] - execution['leaves_qty']) * sideMulti
-                            if (order.executed_amount - order.amount) * sideMulti >= 0:
-                                order.active = False
-                            self.logger.info("got order execution: %s %.1f @ %.1f " % (
-                                execution['order_link_id'], execution['exec_qty'] * sideMulti,
-                                float(execution['price'])))
-
-                elif topic == 'position':
-                    # {'user_id': 712961, 'symbol': 'BTCUSD', 'size': 1, 'side': 'Buy', 'position_value':
-                    # '0.00013684', 'entry_price': '7307.80473546', 'liq_price': '6674', 'bust_price': '6643.5',
-                    # 'leverage': '10', 'order_margin': '0', 'position_margin': '0.00001369', 'available_balance':
-                    # '0.17655005', 'take_profit': '0', 'stop_loss': '0', 'realised_pnl': '-0.00000011',
-                    # 'trailing_stop': '0', 'wallet_balance': '0.17656386', 'risk_id': 1, 'occ_closing_fee':
-                    # '0.00000012', 'occ_funding_fee': '0', 'auto_add_margin': 0, 'cum_realised_pnl': '0.00175533',
-                    # 'position_status': 'Normal', 'position_seq': 505770784}
-                    for pos in msgs:
-                        sizefac = -1 if pos["side"] == "Sell" else 1
-                        if pos['symbol'] == self.symbol and \
-                                self.positions[pos['symbol']].quantity != pos["size"] * sizefac:
-                            self.logger.info("position changed %.2f -> %.2f" % (
-                                self.positions[pos['symbol']].quantity, pos["size"] * sizefac))
-                        if pos['symbol'] not in self.positions.keys():
-                            self.positions[pos['symbol']] = AccountPosition(pos['symbol'],
-                                                                            avgEntryPrice=float(pos["entry_price"]),
-                                                                            quantity=pos["size"] * sizefac,
-                                                                            walletBalance=float(pos['wallet_balance']))
-                        else:
-                            accountPos = self.positions[pos['symbol']]
-                            accountPos.quantity = pos["size"] * sizefac
-                            accountPos.avgEntryPrice = float(pos["entry_price"])
-                            accountPos.walletBalance = float(pos['wallet_balance'])
-                elif topic.startswith('klineV2.') and topic.endswith('.' + self.symbol):
-                    msgs.sort(key=lambda temp: temp['start'], reverse=True)
-                    if len(self.bars) > 0:
-                        for b in reversed(msgs):
-                            if self.bars[0]['start'] >= b['start'] >= self.bars[-1]['start']:
-                                # find bar to fix
-                                for idx in range(0, len(self.bars)):
-                                    if b['start'] == self.bars[idx]['start']:
-                                        self.bars[idx] = b
-                                        break
-                            elif b['start'] > self.bars[0]['start']:
-                                self.bars.insert(0, b)
-                                gotTick = True
-                            # ignore old bars
-                    else:
-                        self.bars = msgs
-                        gotTick = True
-
-                elif topic == 'instrument_info.100ms.' + self.symbol:
-                    obj = msgs
-                    if 'update' in obj.keys():
-                        obj = obj['update'][0]
-                    if obj['symbol'] == self.symbol and 'last_price_e4' in obj.keys():
-                        self.last = obj['last_price_e4'] / 10000
-                else:
-                    self.logger.error('got unkown topic in callback: ' + topic)
+                if handler(topic, msgs):
+                    gotTick = True
                 msgs = self.ws.get_data(topic)
 
             # new bars is handling directly in the messagecause we get a new one on each tick
-            if topic in ["order", "stop_order", "execution"]:
-                gotTick = True
-            if gotTick and self.on_tick_callback is not None:
-                self.on_tick_callback(
-                    fromAccountAction=topic in ["order", "stop_order", "execution"])  # got something new
+            fromAccountAction = topic in ["order", "stop_order", "execution"]
+            if (gotTick or fromAccountAction) and self.on_tick_callback is not None:
+                self.on_tick_callback(fromAccountAction=fromAccountAction)  # got something new
         except Exception as e:
             self.logger.error("error in socket data(%s): %s " % (topic, str(e)))
 
+    def on_order_msgs(self, topic, msgs):
+        # {'order_id': '96319991-c6ac-4ad5-bdf8-a5a79b624951', 'order_link_id': '', 'symbol': 'BTCUSD',
+        # 'side': 'Buy', 'order_type': 'Limit', 'price': '7325.5', 'qty': 1, 'time_in_force':
+        # 'GoodTillCancel', 'order_status': 'Filled', 'leaves_qty': 0, 'cum_exec_qty': 1,
+        # 'cum_exec_value': '0.00013684', 'cum_exec_fee': '0.00000011', 'timestamp':
+        # '2019-12-26T20:02:19.576Z', 'take_profit': '0', 'stop_loss': '0', 'trailing_stop': '0',
+        # 'last_exec_price': '7307.5'}
+        for o in msgs:
+            if o['symbol'] != self.symbol:
+                continue  # ignore orders not of my symbol
+            order = self.orderDictToOrder(o)
+            prev: Order = self.orders[
+                order.exchange_id] if order.exchange_id in self.orders.keys() else None
+            if prev is not None:
+                if prev.tstamp > order.tstamp or abs(prev.executed_amount) > abs(order.executed_amount):
+                    # already got newer information, probably the info of the stop order getting
+                    # triggered, when i already got the info about execution
+                    self.logger.info("ignoring delayed update for %s " % prev.id)
+                    continue
+                # ws removes stop price when executed
+                if order.stop_price is None:
+                    order.stop_price = prev.stop_price
+                if order.limit_price is None:
+                    order.limit_price = prev.limit_price
+            prev = order
+            if not prev.active and prev.execution_tstamp == 0:
+                prev.execution_tstamp = datetime.utcnow().timestamp()
+            self.orders[order.exchange_id] = prev
+
+            self.logger.info("received order update: %s" % (str(order)))
+        return False
+
+    def on_execution_msgs(self, topic, msgs):
+        # {'symbol': 'BTCUSD', 'side': 'Buy', 'order_id': '96319991-c6ac-4ad5-bdf8-a5a79b624951',
+        # 'exec_id': '22add7a8-bb15-585f-b068-3a8648f6baff', 'order_link_id': '', 'price': '7307.5',
+        # 'order_qty': 1, 'exec_type': 'Trade', 'exec_qty': 1, 'exec_fee': '0.00000011', 'leaves_qty': 0,
+        # 'is_maker': False, 'trade_time': '2019-12-26T20:02:19.576Z'}
+        for execution in msgs:
+            if execution['order_id'] in self.orders.keys():
+                sideMulti = 1 if execution['side'] == "Buy" else -1
+                order = self.orders[execution['order_id']]
+                order.executed_amount = (execution['order_qty'] - execution['leaves_qty']) * sideMulti
+                if (order.executed_amount - order.amount) * sideMulti >= 0:
+                    order.active = False
+                self.logger.info("got order execution: %s %.1f @ %.1f " % (
+                    execution['order_link_id'], execution['exec_qty'] * sideMulti,
+                    float(execution['price'])))
+        return False
+
+    def on_position_msgs(self, topic, msgs):
+        # {'user_id': 712961, 'symbol': 'BTCUSD', 'size': 1, 'side': 'Buy', 'position_value':
+        # '0.00013684', 'entry_price': '7307.80473546', 'liq_price': '6674', 'bust_price': '6643.5',
+        # 'leverage': '10', 'order_margin': '0', 'position_margin': '0.00001369', 'available_balance':
+        # '0.17655005', 'take_profit': '0', 'stop_loss': '0', 'realised_pnl': '-0.00000011',
+        # 'trailing_stop': '0', 'wallet_balance': '0.17656386', 'risk_id': 1, 'occ_closing_fee':
+        # '0.00000012', 'occ_funding_fee': '0', 'auto_add_margin': 0, 'cum_realised_pnl': '0.00175533',
+        # 'position_status': 'Normal', 'position_seq': 505770784}
+        for pos in msgs:
+            sizefac = -1 if pos["side"] == "Sell" else 1
+            if pos['symbol'] == self.symbol and \
+                    self.positions[pos['symbol']].quantity != pos["size"] * sizefac:
+                self.logger.info("position changed %.2f -> %.2f" % (
+                    self.positions[pos['symbol']].quantity, pos["size"] * sizefac))
+            if pos['symbol'] not in self.positions.keys():
+                self.positions[pos['symbol']] = AccountPosition(pos['symbol'],
+                                                                avgEntryPrice=float(pos["entry_price"]),
+                                                                quantity=pos["size"] * sizefac,
+                                                                walletBalance=float(pos['wallet_balance']))
+            else:
+                accountPos = self.positions[pos['symbol']]
+                accountPos.quantity = pos["size"] * sizefac
+                accountPos.avgEntryPrice = float(pos["entry_price"])
+                accountPos.walletBalance = float(pos['wallet_balance'])
+        return False
+
+    def on_kline_msgs(self, topic, msgs):
+        if not topic.endswith('.' + self.symbol):
+            return False
+        gotTick = False
+        msgs.sort(key=lambda temp: temp['start'])
+        for b in msgs:
+            if b['open'] is None:
+                continue
+            # fixes known bars in place, bars older than the retention are ignored
+            if self.bars.upsert(self.barDictToBar(b)):
+                gotTick = True
+        return gotTick
+
+    def on_instrument_msgs(self, topic, msgs):
+        if topic != 'instrument_info.100ms.' + self.symbol:
+            return False
+        obj = msgs
+        if 'update' in obj.keys():
+            obj = obj['update'][0]
+        if obj['symbol'] == self.symbol and 'last_price_e4' in obj.keys():
+            self.last = obj['last_price_e4'] / 10000
+        return False
+
     def _execute(self, call: HttpFuture, silent=False, remainingRetries=0):
         if not silent:
             self.logger.info("executing %s %s" % (str(call.operation.http_method).upper(), call.operation.path_name))
         # TODO: handle exception
-        result = call.response().result
+        start = time.monotonic()
+        failed = True
+        try:
+            result = call.response(timeout=self.settings.TIMEOUT or self.transport.timeout).result
+            failed = False
+        finally:
+            self.transport.record(str(call.operation.http_method).upper() + " " + call.operation.path_name,
+                                  time.monotonic() - start, failed)
         if 'result' in result.keys() and result['result'] is not None:
             return result['result']
         else:
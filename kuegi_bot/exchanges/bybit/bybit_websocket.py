@@ -4,6 +4,7 @@ import json
 import time
 
 from kuegi_bot.exchanges.ExchangeWithWS import KuegiWebsocket
+from kuegi_bot.exchanges.message_router import MessageRouter
 
 
 class BybitWebsocket(KuegiWebsocket):
@@ -13,6 +14,9 @@ class BybitWebsocket(KuegiWebsocket):
 
     def __init__(self, wsURL, api_key, api_secret, logger, callback):
         self.data = {}
+        self.router = MessageRouter(logger, topic_of=lambda message: message.get("topic", "response"),
+                                    source=wsURL)
+        self.router.register("response", self.on_response).register_fallback(self.on_topic_data)
         super().__init__(wsURL, api_key, api_secret, logger, callback)
 
     def generate_signature(self, expires):
@@ -28,7 +32,21 @@ class BybitWebsocket(KuegiWebsocket):
 
     def on_message(self, message):
         """Handler for parsing WS messages."""
-        message = json.loads(message)
+        self.router.route(message)
+
+    def on_topic_data(self, message):
+        topic = message["topic"]
+        data = self.data.get(topic)
+        if data is None:
+            self.logger.error("got data for unsubscribed topic: " + topic)
+            return
+        data.append(message["data"])
+        if len(data) > BybitWebsocket.MAX_DATA_CAPACITY:
+            self.data[topic] = data[BybitWebsocket.MAX_DATA_CAPACITY // 2:]
+        if self.callback is not None:
+            self.callback(topic)
+
+    def on_response(self, message):
         if 'success' in message:
             if message["success"]:
                 if 'request' in message and message["request"]["op"] == 'auth':
@@ -39,13 +57,6 @@ class BybitWebsocket(KuegiWebsocket):
             else:
                 self.logger.error("Error in socket: " + str(message))
 
-        if 'topic' in message:
-            self.data[message["topic"]].append(message["data"])
-            if len(self.data[message["topic"]]) > BybitWebsocket.MAX_DATA_CAPACITY:
-                self.data[message["topic"]] = self.data[message["topic"]][BybitWebsocket.MAX_DATA_CAPACITY // 2:]
-            if self.callback is not None:
-                self.callback(message['topic'])
-
     def subscribe_kline(self, symbol: str, interval: str):
         param = {'op': 'subscribe',
                  'args': ['kline.' + symbol + '.' + interval]
@@ -0,0 +1,75 @@
+import time
+
+from kuegi_bot.utils import json_codec, session_recording
+from kuegi_bot.utils.profiling import TimingStats
+
+
+class MessageRouter:
+    ''' decodes raw websocket frames and dispatches them to the handler registered for their topic.
+    topic_of(message) returns the topic of a decoded message. handlers are looked up by the full topic first,
+    then by the part before the first "." (so "kline" handles "kline.BTCUSD.1m"), messages of other topics go to
+    the fallback handler (if set).
+    counts messages and measures decode and handler time per topic.
+    source is the url of the websocket, used when the session gets recorded '''
+
+    def __init__(self, logger, topic_of, decoder: json_codec.JsonDecoder = None, source: str = None):
+        self.logger = logger
+        self.source = source
+        self.topic_of = topic_of
+        self.decoder = decoder if decoder is not None else json_codec.get_decoder()
+        self.handlers = {}
+        self.fallback = None
+        self.decoding = TimingStats()
+        self.topics = {}
+        self.unhandled = 0
+
+    def register(self, topic: str, handler):
+        self.handlers[topic] = handler
+        return self
+
+    def register_fallback(self, handler):
+        self.fallback = handler
+        return self
+
+    def route(self, raw):
+        recorder = session_recording.get_recorder()
+        if recorder is not None:
+            recorder.record_frame(self.source, session_recording.WS_IN, raw)
+        start = time.perf_counter()
+        message = self.decoder.loads(raw)
+        self.decoding.observe(time.perf_counter() - start)
+        self.dispatch(message)
+        return message
+
+    def dispatch(self, message):
+        topic = self.topic_of(message)
+        handler = self.handlers.get(topic)
+        if handler is None and topic is not None:
+            handler = self.handlers.get(topic.split(".", 1)[0])
+        if handler is None:
+            handler = self.fallback
+        if handler is None:
+            self.unhandled += 1
+            self.logger.debug("no handler for ws message with topic %s" % topic)
+            return
+        stats = self.topics.get(topic)
+        if stats is None:
+            stats = TimingStats()
+            self.topics[topic] = stats
+        start = time.perf_counter()
+        try:
+            handler(message)
+        finally:
+            stats.observe(time.perf_counter() - start)
+
+    def replay(self, frames):
+        ''' routes recorded raw frames, f.e. to benchmark decoder and handlers. returns the stats '''
+        for frame in frames:
+            self.route(frame)
+        return self.stats_to_json()
+
+    def stats_to_json(self):
+        return {"decoder": self.decoder.name,
+                "decode": self.decoding.to_json(),
+                "unhandled": self.unhandled,
+                "topics": {topic: stats.to_json() for topic, stats in list(self.topics.items())}}
@@ -2,11 +2,12 @@ import base64
 import hmac
 import hashlib
 import json
-import requests
 import time
 
 from math import trunc
 
+from kuegi_bot.utils.http_transport import HttpTransport, get_transport
+
 
 class PhemexAPIException(Exception):
 
@@ -60,14 +61,14 @@ class Client(object):
     ORDER_STATUS_TRIGGERED = "Triggered"
     ORDER_STATUS_UNTRIGGERED = "Untriggered"
 
-    def __init__(self, api_key=None, api_secret=None, is_testnet=False):
+    def __init__(self, api_key=None, api_secret=None, is_testnet=False, transport: HttpTransport = None):
         self.api_key = api_key
         self.api_secret = api_secret
         self.api_URL = self.MAIN_NET_API_URL
         if is_testnet:
             self.api_URL = self.TEST_NET_API_URL
 
-        self.session = requests.session()
+        self.transport = transport if transport is not None else get_transport()
 
     @staticmethod
     def generate_signature(message, api_secret, body_string=None):
@@ -84,16 +85,17 @@ class Client(object):
         if body:
             body_str = json.dumps(body, separators=(',', ':'))
         [signature, expiry] = self.generate_signature(message, self.api_secret, body_string=body_str)
-        self.session.headers.update({
+        # headers per request: the session is shared between threads
+        headers = {
             'x-phemex-request-signature': signature,
             'x-phemex-request-expiry': str(expiry),
             'x-phemex-access-token': self.api_key,
-            'Content-Type': 'application/json'})
+            'Content-Type': 'application/json'}
 
         url = self.api_URL + endpoint
         if query_string:
             url += '?' + query_string
-        response = self.session.request(method, url, data=body_str.encode())
+        response = self.transport.request(method, url, endpoint=endpoint, data=body_str.encode(), headers=headers)
         if not str(response.status_code).startswith('2'):
             raise PhemexAPIException(response)
         try:
@@ -40,23 +40,17 @@ class PhemexInterface(ExchangeWithWS):
         gotTick = False
         if messageType == "kline":
             if data["type"] == "snapshot":
-                self.bars = []
-                for k in sorted(data["kline"], key=lambda b: b[0], reverse=True):
-                    self.bars.append(self.barArrayToBar(k, self.priceScale))
+                self.bars.clear()
+                for k in sorted(data["kline"], key=lambda b: b[0]):
+                    self.bars.upsert(self.barArrayToBar(k, self.priceScale))
             else:  # incremental
-                for k in sorted(data["kline"], key=lambda b: b[0], reverse=True):
-                    bar = self.barArrayToBar(k, self.priceScale)
-                    if self.bars[0].tstamp >= bar.tstamp >= self.bars[-1].tstamp:
-                        # find bar to fix
-                        for idx in range(0, len(self.bars)):
-                            if bar.tstamp == self.bars[idx].tstamp:
-                                self.bars[idx] = bar
-                                break
-                    elif bar.tstamp > self.bars[0].tstamp:
-                        self.bars.insert(0, bar)
+                for k in sorted(data["kline"], key=lambda b: b[0]):
+                    # fixes known bars in place, bars older than the retention are ignored
+                    if self.bars.upsert(self.barArrayToBar(k, self.priceScale)):
                         gotTick = True
 
-            self.last = self.bars[0].close
+            if not self.bars.is_empty():
+                self.last = self.bars.newest().close
 
         if messageType == "account":
             '''{"accounts":[{"accountBalanceEv":9992165009,"accountID":604630001,"currency":"BTC",
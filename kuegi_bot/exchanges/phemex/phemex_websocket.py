@@ -2,6 +2,7 @@ import json
 import time
 
 from kuegi_bot.exchanges.ExchangeWithWS import KuegiWebsocket
+from kuegi_bot.exchanges.message_router import MessageRouter
 from kuegi_bot.exchanges.phemex.client import Client
 
 
@@ -14,6 +15,11 @@ class PhemexWebsocket(KuegiWebsocket):
     def __init__(self, wsURL, api_key, api_secret, logger, callback):
         """Initialize"""
         self.auth_id = 0
+        self.router = MessageRouter(logger, topic_of=self.topic_of, source=wsURL)
+        self.router.register("auth", self.on_auth)
+        self.router.register("error", self.on_error_reply)
+        self.router.register("account", lambda message: self.on_data("account", message))
+        self.router.register("kline", lambda message: self.on_data("kline", message))
         super().__init__(wsURL, api_key, api_secret, logger, callback)
 
     def send(self, method, params=None):
@@ -31,32 +37,34 @@ class PhemexWebsocket(KuegiWebsocket):
         [signature, expiry] = Client.generate_signature(message=self.api_key, api_secret=self.api_secret)
         self.send("user.auth", ["API", self.api_key, signature, expiry])
 
+    def topic_of(self, message):
+        if 0 < self.auth_id == message.get('id'):
+            return "auth"
+        if message.get('error') is not None:
+            return "error"
+        if message.get("accounts"):
+            return "account"
+        if message.get("kline") and "type" in message:
+            return "kline"
+        return None
+
     def on_message(self, message):
         """Handler for parsing WS messages."""
-        message = json.loads(message)
-        if 0 < self.auth_id == message['id']:
-            self.auth = True
-            self.auth_id = 0
-            self.logger.info("authentication success")
-            return
+        self.router.route(message)
 
-        result = None
-        responseType = None
-        if 'error' in message and message['error'] is not None:
-            self.logger.error("error in ws reply: " + message)
-            self.on_error(message)
-        if "accounts" in message and message['accounts']:
-            # account update
-            responseType = "account"
-            result = message
+    def on_auth(self, message):
+        self.auth = True
+        self.auth_id = 0
+        self.logger.info("authentication success")
 
-        if "kline" in message and message['kline'] and "type" in message:
-            responseType = "kline"
-            result = message
+    def on_error_reply(self, message):
+        self.logger.error("error in ws reply: " + str(message))
+        self.on_error(message)
 
-        if self.callback is not None and result is not None:
+    def on_data(self, responseType, message):
+        if self.callback is not None:
             try:
-                self.callback(responseType, result)
+                self.callback(responseType, message)
             except Exception as e:
                 self.logger.error("Exception in callback: " + str(e) + "\n message: " + str(message))
 
@@ -0,0 +1,204 @@
+import copy
+import threading
+import time
+from typing import List
+
+from kuegi_bot.utils.order_matcher import OrderMatcher
+from kuegi_bot.utils.trading_classes import ExchangeInterface, Account, AccountPosition, Bar, Order, Symbol, \
+    TickerData, process_low_tf_bars
+
+RECENT_ORDERS = 50
+
+
+class SimulationClock:
+    ''' simulated time in seconds. with speed > 0 it runs speed times faster than real time from the start tstamp,
+    with speed 0 it only moves via advance_to (stepping as fast as the caller wants) '''
+
+    def __init__(self, speed: float = 0):
+        self.speed = speed
+        self.start_tstamp = 0
+        self.real_start = time.monotonic()
+        self.offset = 0
+
+    def start(self, tstamp: float):
+        self.start_tstamp = tstamp
+        self.real_start = time.monotonic()
+        self.offset = 0
+
+    def now(self) -> float:
+        elapsed = (time.monotonic() - self.real_start) * self.speed if self.speed > 0 else 0
+        return self.start_tstamp + max(elapsed, self.offset)
+
+    def advance_to(self, tstamp: float):
+        self.offset = max(self.offset, tstamp - self.start_tstamp)
+
+
+class SimulatedOrderMatcher(OrderMatcher):
+    ''' the fill rules of the backtest, additionally keeps the avgEntryPrice of the position like a real exchange '''
+
+    def execute(self, account: Account, order: Order, intrabar: Bar):
+        position = account.open_position
+        before = position.quantity
+        super().execute(account, order, intrabar)
+        price = order.executed_price
+        if before * position.quantity <= 0:
+            position.avgEntryPrice = price if position.quantity != 0 else 0
+        elif abs(position.quantity) > abs(before):
+            position.avgEntryPrice = (position.avgEntryPrice * before + price * (position.quantity - before)) \
+                                     / position.quantity
+
+
+class SimulatedExchange(ExchangeInterface):
+    ''' paper trading exchange on historic M1 bars. orders get filled with the fill rules of the backtest.
+    with SIM_SPEED > 0 a thread moves through the history at that multiple of real time and triggers ticks like a
+    real exchange. with SIM_SPEED 0 the caller moves bar by bar via step() (see LiveTrading.run_simulation).
+    the bars come from the history store (SIM_HISTORY_EXCHANGE, SIM_HISTORY_SYMBOL, SIM_DAYS) or are passed
+    directly (newest first, like load_bars returns them) '''
+
+    def __init__(self, settings, logger, on_tick_callback=None, m1_bars: List[Bar] = None,
+                 clock: SimulationClock = None):
+        super().__init__(settings, logger, on_tick_callback)
+        self.symbol = settings.SYMBOL
+        if m1_bars is None:
+            from kuegi_bot.utils.helper import load_bars
+            m1_bars = load_bars(settings.SIM_DAYS or 30, 1, 0, settings.SIM_HISTORY_EXCHANGE or 'bybit',
+                                settings.SIM_HISTORY_SYMBOL or '')
+        self.m1_bars: List[Bar] = sorted(m1_bars, key=lambda b: b.tstamp)  # oldest first
+        self.clock = clock if clock is not None else SimulationClock(settings.SIM_SPEED or 0)
+        self.symbol_info = Symbol(symbol=self.symbol,
+                                  isInverse=settings.SIM_INVERSE if settings.SIM_INVERSE is not None else True,
+                                  lotSize=settings.SIM_LOT_SIZE or 1,
+                                  tickSize=settings.SIM_TICK_SIZE or 0.5,
+                                  makerFee=settings.SIM_MAKER_FEE if settings.SIM_MAKER_FEE is not None else -0.00025,
+                                  takerFee=settings.SIM_TAKER_FEE if settings.SIM_TAKER_FEE is not None else 0.00075)
+        self.matcher = SimulatedOrderMatcher(self.symbol_info, logger,
+                                             maker_fee=self.symbol_info.makerFee,
+                                             taker_fee=self.symbol_info.takerFee,
+                                             market_slipage_percent=settings.SIM_SLIPPAGE_PERCENT
+                                             if settings.SIM_SLIPPAGE_PERCENT is not None else 0.15)
+        self.account = Account()
+        self.account.open_position = AccountPosition(self.symbol, quantity=0, avgEntryPrice=0,
+                                                     walletBalance=settings.SIM_BALANCE or 1)
+        self.account.equity = self.account.open_position.walletBalance
+
+        # start after enough history for the bot (KLINE_RETENTION_BARS is set to what the bot needs)
+        warmup_bars = (settings.KLINE_RETENTION_BARS or 200) + 1
+        self.index = min(len(self.m1_bars), warmup_bars * (settings.MINUTES_PER_BAR or 1))  # next bar to play
+        self.exited = False
+        self._lock = threading.RLock()
+        if self.index < len(self.m1_bars):
+            self.clock.start(self.m1_bars[self.index].tstamp)
+        self.driver = None
+        if self.clock.speed > 0:
+            self.driver = threading.Thread(target=self._drive, name="simulatedExchange", daemon=True)
+            self.driver.start()
+
+    # simulation
+
+    def step(self) -> bool:
+        ''' plays the next M1 bar: executes triggered orders on it and makes it visible. False if the history is
+        used up '''
+        with self._lock:
+            if self.exited or self.index >= len(self.m1_bars):
+                return False
+            bar = self.m1_bars[self.index]
+            prev_history = len(self.account.order_history)
+            self.matcher.match(self.account, bar)
+            self.index += 1
+            if self.index < len(self.m1_bars):
+                self.clock.advance_to(self.m1_bars[self.index].tstamp)
+            filled = len(self.account.order_history) > prev_history
+        if self.on_tick_callback is not None:
+            self.on_tick_callback(fromAccountAction=filled)
+        return True
+
+    def _drive(self):
+        while not self.exited and self.index < len(self.m1_bars):
+            # a bar is played once the simulated time reached its end
+            if self.clock.now() >= self.m1_bars[self.index].tstamp + 60:
+                self.step()
+            else:
+                time.sleep(0.01)
+
+    def wait_for_dispatch(self, timeout: float = 10):
+        ''' waits till all order requests reached the simulated exchange '''
+        end = time.time() + timeout
+        while self.order_dispatcher.in_flight() > 0 and time.time() < end:
+            time.sleep(0.001)
+
+    def visible_bars(self) -> List[Bar]:
+        ''' the M1 bars played so far, newest first '''
+        with self._lock:
+            return list(reversed(self.m1_bars[:self.index]))
+
+    # implementing ExchangeInterface
+
+    def internal_send_order(self, order: Order):
+        with self._lock:
+            sent = copy.copy(order)
+            sent.exchange_id = order.id
+            sent.tstamp = self.m1_bars[self.index - 1].tstamp if self.index > 0 else 0
+            self.account.open_orders.append(sent)
+            order.exchange_id = order.id
+
+    def internal_update_order(self, order: Order):
+        with self._lock:
+            for idx, existing in enumerate(self.account.open_orders):
+                if existing.id == order.id:
+                    updated = copy.copy(order)
+                    updated.exchange_id = existing.exchange_id
+                    updated.executed_amount = existing.executed_amount
+                    updated.stop_triggered = existing.stop_triggered
+                    self.account.open_orders[idx] = updated
+                    return
+        self.logger.warn("update of unknown or closed order %s ignored" % order.id)
+
+    def internal_cancel_order(self, order: Order):
+        with self._lock:
+            for existing in self.account.open_orders:
+                if existing.id == order.id:
+                    existing.active = False
+                    existing.final_reason = 'cancel'
+                    self.account.open_orders.remove(existing)
+                    self.account.order_history.append(existing)
+                    return
+
+    def get_orders(self) -> List[Order]:
+        # like the real exchanges: open orders and the recently closed ones
+        with self._lock:
+            return [copy.copy(o) for o in self.account.open_orders + self.account.order_history[-RECENT_ORDERS:]]
+
+    def get_bars(self, timeframe_minutes, start_offset_minutes) -> List[Bar]:
+        return process_low_tf_bars(self.visible_bars(), timeframe_minutes, start_offset_minutes)
+
+    def recent_bars(self, timeframe_minutes, start_offset_minutes) -> List[Bar]:
+        with self._lock:
+            recent = list(reversed(self.m1_bars[max(0, self.index - 2 * timeframe_minutes):self.index]))
+        return process_low_tf_bars(recent, timeframe_minutes, start_offset_minutes)
+
+    def get_instrument(self, symbol=None):
+        return self.symbol_info
+
+    def get_ticker(self, symbol=None):
+        with self._lock:
+            last = self.m1_bars[self.index - 1].close if self.index > 0 else None
+        return TickerData(bid=last, ask=last, last=last)
+
+    def get_position(self, symbol=None):
+        return copy.copy(self.account.open_position)
+
+    def is_open(self):
+        return not self.exited and self.index < len(self.m1_bars)
+
+    def check_market_open(self):
+        return self.is_open()
+
+    def update_account(self, account: Account):
+        with self._lock:
+            account.open_position = copy.copy(self.account.open_position)
+            account.equity = self.account.open_position.walletBalance
+            account.usd_equity = self.account.usd_equity
+
+    def exit(self):
+        super().exit()
+        self.exited = True
@@ -0,0 +1,308 @@
+import json
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from kuegi_bot import walk_forward
+from kuegi_bot.backtest_engine import StreamingBackTest, AbortCriteria
+from kuegi_bot.utils.trading_classes import Bar, Symbol
+from kuegi_bot.walk_forward import score
+
+
+class ParamSpace:
+    ''' the discrete param ranges of runOpti: value = min + k * step for k in 0..levels-1 '''
+
+    def __init__(self, min, max, steps):
+        self.min = min
+        self.max = max
+        self.steps = steps
+        self.levels = [int(round((max[i] - min[i]) / steps[i])) + 1 for i in range(len(min))]
+
+    def value(self, dim: int, level: int):
+        return round(self.min[dim] + level * self.steps[dim], 10)
+
+    def params(self, levels: List[int]):
+        return [self.value(dim, level) for dim, level in enumerate(levels)]
+
+    def level(self, dim: int, value) -> int:
+        return int(round((value - self.min[dim]) / self.steps[dim]))
+
+    def size(self) -> int:
+        return math.prod(self.levels)
+
+
+class Trial:
+    def __init__(self, params, budget: float = 1, score: float = None, profit: float = None, maxDD: float = None,
+                 stopped: bool = False, abort: dict = None):
+        self.params = params
+        self.budget = budget  # fraction of the bars used (the most recent ones)
+        self.score = score
+        self.profit = profit
+        self.maxDD = maxDD
+        self.stopped = stopped
+        self.abort = abort  # the abort criteria the trial ran with (they decide which trials get stopped)
+
+    def key(self) -> str:
+        return json.dumps([self.params, self.budget, self.abort], sort_keys=True)
+
+    def to_json(self):
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_json(data):
+        return Trial(**data)
+
+
+class TrialDB:
+    ''' finished trials as json lines, appended as they come in. an interrupted optimization with the same file
+    resumes: trials already in the file are not run again '''
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.trials = {}
+        directory = os.path.dirname(filename)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(filename):
+            with open(filename) as file:
+                for line in file:
+                    if len(line.strip()) > 0:
+                        trial = Trial.from_json(json.loads(line))
+                        self.trials[trial.key()] = trial
+
+    def get(self, trial: Trial) -> Trial:
+        return self.trials.get(trial.key())
+
+    def add(self, trial: Trial):
+        self.trials[trial.key()] = trial
+        with open(self.filename, 'a') as file:
+            file.write(json.dumps(trial.to_json()) + "\n")
+
+
+class SearchStrategy:
+    ''' asks for batches of trials and gets told their results. an empty batch ends the search '''
+
+    def __init__(self, space: ParamSpace, seed=None):
+        self.space = space
+        self.random = random.Random(seed)
+
+    def ask(self) -> List[Trial]:
+        return []
+
+    def tell(self, trials: List[Trial]):
+        pass
+
+    def random_levels(self) -> List[int]:
+        return [self.random.randrange(levels) for levels in self.space.levels]
+
+
+class GridSearch(SearchStrategy):
+    def __init__(self, space: ParamSpace):
+        super().__init__(space)
+        self.done = False
+
+    def ask(self) -> List[Trial]:
+        if self.done:
+            return []
+        self.done = True
+        return [Trial(params) for params in walk_forward.grid_params(self.space.min, self.space.max,
+                                                                     self.space.steps)]
+
+
+class RandomSearch(SearchStrategy):
+    def __init__(self, space: ParamSpace, count: int, seed=None):
+        super().__init__(space, seed)
+        self.count = count
+        self.done = False
+
+    def ask(self) -> List[Trial]:
+        if self.done:
+            return []
+        self.done = True
+        return [Trial(self.space.params(self.random_levels())) for _ in range(self.count)]
+
+
+class LatinHypercube(SearchStrategy):
+    ''' count samples that cover every dimension evenly: each dimension is cut in count strata and every stratum is
+    used once, randomly paired across the dimensions '''
+
+    def __init__(self, space: ParamSpace, count: int, seed=None):
+        super().__init__(space, seed)
+        self.count = count
+        self.done = False
+
+    def samples(self) -> List[List[int]]:
+        columns = []
+        for levels in self.space.levels:
+            column = [min(levels - 1, int((stratum + self.random.random()) * levels / self.count))
+                      for stratum in range(self.count)]
+            self.random.shuffle(column)
+            columns.append(column)
+        return [[column[idx] for column in columns] for idx in range(self.count)]
+
+    def ask(self) -> List[Trial]:
+        if self.done:
+            return []
+        self.done = True
+        return [Trial(self.space.params(levels)) for levels in self.samples()]
+
+
+class SuccessiveHalving(SearchStrategy):
+    ''' starts count latin hypercube samples on the most recent min_budget of the history, keeps the best 1/eta of
+    them for the next round on eta times the history, till the full history is reached '''
+
+    def __init__(self, space: ParamSpace, count: int, eta: int = 3, min_budget: float = 0.1, seed=None,
+                 logger=None):
+        super().__init__(space, seed)
+        self.logger = logger
+        self.eta = eta
+        self.budget = min_budget
+        self.candidates = [space.params(levels) for levels in LatinHypercube(space, count, seed).samples()]
+        self.finished = False
+
+    def ask(self) -> List[Trial]:
+        if self.finished or len(self.candidates) == 0:
+            return []
+        return [Trial(params, budget=self.budget) for params in self.candidates]
+
+    def tell(self, trials: List[Trial]):
+        if self.budget >= 1:
+            self.finished = True
+            return
+        ranked = sorted([t for t in trials if not t.stopped], key=lambda t: t.score, reverse=True)
+        if len(ranked) == 0:
+            if self.logger is not None:
+                self.logger.warn("all %i trials on budget %.2f were stopped by the abort criteria, ending the search"
+                                 % (len(trials), self.budget))
+            self.candidates = []
+            self.finished = True
+            return
+        keep = max(1, len(trials) // self.eta)
+        self.candidates = [t.params for t in ranked[:keep]]
+        self.budget = min(1, round(self.budget * self.eta, 6))
+
+
+class TPESearch(SearchStrategy):
+    ''' tree structured parzen estimator: after startup random trials, the trials are split at the gamma quantile of
+    the score into good and bad ones. per dimension both get a kernel density over the levels, new trials are the
+    candidates with the best ratio of good to bad density. asks batch_size trials at once to keep the workers busy '''
+
+    def __init__(self, space: ParamSpace, count: int, startup: int = 10, batch_size: int = 4, gamma: float = 0.25,
+                 candidates: int = 24, seed=None):
+        super().__init__(space, seed)
+        self.count = count
+        self.startup = startup
+        self.batch_size = batch_size
+        self.gamma = gamma
+        self.candidates = candidates
+        self.history: List[Trial] = []
+        self.asked = 0
+
+    def ask(self) -> List[Trial]:
+        if self.asked >= self.count:
+            return []
+        if self.asked < self.startup:
+            size = min(self.startup, self.count) - self.asked
+            batch = [self.space.params(levels) for levels in
+                     LatinHypercube(self.space, size, self.random.random()).samples()]
+        else:
+            batch = [self.suggest() for _ in range(min(self.batch_size, self.count - self.asked))]
+        self.asked += len(batch)
+        return [Trial(params) for params in batch]
+
+    def tell(self, trials: List[Trial]):
+        self.history += trials
+
+    def density(self, dim: int, trials: List[Trial]) -> List[float]:
+        levels = self.space.levels[dim]
+        bandwidth = max(1.0, levels / 10)
+        weights = [1 / levels] * levels  # flat prior
+        for trial in trials:
+            center = self.space.level(dim, trial.params[dim])
+            for level in range(levels):
+                weights[level] += math.exp(-0.5 * ((level - center) / bandwidth) ** 2)
+        total = sum(weights)
+        return [w / total for w in weights]
+
+    def suggest(self):
+        ranked = sorted(self.history, key=lambda t: t.score, reverse=True)
+        split = max(1, int(math.ceil(self.gamma * len(ranked))))
+        good = ranked[:split]
+        bad = ranked[split:]
+        goodDensity = [self.density(dim, good) for dim in range(len(self.space.levels))]
+        badDensity = [self.density(dim, bad) for dim in range(len(self.space.levels))]
+        best = None
+        bestRatio = None
+        for _ in range(self.candidates):
+            levels = [self.random.choices(range(len(density)), weights=density)[0] for density in goodDensity]
+            ratio = sum(math.log(goodDensity[dim][level]) - math.log(badDensity[dim][level])
+                        for dim, level in enumerate(levels))
+            if bestRatio is None or ratio > bestRatio:
+                best = levels
+                bestRatio = ratio
+        return self.space.params(best)
+
+
+def _abort_key(abort: AbortCriteria):
+    return dict(abort.__dict__) if abort is not None else None
+
+
+def _run_trial(params, budget: float, abort: AbortCriteria):
+    bars = walk_forward._worker_bars
+    count = max(int(len(bars) * budget), 1)
+    backtest = StreamingBackTest(walk_forward._worker_factory(params), reversed(bars[:count]),
+                                 symbol=walk_forward._worker_symbol, extra_lookback=count, abort=abort).run()
+    profit = backtest.account.equity / backtest.initialEquity - 1
+    maxDD = backtest.maxDD / backtest.initialEquity
+    return Trial(params, budget, score(profit, maxDD) if not backtest.aborted else -math.inf, profit, maxDD,
+                 backtest.aborted, _abort_key(abort))
+
+
+class Optimizer:
+    ''' runs the trials of a search strategy as parallel backtests (bot_factory(params) creates the bot, needs to be
+    a module level function). trials that hit the abort criteria are stopped early and rank last.
+    with trial_db the results are persisted and an interrupted optimization resumes '''
+
+    def __init__(self, bars: List[Bar], bot_factory, search: SearchStrategy, symbol: Symbol = None,
+                 workers: int = None, abort: AbortCriteria = None, trial_db: str = None, logger=None):
+        self.bars = bars
+        self.bot_factory = bot_factory
+        self.search = search
+        self.symbol = symbol
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.abort = abort
+        self.db = TrialDB(trial_db) if trial_db is not None else None
+        self.logger = logger
+        self.trials: List[Trial] = []
+
+    def run(self):
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=walk_forward._init_worker,
+                                 initargs=(self.bars, self.bot_factory, self.symbol)) as pool:
+            while True:
+                batch = self.search.ask()
+                if len(batch) == 0:
+                    break
+                for trial in batch:
+                    trial.abort = _abort_key(self.abort)
+                known = [self.db.get(trial) if self.db is not None else None for trial in batch]
+                todo = [trial for trial, done in zip(batch, known) if done is None]
+                results = pool.map(_run_trial, [t.params for t in todo], [t.budget for t in todo],
+                                   [self.abort] * len(todo))
+                finished = {}
+                for trial in results:
+                    finished[trial.key()] = trial
+                    if self.db is not None:
+                        self.db.add(trial)
+                batch = [done if done is not None else finished[trial.key()] for trial, done in zip(batch, known)]
+                if self.logger is not None:
+                    self.logger.info("finished %i trials (%i from db), best score: %.2f" %
+                                     (len(batch), len(batch) - len(todo), max(t.score for t in batch)))
+                self.search.tell(batch)
+                self.trials += batch
+        return self
+
+    def best(self, count: int = 10, full_budget: bool = True) -> List[Trial]:
+        trials = [t for t in self.trials if t.budget >= 1 or not full_budget]
+        return sorted(trials, key=lambda t: t.score, reverse=True)[:count]
@@ -10,7 +10,9 @@ from kuegi_bot.exchanges.binance.binance_interface import BinanceInterface
 from kuegi_bot.exchanges.bitmex.bitmex_interface import BitmexInterface
 from kuegi_bot.exchanges.bybit.bybit_interface import ByBitInterface
 from kuegi_bot.exchanges.phemex.phemex_interface import PhemexInterface
-from kuegi_bot.utils import log, errors
+from kuegi_bot.exchanges.simulated.simulated_exchange import SimulatedExchange
+from kuegi_bot.utils import log, errors, plotting
+from kuegi_bot.utils.latency_tracing import LatencyTracer
 from kuegi_bot.utils.telegram import TelegramBot
 from kuegi_bot.bots.trading_bot import TradingBot
 from kuegi_bot.utils.trading_classes import OrderInterface, Order, Account, Bar, Symbol, ExchangeInterface, OrderType
@@ -22,6 +24,8 @@ class LiveTrading(OrderInterface):
         self.settings = settings
         self.id = self.settings.id
         self.last_tick = 0
+        self.latency = LatencyTracer()
+        self.last_latency_log = time.time()
 
         self.logger = log.setup_custom_logger(name=settings.id,
                                               log_level=settings.LOG_LEVEL,
@@ -33,6 +37,9 @@ class LiveTrading(OrderInterface):
         self.logger.info("#############################")
         self.logger.info(
             "############ Start LiveTrading " + settings.id + " on " + settings.EXCHANGE + " #################")
+        if settings.KLINE_RETENTION_BARS is None:
+            # websocket history only needs to cover what the bot looks at
+            settings.KLINE_RETENTION_BARS = trading_bot.min_bars_needed()
         self.exchange: ExchangeInterface = None
         if settings.EXCHANGE == 'bitmex':
             self.exchange = BitmexInterface(settings=settings, logger=self.logger, on_tick_callback=self.on_tick)
@@ -42,12 +49,15 @@ class LiveTrading(OrderInterface):
             self.exchange = BinanceInterface(settings=settings, logger=self.logger, on_tick_callback=self.on_tick)
         elif settings.EXCHANGE == 'phemex':
             self.exchange = PhemexInterface(settings=settings, logger=self.logger, on_tick_callback=self.on_tick)
+        elif settings.EXCHANGE == 'simulated':
+            self.exchange = SimulatedExchange(settings=settings, logger=self.logger, on_tick_callback=self.on_tick)
         else:
             self.logger.error("unkown exchange: " + settings.EXCHANGE)
             self.alive = False
             return
 
         self.alive = True
+        self.exchange.latency_tracer = self.latency
 
         if self.exchange.is_open():
             self.logger.info(" Starting Live Trading Engine for %s " % self.exchange.symbol)
@@ -76,6 +86,7 @@ class LiveTrading(OrderInterface):
         else:
             delay = 0
         self.last_tick = max(self.last_tick, time.time() + delay)
+        self.latency.tick_arrived("account" if fromAccountAction else "kline")
         self.logger.info("got tick " + str(fromAccountAction))
 
     def print_status(self):
@@ -88,27 +99,43 @@ class LiveTrading(OrderInterface):
     ###
 
     def send_order(self, order: Order):
-        if order.amount == 0:
-            self.logger.error("trying to send order without amount")
-            return
-        if self.telegram_bot is not None:
-            self.telegram_bot.send_log("Sending (" + self.id + "): " + order.print_info(), order.id)
-        order.tstamp = self.bars[0].tstamp
-        if order not in self.account.open_orders:  # bot might add it himself temporarily.
-            self.account.open_orders.append(order)
-        self.exchange.send_order(order)
+        self.send_orders([order])
 
     def update_order(self, order: Order):
-        if self.telegram_bot is not None and TradingBot.order_type_from_order_id(order.id) == OrderType.SL:
-            self.telegram_bot.send_log("updating (" + self.id + "): " + order.print_info(), order.id)
-        self.exchange.update_order(order)
-        self.exchange.on_tick_callback(True) ##simulate tick to prevent early updates (need to wait for exchange to update order
+        self.update_orders([order])
 
     def cancel_order(self, order: Order):
-        if self.telegram_bot is not None:
-            self.telegram_bot.send_log("canceling (" + self.id + "): " + order.print_info(), order.id)
-        order.active = False  # already mark it as cancelled, so not to mess up next loop
-        self.exchange.cancel_order(order)
+        self.cancel_orders([order])
+
+    def send_orders(self, orders: List[Order]):
+        to_send = []
+        for order in orders:
+            if order.amount == 0:
+                self.logger.error("trying to send order without amount")
+                continue
+            if self.telegram_bot is not None:
+                self.telegram_bot.send_log("Sending (" + self.id + "): " + order.print_info())
+            order.tstamp = self.bars[0].tstamp
+            if order not in self.account.open_orders:  # bot might add it himself temporarily.
+                self.account.open_orders.append(order)
+            to_send.append(order)
+        if len(to_send) > 0:
+            self.exchange.send_orders(to_send)
+
+    def update_orders(self, orders: List[Order]):
+        for order in orders:
+            if self.telegram_bot is not None and TradingBot.order_type_from_order_id(order.id) == OrderType.SL:
+                # trailing stops get moved often, only the newest stop of an interval is sent
+                self.telegram_bot.send_log("updating (" + self.id + "): " + order.print_info(), "update:" + order.id)
+        self.exchange.update_orders(orders)
+        self.exchange.on_tick_callback(True) ##simulate tick to prevent early updates (need to wait for exchange to update order
+
+    def cancel_orders(self, orders: List[Order]):
+        for order in orders:
+            if self.telegram_bot is not None:
+                self.telegram_bot.send_log("canceling (" + self.id + "): " + order.print_info())
+            order.active = False  # already mark it as cancelled, so not to mess up next loop
+        self.exchange.cancel_orders(orders)
 
     ###
     # Sanity
@@ -126,6 +153,16 @@ class LiveTrading(OrderInterface):
     def update_account(self):
         self.exchange.update_account(self.account)
         orders = self.exchange.get_orders()
+        # requests still in dispatch are not confirmed by the exchange yet, use the state the bot wants them in
+        in_flight = {}
+        for o in self.exchange.orders_in_flight():
+            in_flight[o.id] = o
+        for idx, o in enumerate(orders):
+            if o.id in in_flight:
+                wanted = in_flight.pop(o.id)
+                if o.active:
+                    orders[idx] = wanted
+        orders += in_flight.values()
         prevOpenIds = []
         for o in self.account.open_orders:
             prevOpenIds.append(o.id)
@@ -141,7 +178,7 @@ class LiveTrading(OrderInterface):
                     self.telegram_bot.send_execution("%s on %s: %s %.2f@ %s" %
                                                      (exec_type.upper(), self.id, o.id, o.executed_amount, price))
                     self.telegram_bot.send_log("%s on %s: %s %.2f@ %s" %
-                                                     (exec_type.upper(), self.id, o.id, o.executed_amount, price),o.id)
+                                                     (exec_type.upper(), self.id, o.id, o.executed_amount, price))
                 self.logger.info("order %s got %s @ %s" % (o.id, exec_type, price))
                 self.account.order_history.append(o)
 
@@ -188,6 +225,7 @@ class LiveTrading(OrderInterface):
         if not self.alive:
             return
         self.logger.info("Shutting down. open orders are not touched! Close manually!")
+        self.logger.info(self.latency.summary())
         try:
             self.exchange.exit()
         except errors.AuthenticationError as e:
@@ -195,18 +233,29 @@ class LiveTrading(OrderInterface):
         except Exception as e:
             self.logger.info("Unable to exit exchange: %s" % e)
             traceback.print_exc()
+        self.bot.close()
         self.alive = False
 
     def handle_tick(self):
+        trace = self.latency.start_tick()
         try:
             self.update_bars()
+            trace.mark("update_bars")
             self.update_account()
+            trace.mark("update_account")
             self.bot.on_tick(self.bars, self.account)
+            trace.mark("bot_on_tick")
             for bar in self.bars:
                 bar.did_change = False
         except Exception as e:
             self.logger.error("Exception in handle_tick: " + traceback.format_exc())
             raise e
+        finally:
+            self.latency.end_tick(trace)
+        interval = self.settings.LATENCY_LOG_INTERVAL
+        if interval and time.time() - self.last_latency_log > interval:
+            self.last_latency_log = time.time()
+            self.logger.info(self.latency.summary())
 
     def run_loop(self):
         if self.alive:
@@ -228,19 +277,29 @@ class LiveTrading(OrderInterface):
 
             sleep(0.5)
 
-    def prepare_plot(self):
+    def run_simulation(self):
+        ''' runs the bot on a SimulatedExchange as fast as possible: one tick per M1 bar, the next bar is only played
+        after all order requests of the tick reached the exchange '''
+        if self.alive:
+            self.bot.init(bars=self.bars, account=self.account, symbol=self.symbolInfo, unique_id=self.settings.id)
+
+        while self.alive:
+            self.handle_tick()
+            self.exchange.wait_for_dispatch()
+            if not self.exchange.step():
+                self.logger.info("simulation finished with %.4f equity" % self.account.equity)
+                self.exit()
+
+    def prepare_plot(self, max_points: int = plotting.MAX_POINTS):
         self.logger.info("running timelines")
         time = list(map(lambda b: datetime.fromtimestamp(b.tstamp), self.bars))
-        open = list(map(lambda b: b.open, self.bars))
-        high = list(map(lambda b: b.high, self.bars))
-        low = list(map(lambda b: b.low, self.bars))
-        close = list(map(lambda b: b.close, self.bars))
 
         self.logger.info("creating plot")
-        fig = go.Figure(data=[go.Candlestick(x=time, open=open, high=high, low=low, close=close, name="XBTUSD")])
+        fig = go.Figure(data=[plotting.candlestick(self.bars, "XBTUSD", max_points)])
 
         self.logger.info("adding bot data")
         self.bot.add_to_plot(fig, self.bars, time)
 
+        fig = plotting.decimate_figure(fig, max_points)
         fig.update_layout(xaxis_rangeslider_visible=False)
         return fig
@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import time
+from functools import partial
+from urllib.parse import unquote
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from kuegi_bot.utils.state_store import diff_state, write_atomic
+
+
+# events a slow stream client may lag behind before it gets a fresh snapshot instead
+MAX_PENDING_EVENTS = 500
+KEEPALIVE_SECONDS = 15
+
+# the html/js of the dashboard in the repo, and the only kinds of files that get served from there
+DASHBOARD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                             "dashboard")
+ASSET_TYPES = [".html", ".js", ".css", ".png", ".ico"]
+
+
+def diff_bot(old: dict, new: dict):
+    ''' the changes from old to new data of a bot (see diff_state), a full copy if the bot is new or died/came back '''
+    if old is None or old.get("alive") != new.get("alive"):
+        return {"full": new}
+    return diff_state(old, new)
+
+
+class StreamSubscriber:
+    ''' pending events of one stream client. if it can't keep up, the backlog is replaced by a fresh snapshot '''
+
+    def __init__(self, snapshot):
+        self._condition = threading.Condition()
+        self.events = [snapshot]
+
+    def push(self, event, snapshot):
+        with self._condition:
+            if len(self.events) >= MAX_PENDING_EVENTS:
+                self.events = [snapshot]
+            else:
+                self.events.append(event)
+            self._condition.notify()
+
+    def next(self, timeout: float):
+        ''' the next event (id, type, data) or None after the timeout '''
+        with self._condition:
+            if len(self.events) == 0:
+                self._condition.wait(timeout)
+            return self.events.pop(0) if len(self.events) > 0 else None
+
+
+class DashboardPublisher:
+    ''' the snapshot of all bots for the dashboard. every bot is serialized on its own and only again once its version
+    changed, the file is only rewritten if any bot changed. the current snapshot can also be served via http with an
+    ETag, so polls of unchanged data get a 304.
+    stream clients get the snapshot and then only the diffs of the bots that changed (diffs are only calculated while
+    someone listens) '''
+
+    def __init__(self, filename: str = None):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.bots = {}  # id -> (version, serialized data)
+        self.data = {}  # id -> data
+        self.diffs = []
+        self.untracked = False  # a bot changed without a diff, clients need a snapshot
+        self.subscribers = []
+        self.dirty = True
+        self.content = b"{}"
+        self.etag = None
+        self.published = 0
+        self.started = int(time.time())
+
+    def is_current(self, id: str, version) -> bool:
+        entry = self.bots.get(id)
+        return entry is not None and entry[0] == version
+
+    def set(self, id: str, version, data: dict):
+        serialized = json.dumps(data, sort_keys=False)
+        self.bots[id] = (version, serialized)
+        # data contains live objects of the bot (f.e. the orders of positions that get changed in place), diffs need
+        # a copy that stays as it was
+        data = json.loads(serialized)
+        if len(self.subscribers) > 0:
+            diff = diff_bot(self.data.get(id), data)
+            if diff is not None:
+                diff["bot"] = id
+                self.diffs.append(diff)
+        else:
+            self.untracked = True
+        self.data[id] = data
+        self.dirty = True
+
+    def publish(self, ids) -> bool:
+        ''' writes the snapshot of the given bots (others are removed) if anything changed since the last call '''
+        for id in list(self.bots.keys()):
+            if id not in ids:
+                del self.bots[id]
+                self.data.pop(id, None)
+                self.diffs.append({"bot": id, "removed": True})
+                self.dirty = True
+        if not self.dirty:
+            return False
+        content = ("{" + ",".join(json.dumps(id) + ":" + self.bots[id][1] for id in ids if id in self.bots)
+                   + "}").encode("utf-8")
+        diffs = self.diffs
+        self.diffs = []
+        with self._lock:
+            self.published += 1
+            self.content = content
+            self.etag = '"%i-%i"' % (self.started, self.published)
+            snapshot = (self.published, "snapshot", content.decode("utf-8"))
+            # diffs only exist for the changes while someone listened
+            events = [snapshot] if self.untracked else [(self.published, "diff", json.dumps(diff)) for diff in diffs]
+            for event in events:
+                for subscriber in self.subscribers:
+                    subscriber.push(event, snapshot)
+            self.untracked = False
+        if self.filename is not None:
+            write_atomic(self.filename, content)
+        self.dirty = False
+        return True
+
+    def snapshot(self):
+        with self._lock:
+            return self.content, self.etag
+
+    def subscribe(self) -> StreamSubscriber:
+        with self._lock:
+            subscriber = StreamSubscriber((self.published, "snapshot", self.content.decode("utf-8")))
+            self.subscribers.append(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber):
+        with self._lock:
+            self.subscribers.remove(subscriber)
+
+
+class DashboardHandler(SimpleHTTPRequestHandler):
+    ''' the snapshot from memory, /events as server-sent events stream and the assets of the dashboard (html/js/css)
+    from the directory. nothing else, no directory listings '''
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/events":
+            self.stream_events()
+            return
+        if path in self.server.snapshot_paths:
+            self.send_snapshot()
+            return
+        if path == "/":
+            path = self.path = "/dashboard.html"
+        name = os.path.basename(unquote(path))
+        if name.startswith(".") or os.path.splitext(name)[1].lower() not in ASSET_TYPES:
+            self.send_error(404)
+            return
+        super().do_GET()
+
+    def do_HEAD(self):
+        self.send_error(405)
+
+    def list_directory(self, path):
+        self.send_error(404)
+        return None
+
+    def send_snapshot(self):
+        content, etag = self.server.publisher.snapshot()
+        if etag is not None and etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Cache-Control", "no-cache")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def stream_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        subscriber = self.server.publisher.subscribe()
+        try:
+            while True:
+                event = subscriber.next(KEEPALIVE_SECONDS)
+                if event is None:
+                    self.wfile.write(b": keepalive\n\n")
+                else:
+                    self.wfile.write(("id: %i\nevent: %s\ndata: %s\n\n" % event).encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.publisher.unsubscribe(subscriber)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DashboardServer:
+    ''' serves the snapshot of the publisher as /dashboard.json (and /<name of the dashboard file>) and the dashboard
+    assets of directory (defaults to the dashboard folder of the repo) in a daemon thread '''
+
+    def __init__(self, publisher: DashboardPublisher, host: str = "127.0.0.1", port: int = 0,
+                 directory: str = DASHBOARD_DIR):
+        self.httpd = ThreadingHTTPServer((host, port), partial(DashboardHandler, directory=directory))
+        self.httpd.daemon_threads = True
+        self.httpd.publisher = publisher
+        self.httpd.snapshot_paths = ["/dashboard.json"]
+        if publisher.filename is not None:
+            self.httpd.snapshot_paths.append("/" + os.path.basename(publisher.filename))
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,5 +1,6 @@
 import json
 import logging
+import os
 import sys
 from datetime import datetime
 from typing import List
@@ -9,7 +10,7 @@ from kuegi_bot.exchanges.bybit.bybit_interface import ByBitInterface
 from kuegi_bot.exchanges.phemex.phemex_interface import PhemexInterface
 from kuegi_bot.indicators.indicator import Indicator
 from kuegi_bot.exchanges.bitmex.bitmex_interface import BitmexInterface
-from kuegi_bot.utils import log
+from kuegi_bot.utils import log, intrabar_path, plotting
 
 import plotly.graph_objects as go
 
@@ -54,17 +55,20 @@ def history_file_name(index, exchange,symbol='') :
     return 'history/' + exchange + '/' + symbol + 'M1_' + str(index) + '.json'
 
 
+# index of the newest history file per exchange_symbol
+HISTORY_FILES = {
+    "bitmex_": 49,
+    "bybit_": 17,
+    "bybit_ETHUSD": 16,
+    "binance_": 9,
+    "binanceSpot_": 28,
+    "phemex_":6
+}
+
+
 def load_bars(days_in_history, wanted_tf, start_offset_minutes=0,exchange='bitmex',symbol=''):
     #empty symbol is legacy and means btcusd
-    knownfiles= {
-        "bitmex_": 49,
-        "bybit_": 17,
-        "bybit_ETHUSD": 16,
-        "binance_": 9,
-        "binanceSpot_": 28,
-        "phemex_":6
-    }
-    end = knownfiles[exchange+"_"+symbol]
+    end = HISTORY_FILES[exchange+"_"+symbol]
     start = max(0,end - int(days_in_history * 1440 / 50000))
     m1_bars_temp = []
     logger.info("loading " + str(end - start) + " history files from "+exchange)
@@ -77,36 +81,96 @@ def load_bars(days_in_history, wanted_tf, start_offset_minutes=0,exchange='bitme
 
     subbars: List[Bar] = []
     for b in m1_bars:
-        if exchange == 'bybit':
-            if b['open'] is None:
-                continue
-            subbars.append(ByBitInterface.barDictToBar(b))
-        elif exchange == 'bitmex':
-            if b['open'] is None:
-                continue
-            subbars.append(BitmexInterface.barDictToBar(b,wanted_tf))
-        elif exchange in ['binance','binanceSpot']:
-            subbars.append(BinanceInterface.barArrayToBar(b))
-        elif exchange == 'phemex':
-            subbars.append(PhemexInterface.barArrayToBar(b,10000))
+        bar = history_bar(b, exchange, wanted_tf)
+        if bar is not None:
+            subbars.append(bar)
     subbars.reverse()
     return process_low_tf_bars(subbars, wanted_tf, start_offset_minutes)
 
 
-def prepare_plot(bars, indis: List[Indicator]):
+def history_bar(b, exchange, wanted_tf):
+    if exchange == 'bybit':
+        if b['open'] is None:
+            return None
+        return ByBitInterface.barDictToBar(b)
+    elif exchange == 'bitmex':
+        if b['open'] is None:
+            return None
+        return BitmexInterface.barDictToBar(b,wanted_tf)
+    elif exchange in ['binance','binanceSpot']:
+        return BinanceInterface.barArrayToBar(b)
+    elif exchange == 'phemex':
+        return PhemexInterface.barArrayToBar(b,10000)
+    return None
+
+
+def stream_bars(days_in_history, wanted_tf, start_offset_minutes=0,exchange='bitmex',symbol='',
+                path_resolution=None):
+    ''' the bars of load_bars as a generator, oldest first. the history files are read one by one, so only one
+    file of M1 data is in memory at a time. with path_resolution the bars carry the compact intrabar path
+    (see intrabar_path) instead of the M1 subbars '''
+    end = HISTORY_FILES[exchange+"_"+symbol]
+    start = max(0,end - int(days_in_history * 1440 / 50000))
+    # same range as load_bars: the last days_in_history days of the newest file
+    with open(history_file_name(end,exchange,symbol)) as f:
+        newest = [history_bar(b, exchange, wanted_tf) for b in json.load(f)]
+    newest = [b for b in newest if b is not None]
+    cutoff = newest[-1].tstamp - days_in_history * 1440 * 60 if len(newest) > 0 else 0
+    del newest
+
+    def finished(bars):
+        if path_resolution is not None:
+            bars = intrabar_path.compress_bars(bars, path_resolution)
+        return reversed(bars)
+
+    logger.info("streaming " + str(end - start) + " history files from "+exchange)
+    pending: List[Bar] = []  # M1 bars of the last, maybe incomplete, bar
+    for i in range(start, end + 1):
+        with open(history_file_name(i,exchange,symbol)) as f:
+            for b in json.load(f):
+                bar = history_bar(b, exchange, wanted_tf)
+                if bar is not None and bar.tstamp > cutoff:
+                    pending.append(bar)
+        if len(pending) == 0:
+            continue
+        pending.reverse()
+        bars = process_low_tf_bars(pending, wanted_tf, start_offset_minutes)
+        # the newest bar might continue in the next file
+        pending = list(reversed(bars[0].subbars))
+        yield from finished(bars[1:])
+    if len(pending) > 0:
+        pending.reverse()
+        yield from finished(process_low_tf_bars(pending, wanted_tf, start_offset_minutes))
+
+
+def load_path_bars(days_in_history, wanted_tf, start_offset_minutes=0,exchange='bitmex',symbol='',
+                   path_resolution=5):
+    ''' like load_bars, but the bars only carry a compact intrabar path instead of all M1 subbars
+    (see intrabar_path). the M1 data of the full range is never in memory (see stream_bars).
+    the result is cached in the history folder '''
+    cachefile = 'history/' + exchange + '/' + (symbol + "_" if len(symbol) > 0 else "") + \
+                'path' + str(path_resolution) + '_' + str(wanted_tf) + '_' + str(start_offset_minutes) + '_' + \
+                str(days_in_history) + '.json'
+    if os.path.exists(cachefile):
+        logger.info("loading cached path bars from " + cachefile)
+        return intrabar_path.read_path_bars(cachefile)
+
+    result = list(stream_bars(days_in_history, wanted_tf, start_offset_minutes, exchange, symbol, path_resolution))
+    result.reverse()
+    intrabar_path.save_path_bars(result, cachefile)
+    return result
+
+
+def prepare_plot(bars, indis: List[Indicator], max_points: int = plotting.MAX_POINTS):
     logger.info("calculating " + str(len(indis)) + " indicators on " + str(len(bars)) + " bars")
     for indi in indis:
         indi.on_tick(bars)
 
     logger.info("running timelines")
     time = list(map(lambda b: datetime.fromtimestamp(b.tstamp), bars))
-    open = list(map(lambda b: b.open, bars))
-    high = list(map(lambda b: b.high, bars))
-    low = list(map(lambda b: b.low, bars))
-    close = list(map(lambda b: b.close, bars))
 
     logger.info("creating plot")
-    fig = go.Figure(data=[go.Candlestick(x=time, open=open, high=high, low=low, close=close, name="XBTUSD")])
+    fig = go.Figure(data=[plotting.candlestick(bars, "XBTUSD", max_points)])
 
     logger.info("adding indicators")
     for indi in indis:
@@ -114,7 +178,8 @@ def prepare_plot(bars, indis: List[Indicator]):
         offset = indi.get_plot_offset()
         for idx in range(0, lines):
             sub_data = list(map(lambda b: indi.get_data_for_plot(b)[idx], bars))
-            fig.add_scatter(x=time, y=sub_data[offset:], mode='lines', line_width=1, name=indi.id + "_" + str(idx))
+            x, y = plotting.minmax_decimate(time, sub_data[offset:], max_points)
+            fig.add_trace(go.Scattergl(x=x, y=y, mode='lines', line_width=1, name=indi.id + "_" + str(idx)))
 
     fig.update_layout(xaxis_rangeslider_visible=False)
     return fig
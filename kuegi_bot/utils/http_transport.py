@@ -0,0 +1,162 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from kuegi_bot.utils import session_recording
+
+
+class LatencyHistogram:
+    ''' latency histogram in seconds. buckets are upper bounds, counts are per bucket (not cumulative) '''
+    BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets if buckets is not None else LatencyHistogram.BUCKETS
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+                return
+        self.counts[-1] += 1
+
+    def avg(self):
+        return self.sum / self.count if self.count > 0 else 0
+
+    def to_json(self):
+        return {"count": self.count,
+                "sum": self.sum,
+                "avg": self.avg(),
+                "max": self.max,
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))}
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+
+    def to_json(self):
+        result = self.latency.to_json()
+        result["errors"] = self.errors
+        return result
+
+
+class TransportAdapter(HTTPAdapter):
+    ''' pooled adapter that applies the url redirects of the transport (also for sessions of third party clients)
+    and records the responses if a session gets recorded '''
+
+    def __init__(self, transport, **kwargs):
+        super().__init__(**kwargs)
+        self.transport = transport
+
+    def send(self, request, **kwargs):
+        originalUrl = request.url
+        request.url = self.transport.resolve_url(originalUrl)
+        response = super().send(request, **kwargs)
+        recorder = session_recording.get_recorder()
+        if recorder is not None:
+            recorder.record_response(request.method, originalUrl, response.status_code, response.text)
+        return response
+
+
+class HttpTransport:
+    ''' shared HTTP layer for the REST clients: one keep-alive session with its own connection pool per host,
+    default timeouts and latency/error stats per endpoint.
+    base_url_overrides maps a base url (like "https://api.phemex.com") to another one, f.e. a local stub server '''
+
+    def __init__(self, timeout: float = 10, pool_size: int = 4, user_agent: str = "kuegi-bot",
+                 base_url_overrides: dict = None):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.user_agent = user_agent
+        self.base_url_overrides = dict(base_url_overrides) if base_url_overrides is not None else {}
+        self.stats = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def redirect(self, base_url: str, target_url: str):
+        self.base_url_overrides[base_url] = target_url
+
+    def resolve_url(self, url: str) -> str:
+        for base, target in self.base_url_overrides.items():
+            if url.startswith(base):
+                return target + url[len(base):]
+        return url
+
+    def session(self, url: str) -> requests.Session:
+        parts = urlparse(url)
+        host = parts.scheme + "://" + parts.netloc
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                self.adopt_session(session)
+                self._sessions[host] = session
+            return self._sessions[host]
+
+    def adopt_session(self, session: requests.Session):
+        ''' gives an externally created session (f.e. of a third party client) the pooled adapters, so it gets
+        redirected and recorded too '''
+        adapter = TransportAdapter(self, pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({'user-agent': self.user_agent})
+
+    def request(self, method: str, url: str, endpoint: str = None, timeout: float = None, **kwargs):
+        ''' sends the request and records latency and errors. kwargs are passed to requests.Session.request.
+        endpoint is the name used in the stats, default is the path of the url '''
+        if endpoint is None:
+            endpoint = urlparse(url).path
+        start = time.monotonic()
+        failed = True
+        try:
+            response = self.session(url).request(method, url, timeout=timeout or self.timeout, **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            self.record(method.upper() + " " + endpoint, time.monotonic() - start, failed)
+
+    def record(self, endpoint: str, duration: float, failed: bool = False):
+        ''' also used by clients that can't send through the transport (f.e. bravado) to report their timing '''
+        with self._lock:
+            if endpoint not in self.stats:
+                self.stats[endpoint] = EndpointStats()
+            stats = self.stats[endpoint]
+            stats.latency.observe(duration)
+            if failed:
+                stats.errors += 1
+
+    def stats_to_json(self):
+        with self._lock:
+            return {endpoint: stats.to_json() for endpoint, stats in self.stats.items()}
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+_transport: HttpTransport = None
+
+
+def get_transport() -> HttpTransport:
+    global _transport
+    if _transport is None:
+        _transport = HttpTransport()
+    return _transport
+
+
+def set_transport(transport: HttpTransport):
+    ''' replaces the shared transport, f.e. to point all clients to a stub server '''
+    global _transport
+    _transport = transport
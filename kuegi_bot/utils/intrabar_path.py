@@ -0,0 +1,139 @@
+import json
+import os
+from typing import List
+
+from kuegi_bot.utils.trading_classes import Bar, process_low_tf_bars
+
+# path resolution 0: only open -> first extreme -> second extreme -> close per bar
+OHLC_PATH = 0
+
+
+def _leg(tstamp, start: float, end: float, volume: float) -> Bar:
+    return Bar(tstamp=tstamp, open=start, high=max(start, end), low=min(start, end), close=end, volume=volume)
+
+
+def ohlc_path(bar: Bar) -> List[Bar]:
+    ''' the path of the bar as 3 legs (newest first, like subbars): open to the first extreme, to the second extreme,
+    to the close. the order of high and low is taken from the M1 subbars if there are any, otherwise the extreme
+    closer to the open is assumed to come first '''
+    highFirst = None
+    highTstamp = lowTstamp = bar.tstamp
+    if len(bar.subbars) > 0:
+        highSub = lowSub = None
+        for sub in reversed(bar.subbars):  # oldest first
+            if highSub is None or sub.high > highSub.high:
+                highSub = sub
+            if lowSub is None or sub.low < lowSub.low:
+                lowSub = sub
+        highTstamp = highSub.tstamp
+        lowTstamp = lowSub.tstamp
+        if highSub != lowSub:
+            highFirst = highSub.tstamp < lowSub.tstamp
+        else:
+            # both in the same M1 bar: same guess on M1 level
+            highFirst = highSub.close < highSub.open
+    if highFirst is None:
+        highFirst = bar.high - bar.open < bar.open - bar.low
+    first, second = (bar.high, bar.low) if highFirst else (bar.low, bar.high)
+    firstTstamp, secondTstamp = (highTstamp, lowTstamp) if highFirst else (lowTstamp, highTstamp)
+    # keep the tstamps strictly increasing, even if the extremes are in the first/same M1 bar
+    firstTstamp = max(firstTstamp, bar.tstamp + 1)
+    secondTstamp = max(secondTstamp, firstTstamp + 1)
+    closeTstamp = max(bar.subbars[0].tstamp if len(bar.subbars) > 0 else bar.tstamp, secondTstamp + 1)
+    volume = bar.volume / 3
+    return [_leg(closeTstamp, second, bar.close, volume),
+            _leg(secondTstamp, first, second, volume),
+            _leg(firstTstamp, bar.open, first, volume)]
+
+
+def pivot_path(bar: Bar, resolution_minutes: int) -> List[Bar]:
+    ''' the M1 subbars of the bar aggregated to resolution_minutes (newest first) '''
+    pivots = process_low_tf_bars(bar.subbars, resolution_minutes)
+    for pivot in pivots:
+        pivot.subbars = []
+    return pivots
+
+
+def compress_bar(bar: Bar, resolution_minutes: int = 5) -> Bar:
+    ''' copy of the bar with the M1 subbars replaced by the compact path '''
+    result = Bar(tstamp=bar.tstamp, open=bar.open, high=bar.high, low=bar.low, close=bar.close, volume=bar.volume)
+    if resolution_minutes == OHLC_PATH:
+        result.subbars = ohlc_path(bar)
+    else:
+        result.subbars = pivot_path(bar, resolution_minutes)
+    return result
+
+
+def compress_bars(bars: List[Bar], resolution_minutes: int = 5) -> List[Bar]:
+    ''' the bars with compact paths instead of M1 subbars. the result shares nothing with the input, so the M1 data
+    can be freed afterwards '''
+    return [compress_bar(bar, resolution_minutes) for bar in bars]
+
+
+def _bar_to_array(bar: Bar):
+    return [bar.tstamp, bar.open, bar.high, bar.low, bar.close, bar.volume]
+
+
+def save_path_bars(bars: List[Bar], filename: str):
+    directory = os.path.dirname(filename)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    with open(filename, 'w') as file:
+        json.dump([_bar_to_array(bar) + [[_bar_to_array(sub) for sub in bar.subbars]] for bar in bars], file)
+
+
+def read_path_bars(filename: str) -> List[Bar]:
+    with open(filename) as file:
+        data = json.load(file)
+    result = []
+    for entry in data:
+        result.append(Bar(tstamp=entry[0], open=entry[1], high=entry[2], low=entry[3], close=entry[4],
+                          volume=entry[5],
+                          subbars=[Bar(tstamp=s[0], open=s[1], high=s[2], low=s[3], close=s[4], volume=s[5])
+                                   for s in entry[6]]))
+    return result
+
+
+def compare_backtests(full, compact) -> dict:
+    ''' divergence of a backtest on compact paths (compact) against the same bot on full M1 subbars (full).
+    positions are matched by id, a position matches if it has the same status in both runs. for matching positions
+    the deviation of the filled entry and exit prices is averaged (in percent of the full fill).
+    uwDaysDiff is the difference of the longest time underwater in days '''
+
+    def by_id(backtest):
+        positions = {}
+        for pos in backtest.bot.position_history:
+            positions[pos.id] = pos
+        return positions
+
+    fullPositions = by_id(full)
+    compactPositions = by_id(compact)
+    matching = 0
+    sameFills = 0
+    fillDiffs = []
+    for posId, pos in fullPositions.items():
+        other = compactPositions.get(posId)
+        if other is None or other.status != pos.status:
+            continue
+        matching += 1
+        same = True
+        for wanted, got in [(pos.filled_entry, other.filled_entry), (pos.filled_exit, other.filled_exit)]:
+            if wanted is not None and got is not None:
+                fillDiffs.append(abs(got - wanted) / wanted)
+                same = same and abs(got - wanted) <= full.symbol.tickSize
+            elif wanted is not None or got is not None:
+                same = False
+        if same:
+            sameFills += 1
+    total = max(len(fullPositions), len(compactPositions))
+    return {
+        "positions": len(fullPositions),
+        "positionsCompact": len(compactPositions),
+        "matchingPositions": matching,
+        "positionMatchRate": matching / total if total > 0 else 1,
+        "sameFills": sameFills,
+        "avgFillDiffPercent": 100 * sum(fillDiffs) / len(fillDiffs) if len(fillDiffs) > 0 else 0,
+        "equityDiffPercent": 100 * (compact.account.equity - full.account.equity) / full.initialEquity,
+        "maxDDDiffPercent": 100 * (compact.maxDD - full.maxDD) / full.initialEquity,
+        "uwDaysDiff": (compact.max_underwater - full.max_underwater) / (60 * 60 * 24)
+    }
@@ -0,0 +1,79 @@
+import json
+import sys
+import time
+from typing import List
+
+
+class JsonDecoder:
+    def __init__(self, name: str, loads):
+        self.name = name
+        self.loads = loads
+
+
+def _load_decoders():
+    decoders = {}
+    try:
+        import orjson
+        decoders["orjson"] = JsonDecoder("orjson", orjson.loads)
+    except ImportError:
+        pass
+    try:
+        import ujson
+        decoders["ujson"] = JsonDecoder("ujson", ujson.loads)
+    except ImportError:
+        pass
+    decoders["json"] = JsonDecoder("json", json.loads)
+    return decoders
+
+
+# ordered by preference, stdlib json is always there
+DECODERS = _load_decoders()
+
+_default: JsonDecoder = next(iter(DECODERS.values()))
+
+
+def get_decoder(name: str = None) -> JsonDecoder:
+    ''' the decoder with the given name, or the default (fastest available) one if name is None.
+    falls back to stdlib json if the wanted library is not installed '''
+    if name is None:
+        return _default
+    return DECODERS.get(name, DECODERS["json"])
+
+
+def set_default_decoder(name: str):
+    global _default
+    _default = get_decoder(name)
+    return _default
+
+
+def loads(value):
+    return _default.loads(value)
+
+
+def benchmark(frames: List[str], decoders: List[str] = None, repeat: int = 5):
+    ''' decodes the frames with every decoder and returns the best time per frame in microseconds by decoder '''
+    result = {}
+    for name in decoders if decoders is not None else DECODERS.keys():
+        decoder = get_decoder(name)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for frame in frames:
+                decoder.loads(frame)
+            duration = time.perf_counter() - start
+            best = duration if best is None else min(best, duration)
+        result[decoder.name] = best * 1e6 / max(1, len(frames))
+    return result
+
+
+if __name__ == "__main__":
+    # usage: python -m kuegi_bot.utils.json_codec <capture file with one raw frame per line or recorded session>
+    if sys.argv[1].endswith(".gz"):
+        from kuegi_bot.utils import session_recording
+        lines = [entry[3] for entry in session_recording.read_session(sys.argv[1])
+                 if entry[1] == session_recording.WS_IN]
+    else:
+        with open(sys.argv[1]) as file:
+            lines = [line.rstrip("\n") for line in file if len(line.strip()) > 0]
+    for decoderName, micros in benchmark(lines).items():
+        print("%s: %.2f us per frame (%i frames)" % (decoderName, micros, len(lines)))
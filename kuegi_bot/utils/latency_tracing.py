@@ -0,0 +1,101 @@
+import threading
+import time
+
+from kuegi_bot.utils.http_transport import LatencyHistogram
+
+# finer buckets than for http requests, most stages of a tick take only milliseconds
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+class TickTrace:
+    ''' monotonic timestamps (perf_counter) of one tick on its way through the engine '''
+
+    def __init__(self, origin: str, arrived: float):
+        self.origin = origin  # what triggered the tick: kline, account or loop
+        self.arrived = arrived
+        self.started = time.perf_counter()
+        self.marks = []  # (stage, time) in the order they happened
+        self.submitted = False
+
+    def mark(self, stage: str):
+        self.marks.append((stage, time.perf_counter()))
+
+
+class LatencyTracer:
+    ''' latency of the ticks of one bot, aggregated as histograms per span:
+    queued: data arrived (socket callback) -> handle_tick started
+    update_bars, update_account, bot_on_tick: the stages of handle_tick
+    handle_tick: the full tick, tick_total: arrival till the end of the tick
+    tick_to_submit: arrival -> first order request of the tick handed to the dispatcher
+    tick_to_<send|update|cancel>: arrival -> REST call of the request returned (from the dispatcher threads) '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.ticks = {}  # count per origin
+        self.failed_requests = 0
+        self.pending = None  # (origin, arrival) of the oldest data not handled yet
+        self.current: TickTrace = None
+
+    def observe(self, span: str, duration: float):
+        with self._lock:
+            histogram = self.spans.get(span)
+            if histogram is None:
+                histogram = LatencyHistogram(BUCKETS)
+                self.spans[span] = histogram
+            histogram.observe(duration)
+
+    def tick_arrived(self, origin: str):
+        ''' called when new data arrives. the latency of a tick is measured from the oldest data it handles '''
+        with self._lock:
+            if self.pending is None:
+                self.pending = (origin, time.perf_counter())
+
+    def start_tick(self) -> TickTrace:
+        with self._lock:
+            origin, arrived = self.pending if self.pending is not None else ("loop", time.perf_counter())
+            self.pending = None
+            self.ticks[origin] = self.ticks.get(origin, 0) + 1
+        trace = TickTrace(origin, arrived)
+        self.current = trace
+        return trace
+
+    def end_tick(self, trace: TickTrace):
+        end = time.perf_counter()
+        self.current = None
+        self.observe("queued", trace.started - trace.arrived)
+        previous = trace.started
+        for stage, tstamp in trace.marks:
+            self.observe(stage, tstamp - previous)
+            previous = tstamp
+        self.observe("handle_tick", end - trace.started)
+        self.observe("tick_total", end - trace.arrived)
+
+    def order_submitted(self) -> TickTrace:
+        ''' the trace of the tick that submits an order request right now (None if outside of a tick) '''
+        trace = self.current
+        if trace is not None and not trace.submitted:
+            trace.submitted = True
+            self.observe("tick_to_submit", time.perf_counter() - trace.arrived)
+        return trace
+
+    def order_done(self, trace: TickTrace, action: str, error):
+        if trace is None:
+            return
+        if error is not None:
+            with self._lock:
+                self.failed_requests += 1
+            return
+        self.observe("tick_to_" + action, time.perf_counter() - trace.arrived)
+
+    def to_json(self):
+        with self._lock:
+            return {"ticks": dict(self.ticks),
+                    "failed_requests": self.failed_requests,
+                    "spans": {span: histogram.to_json() for span, histogram in self.spans.items()}}
+
+    def summary(self) -> str:
+        with self._lock:
+            parts = ["%s: %.1f/%.1f ms (%i)" % (span, histogram.avg() * 1000, histogram.max * 1000, histogram.count)
+                     for span, histogram in self.spans.items()]
+        return "latency avg/max | " + " | ".join(parts)
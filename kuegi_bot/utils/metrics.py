@@ -0,0 +1,207 @@
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from kuegi_bot.utils.http_transport import LatencyHistogram
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    ''' one metric family: a value per combination of label values '''
+    TYPE = "untyped"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # tuple of label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(label, "") for label in self.labels)
+
+    def _label_text(self, key: tuple, extra: str = None) -> str:
+        parts = ['%s="%s"' % (label, _escape(value)) for label, value in zip(self.labels, key)]
+        if extra is not None:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if len(parts) > 0 else ""
+
+    def samples(self):
+        ''' (suffix, label text, value) of all values '''
+        with self._lock:
+            items = list(self.values.items())
+        return [("", self._label_text(key), value) for key, value in items]
+
+    def exposition(self) -> str:
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.TYPE)]
+        for suffix, labels, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, labels, _format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        ''' for collectors that read a count that is kept elsewhere '''
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    ''' values are LatencyHistograms (or their to_json()), buckets are exposed cumulative like prometheus wants '''
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=None):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = LatencyHistogram(self.buckets)
+                self.values[key] = histogram
+            histogram.observe(value)
+
+    def set(self, histogram_json: dict, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = histogram_json
+
+    def samples(self):
+        with self._lock:
+            items = [(key, value.to_json() if isinstance(value, LatencyHistogram) else value)
+                     for key, value in self.values.items()]
+        result = []
+        for key, data in items:
+            cumulative = 0
+            for bound, count in data["buckets"].items():
+                cumulative += count
+                result.append(("_bucket", self._label_text(key, 'le="%s"' % bound), cumulative))
+            result.append(("_sum", self._label_text(key), data["sum"]))
+            result.append(("_count", self._label_text(key), data["count"]))
+        return result
+
+
+class MetricsRegistry:
+    ''' metrics of the process in the prometheus text format.
+    counters/gauges/histograms created here are updated where things happen. collectors (functions returning a list
+    of metrics) are only called on a scrape, so state that is kept anyway (equity, stats of the transport, ...)
+    costs nothing on the trading threads '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get(self, cls, name: str, help: str, labels=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labels, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels=(), buckets=None) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            metrics += collector()
+        return metrics
+
+    def exposition(self) -> str:
+        return "\n".join(metric.exposition() for metric in self.collect()) + "\n"
+
+
+_registry: MetricsRegistry = None
+
+
+def get_registry() -> MetricsRegistry:
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry()
+    return _registry
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ["/", "/metrics"]:
+            self.send_error(404)
+            return
+        try:
+            data = self.server.registry.exposition().encode("utf-8")
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    ''' serves the registry on http://host:port/metrics in a daemon thread '''
+
+    def __init__(self, registry: MetricsRegistry = None, host: str = "127.0.0.1", port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry if registry is not None else get_registry()
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
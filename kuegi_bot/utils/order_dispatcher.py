@@ -0,0 +1,149 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DispatchRequest:
+    def __init__(self, action: str, orders: dict, call, deadline: float, trace=None):
+        self.action = action
+        self.orders = orders  # key -> order
+        self.keys = list(orders.keys())
+        self.call = call
+        self.deadline = deadline
+        self.attempts = 0
+        self.started = False
+        self.trace = trace  # TickTrace of the tick that caused the request (if latency gets traced)
+
+    def key_info(self) -> str:
+        return ",".join(self.keys)
+
+
+class OrderDispatcher:
+    ''' executes order requests (send/update/cancel) in the background so the caller never blocks.
+    a request covers one or more orders (batch), identified by their key (the client order id).
+    requests touching the same key run strictly in the order of submission, all others run in parallel
+    with at most max_workers requests in flight. retryable errors are retried with exponential backoff and jitter
+    until the deadline of the request. on_done(request, error) gets called once per request with the final
+    outcome (error is None on success) '''
+
+    def __init__(self, logger, max_workers: int = 2, base_delay: float = 1, max_delay: float = 30,
+                 deadline_seconds: float = 60, retryable=(ValueError,), on_done=None):
+        self.logger = logger
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline_seconds = deadline_seconds
+        self.retryable = retryable
+        self.on_done = on_done
+        self.closed = False
+
+        self._lock = threading.Lock()
+        self._queues = {}  # key -> deque of requests for this key, head is in flight (or next to start)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="orderDispatch")
+
+    def submit(self, action: str, orders: dict, call, trace=None):
+        ''' queues the call for the given orders (key -> order).
+        call(attempt) gets executed in a worker thread, attempt starts at 1 '''
+        if len(orders) == 0:
+            return
+        request = DispatchRequest(action, orders, call, time.time() + self.deadline_seconds, trace)
+        with self._lock:
+            if self.closed:
+                self.logger.warn("dispatcher closed, dropping %s of %s" % (action, request.key_info()))
+                return
+            if len(request.keys) == 1:
+                queue = self._queues.get(request.keys[0])
+                if queue is not None and len(queue) > 1 and queue[-1].keys == request.keys \
+                        and queue[-1].action == action:
+                    # same action still waiting: only the newest state of the order needs to reach the exchange
+                    queue[-1] = request
+                    return
+            for key in request.keys:
+                self._queues.setdefault(key, deque()).append(request)
+            ready = self._is_ready(request)
+        if ready:
+            self._executor.submit(self._run, request)
+
+    def pending_orders(self) -> list:
+        ''' the newest requested state of every order that has a request in flight or waiting '''
+        with self._lock:
+            return [queue[-1].orders[key] for key, queue in self._queues.items()]
+
+    def pending_action(self, key: str):
+        with self._lock:
+            queue = self._queues.get(key)
+            return queue[-1].action if queue else None
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._queues)
+
+    def shutdown(self):
+        with self._lock:
+            self.closed = True
+        self._executor.shutdown(wait=False)
+
+    def _is_ready(self, request: DispatchRequest) -> bool:
+        ''' needs to be called with the lock held. marks the request as started if all its keys are free '''
+        if request.started:
+            return False
+        for key in request.keys:
+            if self._queues[key][0] is not request:
+                return False
+        request.started = True
+        return True
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * pow(2, attempt - 1))
+        return delay * (0.5 + random.random() / 2)
+
+    def _run(self, request: DispatchRequest):
+        if request.attempts == 0 and time.time() > request.deadline:
+            self._finish(request, TimeoutError("deadline passed before %s of %s got sent" %
+                                               (request.action, request.key_info())))
+            return
+        request.attempts += 1
+        try:
+            request.call(request.attempts)
+        except self.retryable as e:
+            delay = self._backoff(request.attempts)
+            if self.closed or time.time() + delay > request.deadline:
+                self._finish(request, e)
+                return
+            self.logger.info("%s of %s failed (%s), retry %i in %.1f s" %
+                             (request.action, request.key_info(), str(e), request.attempts, delay))
+            timer = threading.Timer(delay, self._retry, args=[request])
+            timer.daemon = True
+            timer.start()
+        except Exception as e:
+            self._finish(request, e)
+        else:
+            self._finish(request, None)
+
+    def _retry(self, request: DispatchRequest):
+        try:
+            self._executor.submit(self._run, request)
+        except RuntimeError as e:  # executor got shut down in the meantime
+            self._finish(request, e)
+
+    def _finish(self, request: DispatchRequest, error):
+        to_start = []
+        with self._lock:
+            for key in request.keys:
+                queue = self._queues[key]
+                queue.popleft()
+                if len(queue) == 0:
+                    del self._queues[key]
+                elif self._is_ready(queue[0]):
+                    to_start.append(queue[0])
+        if self.on_done is not None:
+            try:
+                self.on_done(request, error)
+            except Exception as e:
+                self.logger.error("error in order dispatch callback: %s" % str(e))
+        for next_request in to_start:
+            try:
+                self._executor.submit(self._run, next_request)
+            except RuntimeError as e:
+                self._finish(next_request, e)
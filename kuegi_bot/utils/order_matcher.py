@@ -0,0 +1,88 @@
+import math
+
+from kuegi_bot.utils.trading_classes import Account, Bar, Order, Symbol
+
+
+class OrderMatcher:
+    ''' the fill rules of the backtest: matches the open orders of an account against a (sub)bar and books the
+    executions on the position and wallet of the account. also used by the SimulatedExchange '''
+
+    def __init__(self, symbol: Symbol, logger, maker_fee: float = -0.00025, taker_fee: float = 0.00075,
+                 market_slipage_percent: float = 0.15):
+        self.symbol = symbol
+        self.logger = logger
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.market_slipage_percent = market_slipage_percent
+
+    def execute(self, account: Account, order: Order, intrabar: Bar):
+        amount = order.amount - order.executed_amount
+        order.executed_amount = order.amount
+        fee = self.taker_fee
+        if order.limit_price:
+            price = order.limit_price
+            fee = self.maker_fee
+        elif order.stop_price:
+            price = int(order.stop_price * (1 + math.copysign(self.market_slipage_percent,
+                                                              order.amount) / 100) / self.symbol.tickSize) * self.symbol.tickSize
+        else:
+            price = intrabar.open * (1 + math.copysign(self.market_slipage_percent, order.amount) / 100)
+        price = min(intrabar.high,
+                    max(intrabar.low, price))  # only prices within the bar. might mean less slipage
+        order.executed_price = price
+        position = account.open_position
+        position.quantity += amount
+        delta = amount * (price if not self.symbol.isInverse else -1 / price)
+        position.walletBalance -= delta
+        position.walletBalance -= math.fabs(delta) * fee
+
+        order.active = False
+        order.execution_tstamp = intrabar.tstamp
+        order.final_reason = 'executed'
+        account.order_history.append(order)
+        account.open_orders.remove(order)
+        self.logger.debug(
+            "executed order %s | %.0f %.2f | %.2f@ %.1f" % (
+            order.id, account.usd_equity, position.quantity, order.executed_amount,
+            order.executed_price))
+
+    def match(self, account: Account, intrabarToCheck: Bar) -> bool:
+        ''' executes all orders that got triggered in the bar and updates the equity. returns True if something
+        changed '''
+        something_changed = False
+        to_execute = []
+        for order in account.open_orders:
+            if order.limit_price is None and order.stop_price is None:
+                to_execute.append(order)
+                something_changed = True
+                continue
+
+            if order.stop_price and not order.stop_triggered:
+                if (order.amount > 0 and order.stop_price < intrabarToCheck.high) or (
+                        order.amount < 0 and order.stop_price > intrabarToCheck.low):
+                    order.stop_triggered = True
+                    something_changed = True
+                    if order.limit_price is None:
+                        # execute stop market
+                        to_execute.append(order)
+                    elif ((order.amount > 0 and order.limit_price > intrabarToCheck.close) or (
+                            order.amount < 0 and order.limit_price < intrabarToCheck.close)):
+                        # close below/above limit: got definitly executed
+                        to_execute.append(order)
+
+            else:  # means order.limit_price and (order.stop_price is None or order.stop_triggered):
+                # check for limit execution
+                if (order.amount > 0 and order.limit_price > intrabarToCheck.low) or (
+                        order.amount < 0 and order.limit_price < intrabarToCheck.high):
+                    to_execute.append(order)
+
+        for order in to_execute:
+            something_changed = True
+            self.execute(account, order, intrabarToCheck)
+
+        # update equity = balance + current value of open position
+        posValue = account.open_position.quantity * (
+            intrabarToCheck.close if not self.symbol.isInverse else -1 / intrabarToCheck.close)
+        account.equity = account.open_position.walletBalance + posValue
+        account.usd_equity = account.equity * intrabarToCheck.close
+        return something_changed
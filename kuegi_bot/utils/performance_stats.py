@@ -0,0 +1,125 @@
+import numpy as np
+
+DAY = 60 * 60 * 24
+
+
+def trade_results(trades: dict, is_inverse: bool = True) -> np.ndarray:
+    ''' result of every trade in the currency of the equity (coins for inverse, quote currency for linear) '''
+    amount = trades["amount"]
+    if is_inverse:
+        return amount / trades["filled_entry"] - amount / trades["filled_exit"]
+    return amount * (trades["filled_exit"] - trades["filled_entry"])
+
+
+def r_multiples(trades: dict, results: np.ndarray, is_inverse: bool = True) -> np.ndarray:
+    ''' result per initial risk (entry to initial stop), nan if there was no stop '''
+    amount = np.abs(trades["amount"])
+    if is_inverse:
+        risk = amount * np.abs(1 / trades["initial_stop"] - 1 / trades["filled_entry"])
+    else:
+        risk = amount * np.abs(trades["filled_entry"] - trades["initial_stop"])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(risk > 0, results / risk, np.nan)
+
+
+def ema(values: np.ndarray, alpha: float, block: int = 256) -> np.ndarray:
+    ''' y[i] = alpha * x[i] + (1 - alpha) * y[i-1] with y[-1] = 0. computed blockwise with cumsums (the weights
+    (1-alpha)^-i would overflow on the full series) '''
+    result = np.empty(len(values))
+    decay = 1 - alpha
+    carry = 0.0
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        powers = decay ** np.arange(len(chunk))
+        if decay > 0:
+            chunkResult = alpha * powers * np.cumsum(chunk / powers) + carry * decay * powers
+        else:
+            chunkResult = alpha * chunk
+        result[start:start + len(chunk)] = chunkResult
+        carry = chunkResult[-1]
+    return result
+
+
+def _range_reduce(values: np.ndarray, starts: np.ndarray, reduce) -> np.ndarray:
+    ''' reduce (np.maximum or np.minimum) of values[starts[i]:i+1] for every i, via a sparse table '''
+    count = len(values)
+    table = [values]
+    width = 1
+    while width * 2 <= count:
+        prev = table[-1]
+        table.append(reduce(prev[:-width], prev[width:]))
+        width *= 2
+    ends = np.arange(count)
+    lengths = ends - starts + 1
+    levels = np.floor(np.log2(lengths)).astype(int)
+    result = np.empty(count)
+    for level in np.unique(levels):
+        mask = levels == level
+        result[mask] = reduce(table[level][starts[mask]], table[level][ends[mask] - (1 << level) + 1])
+    return result
+
+
+def rolling_starts(tstamps: np.ndarray, range_seconds: float) -> np.ndarray:
+    ''' index of the first entry in the window ending at every entry (entries older than range_seconds drop out) '''
+    running = np.maximum.accumulate(tstamps)
+    starts = np.searchsorted(running, tstamps - range_seconds, side='left')
+    return np.minimum(np.maximum.accumulate(starts), np.arange(len(tstamps)))
+
+
+def performance_stats(trades: dict, is_inverse: bool = True, range_days: float = 75, alpha: float = 0.3,
+                      start_tstamp: float = None) -> dict:
+    ''' rolling performance of the closed trades (columns as from backtest_result.trades_to_arrays, ordered like the
+    position history). every value is an array with one entry per trade:
+    result and r of the trade, equity and hh (relative to the equity before the first trade), dd, maxDD,
+    underwaterDays and over the trades of the last range_days (smoothed with an ema of alpha):
+    tradesInRange, percWin, avgResult, avgR, maxWinner and maxLoser '''
+    count = len(trades["amount"])
+    if count == 0:
+        return {}
+    exitTstamp = trades["exit_tstamp"]
+    exitEquity = trades["exit_equity"]
+    results = trade_results(trades, is_inverse)
+    rs = r_multiples(trades, results, is_inverse)
+    startEquity = exitEquity[0] - results[0]
+
+    starts = rolling_starts(exitTstamp, range_days * DAY)
+    ends = np.arange(count)
+    inRange = ends - starts + 1
+
+    def rolling_sum(values):
+        sums = np.concatenate([[0.0], np.cumsum(values)])
+        return sums[ends + 1] - sums[starts]
+
+    winners = rolling_sum(results > 0)
+    avgResult = rolling_sum(results) / inRange
+    validR = ~np.isnan(rs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avgR = np.where(rolling_sum(validR) > 0, rolling_sum(np.where(validR, rs, 0)) / rolling_sum(validR), 0)
+    maxWinner = np.maximum(_range_reduce(results, starts, np.maximum), 0)
+    maxLoser = -np.minimum(_range_reduce(results, starts, np.minimum), 0)
+
+    # drawdown on the exit equity, hh starts at 1 like the equity of the backtest
+    hh = np.maximum.accumulate(np.maximum(exitEquity, 1))
+    prevHH = np.concatenate([[1.0], hh[:-1]])
+    newHH = exitEquity > prevHH
+    lastHHIdx = np.maximum.accumulate(np.where(newHH, ends, -1))
+    firstTstamp = start_tstamp if start_tstamp is not None else trades["signal_tstamp"][0]
+    lastHHTstamp = np.where(lastHHIdx >= 0, exitTstamp[np.maximum(lastHHIdx, 0)], firstTstamp)
+    dd = hh - exitEquity
+
+    return {
+        "exit_tstamp": exitTstamp,
+        "result": results,
+        "r": rs,
+        "equity": exitEquity - startEquity,
+        "hh": hh - startEquity,
+        "dd": dd,
+        "maxDD": np.maximum.accumulate(np.maximum(dd, 0)),
+        "underwaterDays": (exitTstamp - lastHHTstamp) / DAY,
+        "tradesInRange": ema(inRange.astype(float), alpha),
+        "percWin": ema(100.0 * winners / inRange, alpha),
+        "avgResult": ema(avgResult, alpha),
+        "avgR": ema(avgR, alpha),
+        "maxWinner": ema(maxWinner, alpha),
+        "maxLoser": ema(maxLoser, alpha)
+    }
@@ -0,0 +1,128 @@
+import math
+import os
+from datetime import datetime
+from typing import List
+
+import numpy as np
+import plotly.graph_objects as go
+
+from kuegi_bot.utils.trading_classes import Bar, Position, PositionStatus
+
+# more points than a screen can show don't add anything but render time and file size
+MAX_POINTS = 4000
+
+
+def bucket_size(count: int, max_points: int) -> int:
+    if max_points is None or max_points <= 0 or count <= max_points:
+        return 1
+    return int(math.ceil(count / max_points))
+
+
+def aggregate_bars(bars: List[Bar], max_points: int = MAX_POINTS) -> List[Bar]:
+    ''' the bars (newest first) merged to at most max_points bars. high and low of the merged bars are the extremes of
+    the bucket, so no spike gets lost. the first bucket is the one with the newest bar and might be incomplete '''
+    size = bucket_size(len(bars), max_points)
+    if size == 1:
+        return bars
+    result = []
+    for start in range(0, len(bars), size):
+        bucket = bars[start:start + size]
+        result.append(Bar(tstamp=bucket[-1].tstamp, open=bucket[-1].open, high=max(b.high for b in bucket),
+                          low=min(b.low for b in bucket), close=bucket[0].close,
+                          volume=sum(b.volume for b in bucket if b.volume is not None)))
+    return result
+
+
+def minmax_decimate(x: list, y: list, max_points: int = MAX_POINTS):
+    ''' reduces a line to at most max_points by keeping only the min and the max point of every bucket (in their
+    original order). gaps (None/nan) stay gaps. x and y are cut to the shorter of both like plotly does '''
+    count = min(len(x), len(y))
+    # up to 3 points per bucket: the start of a gap, min and max
+    size = bucket_size(count, max(1, max_points // 3) if max_points is not None else None)
+    if size == 1:
+        return list(x[:count]), list(y[:count])
+    values = np.array([v if v is not None else np.nan for v in y[:count]], dtype=float)
+    indices = []
+    for start in range(0, count, size):
+        bucket = values[start:start + size]
+        valid = ~np.isnan(bucket)
+        if not valid.any():
+            indices.append(start)
+            continue
+        if not valid.all():
+            # keep the gap visible: a nan point before the extremes
+            indices.append(start + int(np.argmin(valid)))
+        low = start + int(np.nanargmin(bucket))
+        high = start + int(np.nanargmax(bucket))
+        indices.extend(sorted({low, high}))
+    indices = sorted(set(indices))
+    return [x[idx] for idx in indices], [y[idx] if not np.isnan(values[idx]) else None for idx in indices]
+
+
+def candlestick(bars: List[Bar], name: str, max_points: int = MAX_POINTS, center: bool = False) -> go.Candlestick:
+    ''' candlestick of the bars, merged to at most max_points candles. with center the candle is drawn in the middle of
+    its timespan instead of at the open '''
+    plotBars = aggregate_bars(bars, max_points)
+    offset = 0
+    if center and len(bars) > 1:
+        offset = (bars[0].tstamp - bars[1].tstamp) * bucket_size(len(bars), max_points) / 2
+    return go.Candlestick(x=[datetime.fromtimestamp(b.tstamp + offset) for b in plotBars],
+                          open=[b.open for b in plotBars],
+                          high=[b.high for b in plotBars],
+                          low=[b.low for b in plotBars],
+                          close=[b.close for b in plotBars],
+                          name=name)
+
+
+def decimate_figure(fig: go.Figure, max_points: int = MAX_POINTS) -> go.Figure:
+    ''' new figure with all line traces (f.e. the indicators added by the bots) decimated to max_points and drawn
+    with WebGL '''
+    data = []
+    for trace in fig.data:
+        if trace.type == 'scatter' and trace.x is not None and trace.y is not None:
+            props = trace.to_plotly_json()
+            props.pop('type')
+            props['x'], props['y'] = minmax_decimate(trace.x, trace.y, max_points)
+            data.append(go.Scattergl(props))
+        else:
+            data.append(trace)
+    return go.Figure(data=data, layout=fig.layout)
+
+
+def _add_segment(segments: dict, style, x0, y0, x1, y1):
+    xs, ys = segments.setdefault(style, ([], []))
+    xs.extend([datetime.fromtimestamp(x0), datetime.fromtimestamp(x1), None])
+    ys.extend([y0, y1, None])
+
+
+def add_trades(fig: go.Figure, open_positions: List[Position], position_history: List[Position], bars: List[Bar]):
+    ''' the positions as lines from entry to exit. all lines of one style are one WebGL trace (separated by gaps)
+    instead of a shape per position, which plotly can't handle for thousands of positions '''
+    # style: (name, color, width, dash)
+    segments = {}
+    for pos in open_positions:
+        if pos.status == PositionStatus.OPEN:
+            _add_segment(segments, ("open long" if pos.amount > 0 else "open short",
+                                    "Green" if pos.amount > 0 else "Red", 2, "dash"),
+                         pos.entry_tstamp, pos.filled_entry, bars[0].tstamp, bars[0].close)
+    for pos in position_history:
+        if pos.status == PositionStatus.CLOSED:
+            _add_segment(segments, ("long" if pos.amount > 0 else "short",
+                                    "Green" if pos.amount > 0 else "Red", 2, "solid"),
+                         pos.entry_tstamp, pos.filled_entry, pos.exit_tstamp, pos.filled_exit)
+        if pos.status == PositionStatus.MISSED:
+            _add_segment(segments, ("missed", "Blue", 1, "dot"),
+                         pos.signal_tstamp, pos.wanted_entry, pos.exit_tstamp, pos.wanted_entry)
+
+    for (name, color, width, dash), (xs, ys) in segments.items():
+        fig.add_trace(go.Scattergl(x=xs, y=ys, mode='lines', name=name, connectgaps=False,
+                                   line=dict(color=color, width=width, dash=dash)))
+
+
+def write_plot(fig: go.Figure, filename: str, include_plotlyjs=True):
+    ''' writes the figure as standalone html without opening a browser.
+    include_plotlyjs='cdn' makes the file a lot smaller but needs internet to view '''
+    directory = os.path.dirname(filename)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    fig.write_html(filename, include_plotlyjs=include_plotlyjs, auto_open=False)
@@ -0,0 +1,125 @@
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from kuegi_bot.utils.trading_classes import Position, PositionStatus
+
+MAGIC = b"KBJ1"
+HEADER = struct.Struct("<4sI")  # magic, size of a record
+
+# one fixed size record per position. exit_tstamp is first: positions are journaled when they close, so the records
+# are sorted by it and the file itself is the index by time
+COLUMNS = ["exit_tstamp", "signal_tstamp", "entry_tstamp", "amount", "wanted_entry", "initial_stop", "filled_entry",
+           "filled_exit", "exit_equity"]
+RECORD = struct.Struct("<9dii")  # the columns, status, reserved
+DTYPE = np.dtype([(column, "<f8") for column in COLUMNS] + [("status", "<i4"), ("reserved", "<i4")])
+STATUS = list(PositionStatus)
+
+
+def _float(value) -> float:
+    return float(value) if value is not None else float("nan")
+
+
+def pack_position(position: Position) -> bytes:
+    return RECORD.pack(*[_float(getattr(position, column)) for column in COLUMNS],
+                       STATUS.index(position.status), 0)
+
+
+def read_journal(filename: str, start: float = None, end: float = None) -> dict:
+    ''' the positions of the journal with exit_tstamp in [start, end) as arrays per column (+ status as
+    PositionStatus values). missing prices (f.e. of missed positions) are nan '''
+    records = np.zeros(0, dtype=DTYPE)
+    if os.path.exists(filename) and os.path.getsize(filename) >= HEADER.size:
+        with open(filename, 'rb') as file:
+            magic, size = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or size != RECORD.size:
+                raise ValueError("%s is no position journal of this version" % filename)
+            # a record that was cut by a crash is ignored
+            count = (os.path.getsize(filename) - HEADER.size) // RECORD.size
+            records = np.fromfile(file, dtype=DTYPE, count=count)
+    times = records["exit_tstamp"]
+    if start is not None or end is not None:
+        if np.all(times[1:] >= times[:-1]):
+            first = np.searchsorted(times, start, side='left') if start is not None else 0
+            last = np.searchsorted(times, end, side='left') if end is not None else len(records)
+            records = records[first:last]
+        else:
+            mask = np.ones(len(records), dtype=bool)
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times < end
+            records = records[mask]
+    result = {column: records[column] for column in COLUMNS}
+    result["status"] = np.array([STATUS[idx].value for idx in records["status"]], dtype=object)
+    return result
+
+
+class PositionJournal:
+    ''' append only journal of the closed positions of a bot. append() only queues the record, a background thread
+    writes everything that is queued in one go and flushes after every batch '''
+
+    def __init__(self, filename: str, logger=None):
+        self.filename = filename
+        self.logger = logger
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        directory = os.path.dirname(self.filename)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        file = open(self.filename, 'ab')
+        size = file.tell()
+        if size < HEADER.size:
+            file.truncate(0)
+            file.write(HEADER.pack(MAGIC, RECORD.size))
+        elif (size - HEADER.size) % RECORD.size != 0:
+            # cut record of a crash
+            file.truncate(size - (size - HEADER.size) % RECORD.size)
+        return file
+
+    def _write_loop(self):
+        file = self._open()
+        try:
+            running = True
+            while running:
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in batch:
+                    running = False
+                    batch = [record for record in batch if record is not None]
+                file.write(b"".join(batch))
+                file.flush()
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.error("error writing position journal %s: %s" % (self.filename, str(e)))
+        finally:
+            file.close()
+
+    def append(self, position: Position):
+        record = pack_position(position)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._write_loop, daemon=True)
+                self._thread.start()
+        self._queue.put(record)
+
+    def close(self):
+        ''' writes everything that is queued and stops the writer '''
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+            self._thread = None
+
+    def read(self, start: float = None, end: float = None) -> dict:
+        return read_journal(self.filename, start, end)
@@ -0,0 +1,74 @@
+import time
+from functools import wraps
+
+
+class TimingStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, duration: float):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def to_json(self):
+        return {"count": self.count,
+                "avg_us": self.total * 1e6 / self.count if self.count > 0 else 0,
+                "max_us": self.max * 1e6}
+
+
+class Profiler:
+    ''' cumulative time and calls per section. sections are measured by wrapping methods of single instances, so
+    nothing is measured (and nothing costs) unless profiling got enabled for that object.
+    times of nested sections are included in the outer ones (on_tick contains prep_bars etc.) '''
+
+    def __init__(self):
+        self.sections = {}
+        self.started = time.perf_counter()
+
+    def reset(self):
+        for stats in self.sections.values():
+            stats.__init__()
+        self.started = time.perf_counter()
+
+    def stats(self, name: str) -> TimingStats:
+        stats = self.sections.get(name)
+        if stats is None:
+            stats = TimingStats()
+            self.sections[name] = stats
+        return stats
+
+    def wrap(self, obj, method: str, name: str = None):
+        ''' replaces obj.method (on the instance only) with a version that gets timed as section name '''
+        original = getattr(obj, method, None)
+        if original is None or getattr(original, "_profiled", False):
+            return
+        stats = self.stats(name if name is not None else method)
+
+        @wraps(original)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                stats.observe(time.perf_counter() - start)
+
+        timed._profiled = True
+        setattr(obj, method, timed)
+
+    def to_json(self):
+        return {name: stats.to_json() for name, stats in self.sections.items()}
+
+    def report(self) -> str:
+        ''' the sections sorted by their total time '''
+        runtime = time.perf_counter() - self.started
+        lines = ["profile of %.2fs" % runtime]
+        for name, stats in sorted(self.sections.items(), key=lambda item: item[1].total, reverse=True):
+            if stats.count == 0:
+                continue
+            lines.append("%-40s %9.3fs %5.1f%% | calls: %8i | avg: %9.1fus | max: %9.1fus" %
+                         (name, stats.total, 100 * stats.total / runtime if runtime > 0 else 0, stats.count,
+                          stats.total * 1e6 / stats.count, stats.max * 1e6))
+        return "\n".join(lines)
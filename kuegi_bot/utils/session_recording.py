@@ -0,0 +1,145 @@
+import gzip
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+import websocket
+
+from kuegi_bot.utils import http_transport
+
+# kinds of recorded entries
+WS_IN = "in"  # frame received from the exchange
+WS_OUT = "out"  # frame sent to the exchange
+REST = "rest"  # response to a REST request
+
+REDACTED = "<redacted>"
+# query params of signed requests (bybit, binance, ...)
+SECRET_PARAMS = {"api_key", "apikey", "api-key", "sign", "signature", "api_signature", "api-signature"}
+# the token of the telegram bot is part of the path
+SECRET_PATH = re.compile(r"/bot\d+:[A-Za-z0-9_-]+")
+# binance user streams: the listen key works as credential while it's valid. it's the last segment of /ws/<key>
+# urls, a param of SUBSCRIBE frames and in the response that creates it. stream names always contain an "@"
+LISTEN_KEY_PATH = re.compile(r"^/ws/[^/@]+$")
+LISTEN_KEY_BODY = re.compile(r'"listenKey"\s*:\s*"[^"]*"')
+
+
+def redact_url(url: str) -> str:
+    ''' the url without the signing params and tokens. the replay only needs method and path '''
+    parts = urlparse(url)
+    path = SECRET_PATH.sub("/bot" + REDACTED, parts.path)
+    path = LISTEN_KEY_PATH.sub("/ws/" + REDACTED, path)
+    query = urlencode([(key, REDACTED if key.lower() in SECRET_PARAMS else value)
+                       for key, value in parse_qsl(parts.query, keep_blank_values=True)], safe="<>")
+    return urlunparse(parts._replace(path=path, query=query))
+
+
+def redact_frame(payload: str) -> str:
+    ''' auth frames sent on a websocket (bybit/bitmex "op", phemex "method") with the key and signature replaced,
+    listen keys in binance (UN)SUBSCRIBE frames too. the replay only counts the client frames and maps their id '''
+    if "auth" not in payload and "SUBSCRIBE" not in payload:
+        return payload
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        return payload
+    if not isinstance(message, dict):
+        return payload
+    for field, argsField in [("op", "args"), ("method", "params")]:
+        if "auth" in str(message.get(field, "")).lower() and isinstance(message.get(argsField), list):
+            message[argsField] = [REDACTED for _ in message[argsField]]
+            return json.dumps(message)
+    if str(message.get("method", "")).endswith("SUBSCRIBE") and isinstance(message.get("params"), list):
+        params = [REDACTED if isinstance(param, str) and "@" not in param else param for param in message["params"]]
+        if params != message["params"]:
+            message["params"] = params
+            return json.dumps(message)
+    return payload
+
+
+def redact_body(body: str) -> str:
+    ''' the response without listen keys '''
+    if body is None or "listenKey" not in body:
+        return body
+    return LISTEN_KEY_BODY.sub('"listenKey":"' + REDACTED + '"', body)
+
+
+class SessionRecorder:
+    ''' writes raw websocket frames (both directions) and REST responses with their timestamp to a gzipped file.
+    one json array per line: [time, kind, channel, payload] for ws frames (channel is the ws url) and
+    [time, "rest", "METHOD url", body, status] for REST responses.
+    api keys, signatures, tokens and listen keys are redacted before they get written '''
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.file = gzip.open(filename, "wt", encoding="utf-8")
+        self.entries = 0
+        self._lock = threading.Lock()
+
+    def record_frame(self, channel: str, direction: str, payload):
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        if direction == WS_OUT:
+            payload = redact_frame(payload)
+        self._write([time.time(), direction, redact_url(channel), payload])
+
+    def record_response(self, method: str, url: str, status: int, body: str):
+        self._write([time.time(), REST, method.upper() + " " + redact_url(url), redact_body(body), status])
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + "\n"
+        with self._lock:
+            if self.file is not None:
+                self.file.write(line)
+                self.entries += 1
+
+    def close(self):
+        with self._lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_session(filename: str):
+    ''' all entries of a recorded session, in the order of recording '''
+    with gzip.open(filename, "rt", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if len(line.strip()) > 0]
+
+
+_recorder: SessionRecorder = None
+
+
+def get_recorder() -> SessionRecorder:
+    return _recorder
+
+
+def start_recording(filename: str) -> SessionRecorder:
+    global _recorder
+    stop_recording()
+    _recorder = SessionRecorder(filename)
+    return _recorder
+
+
+def stop_recording():
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
+
+
+def open_websocket(url: str, **kwargs) -> websocket.WebSocketApp:
+    ''' creates the WebSocketApp for the url (redirected by the shared transport, f.e. to a replay server).
+    if a session gets recorded, frames sent on this socket are recorded too (received frames get recorded by the
+    MessageRouter) '''
+    ws = websocket.WebSocketApp(http_transport.get_transport().resolve_url(url), **kwargs)
+    recorder = get_recorder()
+    if recorder is not None:
+        send = ws.send
+
+        def recording_send(data, *args, **kw):
+            recorder.record_frame(url, WS_OUT, data)
+            return send(data, *args, **kw)
+
+        ws.send = recording_send
+    return ws
@@ -0,0 +1,296 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from kuegi_bot.utils import session_recording
+from kuegi_bot.utils.http_transport import HttpTransport
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class RecordedChannel:
+    ''' the recorded frames of one websocket url: list of (time, direction, payload) '''
+
+    def __init__(self, url):
+        self.url = url
+        self.frames = []
+
+
+class ReplaySession:
+    ''' plays the frames of one channel to one connected client.
+    received frames are sent at their recorded pace (divided by speed, speed 0 = as fast as possible).
+    frames sent by the client in the recording (auth, subscribe) act as gates: frames recorded after the n-th client
+    frame are only sent after the live client sent its n-th frame. ids of the client requests (f.e. phemex auth)
+    are mapped from the recorded to the live ones in the replies '''
+
+    def __init__(self, server, channel: RecordedChannel, wfile, rfile):
+        self.server = server
+        self.channel = channel
+        self.wfile = wfile
+        self.rfile = rfile
+        self.clientFrames = deque()
+        self.clientCondition = threading.Condition()
+        self.idMapping = {}
+        self.closed = False
+        self.sent = 0
+        self._writeLock = threading.Lock()
+
+    def run(self):
+        reader = threading.Thread(target=self.read_client, daemon=True)
+        reader.start()
+        baseReal = time.monotonic()
+        baseRecorded = self.channel.frames[0][0] if len(self.channel.frames) > 0 else 0
+        for recordedTime, direction, payload in self.channel.frames:
+            if self.closed or self.server.stopped:
+                return
+            if direction == session_recording.WS_OUT:
+                self.wait_for_client(payload)
+                baseReal = time.monotonic()
+                baseRecorded = recordedTime
+                continue
+            if self.server.speed > 0:
+                delay = (recordedTime - baseRecorded) / self.server.speed - (time.monotonic() - baseReal)
+                if delay > 0:
+                    time.sleep(delay)
+            self.send_text(self.map_ids(payload))
+            self.sent += 1
+        # keep the connection open till the client closes it
+        while not self.closed and not self.server.stopped:
+            time.sleep(0.1)
+
+    def wait_for_client(self, recordedPayload):
+        with self.clientCondition:
+            self.clientCondition.wait_for(lambda: len(self.clientFrames) > 0 or self.closed or self.server.stopped,
+                                          timeout=self.server.gateTimeout)
+            live = self.clientFrames.popleft() if len(self.clientFrames) > 0 else None
+        if live is None:
+            return
+        try:
+            recordedId = json.loads(recordedPayload).get("id")
+            liveId = json.loads(live).get("id")
+            if recordedId is not None and liveId is not None:
+                self.idMapping[recordedId] = liveId
+        except (ValueError, AttributeError):
+            pass  # not a json object, nothing to map
+
+    def map_ids(self, payload: str) -> str:
+        if len(self.idMapping) == 0 or '"id"' not in payload:
+            return payload
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return payload
+        if isinstance(message, dict) and message.get("id") in self.idMapping:
+            message["id"] = self.idMapping[message["id"]]
+            return json.dumps(message)
+        return payload
+
+    def read_client(self):
+        try:
+            while not self.closed:
+                opcode, data = read_frame(self.rfile)
+                if opcode == 0x8:  # close
+                    break
+                elif opcode == 0x9:  # ping
+                    self.send_frame(0xA, data)
+                elif opcode == 0x1:
+                    with self.clientCondition:
+                        self.clientFrames.append(data.decode("utf-8"))
+                        self.clientCondition.notify_all()
+        except (OSError, ValueError):
+            pass
+        self.closed = True
+        with self.clientCondition:
+            self.clientCondition.notify_all()
+
+    def send_text(self, text: str):
+        self.send_frame(0x1, text.encode("utf-8"))
+
+    def send_frame(self, opcode: int, data: bytes):
+        header = bytes([0x80 | opcode])
+        if len(data) < 126:
+            header += bytes([len(data)])
+        elif len(data) < 65536:
+            header += bytes([126]) + struct.pack(">H", len(data))
+        else:
+            header += bytes([127]) + struct.pack(">Q", len(data))
+        with self._writeLock:
+            try:
+                self.wfile.write(header + data)
+                self.wfile.flush()
+            except OSError:
+                self.closed = True
+
+
+def read_frame(rfile):
+    ''' reads one (masked) client frame, returns (opcode, payload). continuation frames are not supported '''
+    head = rfile.read(2)
+    if len(head) < 2:
+        raise ValueError("connection closed")
+    opcode = head[0] & 0x0F
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", rfile.read(8))[0]
+    mask = rfile.read(4) if head[1] & 0x80 else None
+    data = rfile.read(length)
+    if mask is not None:
+        data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+    return opcode, data
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            self.handle_websocket()
+        else:
+            self.handle_rest()
+
+    def do_POST(self):
+        self.handle_rest()
+
+    def do_PUT(self):
+        self.handle_rest()
+
+    def do_DELETE(self):
+        self.handle_rest()
+
+    def handle_rest(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length > 0:
+            self.rfile.read(length)
+        status, body = self.server.replay.next_response(self.command, self.path)
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_websocket(self):
+        channel = self.server.replay.channel_for(self.path)
+        if channel is None:
+            self.send_error(404, "no recorded websocket for " + self.path)
+            return
+        accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WS_GUID).encode()).digest())
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept.decode())
+        self.end_headers()
+        self.wfile.flush()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        session = ReplaySession(self.server.replay, channel, self.wfile, self.rfile)
+        self.server.replay.sessions.append(session)
+        session.run()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer:
+    ''' serves a recorded session (see session_recording) on a local port: websocket channels and REST responses.
+    websocket frames get replayed per connection at the recorded pace divided by speed (0 = as fast as possible).
+    REST responses are returned per method and path in the recorded order, the last one is repeated when
+    the recorded ones are used up.
+    redirect(transport) points the recorded hosts of the shared transport to this server, so the unchanged exchange
+    interfaces (and LiveTrading on top of them) run against the recording '''
+
+    def __init__(self, filename: str, speed: float = 1, host: str = "127.0.0.1", port: int = 0,
+                 gateTimeout: float = 10):
+        self.speed = speed
+        self.gateTimeout = gateTimeout
+        self.stopped = False
+        self.channels = {}  # path -> RecordedChannel
+        self.responses = {}  # "METHOD path" -> deque of (status, body)
+        self.restHosts = set()
+        self.sessions = []
+        self._lock = threading.Lock()
+        self.load(session_recording.read_session(filename))
+        self.httpd = ThreadingHTTPServer((host, port), ReplayHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.replay = self
+        self.thread = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def load(self, entries):
+        for entry in entries:
+            if entry[1] == session_recording.REST:
+                method, url = entry[2].split(" ", 1)
+                parts = urlparse(url)
+                self.restHosts.add(parts.scheme + "://" + parts.netloc)
+                key = method + " " + parts.path
+                self.responses.setdefault(key, deque()).append((entry[4], entry[3]))
+            else:
+                path = urlparse(entry[2]).path
+                if path not in self.channels:
+                    self.channels[path] = RecordedChannel(entry[2])
+                self.channels[path].frames.append((entry[0], entry[1], entry[3]))
+
+    def recorded_hosts(self):
+        hosts = set(self.restHosts)
+        for channel in self.channels.values():
+            parts = urlparse(channel.url)
+            hosts.add(parts.scheme + "://" + parts.netloc)
+        return hosts
+
+    def channel_for(self, path: str):
+        # the recording has redacted paths (binance listen key)
+        return self.channels.get(urlparse(session_recording.redact_url(path)).path)
+
+    def next_response(self, method: str, path: str):
+        # the recording has redacted paths (telegram token, binance listen key)
+        key = method + " " + urlparse(session_recording.redact_url(path)).path
+        with self._lock:
+            queue = self.responses.get(key)
+            if queue is None or len(queue) == 0:
+                return 404, json.dumps({"error": "no recorded response for " + key})
+            if len(queue) > 1:
+                return queue.popleft()
+            return queue[0]
+
+    def redirect(self, transport: HttpTransport):
+        for host in self.recorded_hosts():
+            local = ("ws://" if host.startswith("ws") else "http://") + "127.0.0.1:%i" % self.port
+            transport.redirect(host, local)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="replayServer", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped = True
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    # usage: python -m kuegi_bot.utils.session_replay <recording> [speed] [port]
+    server = ReplayServer(sys.argv[1], speed=float(sys.argv[2]) if len(sys.argv) > 2 else 1,
+                          port=int(sys.argv[3]) if len(sys.argv) > 3 else 0).start()
+    print("replaying %s on port %i" % (sys.argv[1], server.port))
+    for path, recorded in server.channels.items():
+        print("ws %s: %i frames" % (recorded.url, len(recorded.frames)))
+    for key, responses in server.responses.items():
+        print("rest %s: %i responses" % (key, len(responses)))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
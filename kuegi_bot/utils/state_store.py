@@ -0,0 +1,149 @@
+import json
+import os
+
+# WAL records after which the state gets compacted to a new snapshot
+COMPACT_EVERY = 1000
+
+
+def write_atomic(filename: str, data: bytes, fsync: bool = False):
+    ''' writes to a temp file and renames it, so readers see either the old or the new file, never half of it.
+    with fsync the data is on disk before the rename (survives a power loss, not only a dying process) '''
+    directory = os.path.dirname(filename)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    tmpFile = filename + ".tmp"
+    with open(tmpFile, 'wb') as file:
+        file.write(data)
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(tmpFile, filename)
+
+
+def diff_state(old: dict, new: dict):
+    ''' the changes from old to new: changed fields in "set", changed positions by id in "positions" (None for
+    positions that are gone). None if nothing changed '''
+    changes = {key: value for key, value in new.items() if key != "positions" and old.get(key) != value}
+    oldPositions = {pos["id"]: pos for pos in old.get("positions", [])}
+    newPositions = {pos["id"]: pos for pos in new.get("positions", [])}
+    positions = {posId: pos for posId, pos in newPositions.items() if oldPositions.get(posId) != pos}
+    for posId in oldPositions.keys():
+        if posId not in newPositions:
+            positions[posId] = None
+    if len(changes) == 0 and len(positions) == 0:
+        return None
+    diff = {}
+    if len(changes) > 0:
+        diff["set"] = changes
+    if len(positions) > 0:
+        diff["positions"] = positions
+    return diff
+
+
+def apply_diff(state: dict, diff: dict) -> dict:
+    ''' the new state (the old one is not changed). positions keep their order, new ones are appended '''
+    result = dict(state)
+    result.update(diff.get("set", {}))
+    if "positions" in diff:
+        positions = list(state.get("positions", []))
+        for posId, pos in diff["positions"].items():
+            idx = next((i for i, p in enumerate(positions) if p["id"] == posId), None)
+            if pos is None:
+                if idx is not None:
+                    del positions[idx]
+            elif idx is not None:
+                positions[idx] = pos
+            else:
+                positions.append(pos)
+        result["positions"] = positions
+    return result
+
+
+class StateStore:
+    ''' persists a json state (the open positions of a bot) as snapshot + write-ahead log.
+    save() only appends the diff to the last state as one line to <filename>.wal, every compact_every records (and on
+    close) the state is written as new snapshot to <filename> via temp file and rename. the snapshot knows the
+    sequence number of the last record it contains, so a crash between snapshot and truncating the log loses nothing.
+    load() replays the log on the snapshot, a last record that was cut by a crash is dropped.
+    the log is flushed after every record, which is safe against the process dying. fsync also against power loss '''
+
+    def __init__(self, filename: str, compact_every: int = COMPACT_EVERY, fsync: bool = False):
+        self.filename = filename
+        self.wal_filename = filename + ".wal"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.state: dict = None
+        self.seq = 0
+        self.records = 0  # in the log since the last snapshot
+        self._wal = None
+
+    def load(self) -> dict:
+        ''' the last saved state, None if there is none '''
+        state = None
+        seq = 0
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as file:
+                state = json.load(file)
+            seq = state.pop("wal_seq", 0)
+        records = 0
+        if os.path.exists(self.wal_filename):
+            valid = 0
+            with open(self.wal_filename, 'rb') as file:
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    valid += len(line)
+                    if record["seq"] <= seq:
+                        continue  # already in the snapshot
+                    state = apply_diff(state if state is not None else {}, record)
+                    seq = record["seq"]
+                    records += 1
+            if valid < os.path.getsize(self.wal_filename):
+                with open(self.wal_filename, 'r+b') as file:
+                    file.truncate(valid)
+        self.state = state
+        self.seq = seq
+        self.records = records
+        return state
+
+    def save(self, state: dict):
+        if self.state is None:
+            self.state = state
+            self.compact()
+            return
+        diff = diff_state(self.state, state)
+        if diff is None:
+            return
+        self.seq += 1
+        diff["seq"] = self.seq
+        if self._wal is None:
+            self._wal = open(self.wal_filename, 'ab')
+        self._wal.write(json.dumps(diff).encode("utf-8") + b"\n")
+        self._wal.flush()
+        if self.fsync:
+            os.fsync(self._wal.fileno())
+        self.state = state
+        self.records += 1
+        if self.records >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        ''' writes the state as snapshot and starts a new log '''
+        data = dict(self.state)
+        data["wal_seq"] = self.seq
+        write_atomic(self.filename, json.dumps(data, sort_keys=False, indent=4).encode("utf-8"), self.fsync)
+        if self._wal is not None:
+            self._wal.close()
+        self._wal = open(self.wal_filename, 'wb')
+        self.records = 0
+
+    def close(self):
+        if self.state is not None and self.records > 0:
+            self.compact()
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
@@ -1,51 +1,149 @@
-import requests
 import threading
+from collections import OrderedDict
+
+from kuegi_bot.utils.http_transport import get_transport
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+
+class ChatQueue:
+	''' pending messages of one chat. messages with the same debounceId replace each other '''
+	def __init__(self):
+		self.messages = OrderedDict()
+		self.dropped = 0
+		self.nextId = 0
+
+	def add(self, message, debounceId):
+		if debounceId is None:
+			debounceId = "__msg" + str(self.nextId)
+			self.nextId += 1
+		else:
+			self.messages.pop(debounceId, None) # keep order of arrival for the newest version
+		self.messages[debounceId] = message
+
+	def take_all(self):
+		messages = list(self.messages.values())
+		dropped = self.dropped
+		self.messages = OrderedDict()
+		self.dropped = 0
+		return messages, dropped
+
 
 class TelegramBot:
+	''' sends messages to telegram from a background thread, so the trading loop never waits for the telegram api.
+	messages are collected per chat and sent as one message per interval (settings.batchInterval, default 5 seconds).
+	if more than settings.maxQueueSize messages are pending for a chat, new ones get dropped and summarised in the next batch '''
 	def __init__(self,logger,settings):
 		self.token= settings.token
 		self.logChatId= settings.logChatId
 		self.executionChannel= settings.executionChannel
 		self.logger= logger
-		self.timer= None
-		self.messagesToSend = {}
+		self.batchInterval= settings.batchInterval if settings.batchInterval is not None else 5
+		self.maxQueueSize= settings.maxQueueSize if settings.maxQueueSize is not None else 100
+		self.chats = {}
+		self.sent = 0
+		self.failed = 0
+		self.closed = False
+		self.condition = threading.Condition()
+		self.worker = threading.Thread(target=self.__run, name="telegram", daemon=True)
+		self.worker.start()
 
 	def send_log(self,log_message,debounceId:str= None):
+		''' messages with the same debounceId that are sent within one interval get coalesced, only the newest one
+		is sent. only use it for repeated messages of the same kind (f.e. "update:" + order id), it replaces
+		whatever else was sent with that id '''
 		if self.logChatId is None:
 			self.logger.warn("missing telegram logChatId")
 			return
-
-		self.__internal_send(self.logChatId, log_message)
-		''' 
-		# if doing debounce, but might have problems with id collision on multiple ids
-		if debounceId is None:
-			debounceId= log_message
-		if self.timer is not None:
-			self.timer.cancel()
-
-		self.timer= threading.Timer(interval=35, function= self.__internal_send_logs)
-		self.timer.start()
-		self.messagesToSend[debounceId] = log_message
-		'''
+		self.__enqueue(self.logChatId, log_message, debounceId)
 
 	def send_execution(self, signal_message):
 		if self.executionChannel is not None:
-			self.__internal_send(self.executionChannel, signal_message)
+			self.__enqueue(self.executionChannel, signal_message, None)
+
+	def flush(self):
+		''' sends all pending messages now, from the calling thread '''
+		with self.condition:
+			batches = self.__take_batches()
+		self.__send_batches(batches)
+
+	def close(self):
+		''' stops the background thread and sends what is still pending '''
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+		self.worker.join(timeout=self.batchInterval + 10)
+		self.flush()
+
+	def __enqueue(self, chat_id, message, debounceId):
+		with self.condition:
+			chat = self.chats.get(chat_id)
+			if chat is None:
+				chat = ChatQueue()
+				self.chats[chat_id] = chat
+			if debounceId is not None and debounceId in chat.messages:
+				chat.add(message, debounceId)
+			elif len(chat.messages) >= self.maxQueueSize:
+				chat.dropped += 1
+			else:
+				chat.add(message, debounceId)
+
+	def __take_batches(self):
+		''' needs to be called with the condition held '''
+		batches = []
+		for chat_id, chat in self.chats.items():
+			messages, dropped = chat.take_all()
+			if dropped > 0:
+				messages.append("... %i more messages dropped (queue full)" % dropped)
+			if len(messages) > 0:
+				batches.append((chat_id, messages))
+		return batches
+
+	def __run(self):
+		while True:
+			with self.condition:
+				if not self.closed:
+					self.condition.wait(self.batchInterval)
+				if self.closed:
+					return
+				batches = self.__take_batches()
+			self.__send_batches(batches)
+
+	def __send_batches(self, batches):
+		for chat_id, messages in batches:
+			for text in TelegramBot.join_messages(messages):
+				try:
+					self.__internal_send(chat_id, text)
+				except Exception as e:
+					self.failed += 1
+					self.logger.warn("error sending telegram messages: " + str(e))
 
-	def __internal_send_logs(self):
-		self.timer= None
-		for key, msg in self.messagesToSend.items():
-			self.__internal_send(self.logChatId,msg)
-		self.messagesToSend= {}
+	@staticmethod
+	def join_messages(messages, maxLength: int = TELEGRAM_MAX_MESSAGE_LENGTH):
+		''' joins the messages into as few texts as possible within the length limit of telegram '''
+		texts = []
+		current = ""
+		for msg in messages:
+			msg = msg[:maxLength]
+			if len(current) > 0 and len(current) + 1 + len(msg) > maxLength:
+				texts.append(current)
+				current = ""
+			current = msg if len(current) == 0 else current + "\n" + msg
+		if len(current) > 0:
+			texts.append(current)
+		return texts
 
 	def __internal_send(self,chat_id,message):
 		if self.token is None:
 			self.logger.warn("missing telegram token or chatId")
 			return
 
-		url = 'https://api.telegram.org/bot' + self.token + '/sendMessage?chat_id=' + chat_id+ '&text=' + message
+		url = 'https://api.telegram.org/bot' + self.token + '/sendMessage'
 
-		result= requests.get(url).json()
+		result= get_transport().request("POST", url, endpoint="/sendMessage",
+										data={'chat_id': chat_id, 'text': message}).json()
 		if not result["ok"]:
+			self.failed += 1
 			self.logger.warning("error sending telegram messages "+str(result))
-	
\ No newline at end of file
+		else:
+			self.sent += 1
@@ -1,11 +1,12 @@
 import math
 from typing import List
-from time import sleep
 from datetime import datetime
 
 import atexit
 from enum import Enum
 
+from kuegi_bot.utils.order_dispatcher import OrderDispatcher
+
 
 class AccountPosition:
     def __init__(self, symbol: str, quantity: float, avgEntryPrice: float, walletBalance: float = 0):
@@ -150,6 +151,20 @@ class OrderInterface:
     def cancel_order(self, order: Order):
         pass
 
+    # batch versions, implementations with native support can do this in one go
+
+    def send_orders(self, orders: List[Order]):
+        for order in orders:
+            self.send_order(order)
+
+    def update_orders(self, orders: List[Order]):
+        for order in orders:
+            self.update_order(order)
+
+    def cancel_orders(self, orders: List[Order]):
+        for order in orders:
+            self.cancel_order(order)
+
 class PositionStatus(Enum):
     PENDING = "pending"
     TRIGGERED = "triggered"
@@ -240,50 +255,187 @@ def process_low_tf_bars(subbars: List[Bar], timeframe_minutes, start_offset_minu
     return result
 
 
+class BarBuffer:
+    ''' fixed capacity ringbuffer for (sub)bars, indexed by the start time of the bar.
+    upserts are O(1), once the buffer is full the oldest bars get overwritten '''
+
+    def __init__(self, capacity: int, resolution_minutes: int = 1):
+        self.capacity = max(1, int(capacity))
+        self.resolution = resolution_minutes * 60
+        self.newest_tstamp = None
+        self._slots: List[Bar] = [None] * self.capacity
+
+    def _index(self, tstamp) -> int:
+        return int(tstamp // self.resolution)
+
+    def clear(self):
+        self.newest_tstamp = None
+        self._slots = [None] * self.capacity
+
+    def is_empty(self) -> bool:
+        return self.newest_tstamp is None
+
+    def upsert(self, bar: Bar) -> bool:
+        ''' inserts the bar or replaces the one with the same tstamp.
+        returns True if the bar is newer than all known bars '''
+        if self.newest_tstamp is not None and \
+                self._index(bar.tstamp) <= self._index(self.newest_tstamp) - self.capacity:
+            return False  # older than the retention, ignore
+        self._slots[self._index(bar.tstamp) % self.capacity] = bar
+        if self.newest_tstamp is None or bar.tstamp > self.newest_tstamp:
+            self.newest_tstamp = bar.tstamp
+            return True
+        return False
+
+    def newest(self) -> Bar:
+        if self.newest_tstamp is None:
+            return None
+        return self._slots[self._index(self.newest_tstamp) % self.capacity]
+
+    def newest_first(self) -> List[Bar]:
+        ''' all bars within the retention, ordered newest bar = index 0 (gaps are skipped) '''
+        result: List[Bar] = []
+        if self.newest_tstamp is None:
+            return result
+        start = self._index(self.newest_tstamp)
+        for idx in range(start, start - self.capacity, -1):
+            bar = self._slots[idx % self.capacity]
+            # slots of an older round in the ring are not valid anymore
+            if bar is not None and self._index(bar.tstamp) == idx:
+                result.append(bar)
+        return result
+
+    def __len__(self):
+        return len(self.newest_first())
+
+
 class ExchangeInterface(OrderInterface):
+    # max number of orders per request for exchanges with batch endpoints. 1 means no batch support
+    MAX_BATCH_SIZE = 1
+
     def __init__(self, settings, logger,on_tick_callback=None):
         self.settings = settings
         self.logger = logger
         self.symbol = None
         self.on_tick_callback= on_tick_callback
+        self.latency_tracer = None  # LatencyTracer of the engine, if set order requests are traced
+        self.order_requests = {}  # (action, result) -> count of finished order requests
+        self.order_dispatcher = OrderDispatcher(logger=logger,
+                                                max_workers=settings.ORDER_DISPATCH_WORKERS or 2,
+                                                base_delay=settings.API_ERROR_INTERVAL or 1,
+                                                max_delay=settings.API_ERROR_MAX_INTERVAL or 30,
+                                                deadline_seconds=settings.ORDER_DEADLINE or 60,
+                                                on_done=self._order_request_done)
 
         atexit.register(lambda: self.exit())
 
     def cancel_order(self, order: Order):
         self.logger.info("Canceling: %s" % order.id)
-        while True:
-            try:
-                self.internal_cancel_order(order)
-            except ValueError as e:
-                self.logger.info(e)
-                sleep(self.settings.API_ERROR_INTERVAL)
-            else:
-                break
+        self.order_dispatcher.submit("cancel", {order.id: order}, lambda attempt: self.internal_cancel_order(order),
+                                     self._trace())
 
     def send_order(self, order: Order):
         self.logger.info("Placing: %s" % order.print_info())
-        while True:
-            try:
-                self.internal_send_order(order)
-            except ValueError as e:
-                self.logger.info(e)
-                sleep(self.settings.API_ERROR_INTERVAL)
-            else:
-                break
+        self.order_dispatcher.submit("send", {order.id: order},
+                                     lambda attempt: self._send_idempotent([order], attempt), self._trace())
 
     def update_order(self, order: Order):
         self.logger.info("Updating: %s" % order.print_info())
-        while True:
-            try:
-                self.internal_update_order(order)
-            except ValueError as e:
-                self.logger.info(e)
-                sleep(self.settings.API_ERROR_INTERVAL)
-            else:
-                break
+        self.order_dispatcher.submit("update", {order.id: order},
+                                     lambda attempt: self._update_idempotent([order], attempt), self._trace())
+
+    def cancel_orders(self, orders: List[Order]):
+        if self.MAX_BATCH_SIZE <= 1 or len(orders) <= 1:
+            super().cancel_orders(orders)
+            return
+        for batch in self._batches(orders):
+            self.logger.info("Canceling: %s" % ", ".join([order.id for order in batch]))
+            self.order_dispatcher.submit("cancel", self._keyed(batch),
+                                         lambda attempt, batch=batch: self.internal_cancel_orders(batch),
+                                         self._trace())
+
+    def send_orders(self, orders: List[Order]):
+        if self.MAX_BATCH_SIZE <= 1 or len(orders) <= 1:
+            super().send_orders(orders)
+            return
+        for batch in self._batches(orders):
+            self.logger.info("Placing: %s" % ", ".join([order.print_info() for order in batch]))
+            self.order_dispatcher.submit("send", self._keyed(batch),
+                                         lambda attempt, batch=batch: self._send_idempotent(batch, attempt),
+                                         self._trace())
+
+    def update_orders(self, orders: List[Order]):
+        if self.MAX_BATCH_SIZE <= 1 or len(orders) <= 1:
+            super().update_orders(orders)
+            return
+        for batch in self._batches(orders):
+            self.logger.info("Updating: %s" % ", ".join([order.print_info() for order in batch]))
+            self.order_dispatcher.submit("update", self._keyed(batch),
+                                         lambda attempt, batch=batch: self._update_idempotent(batch, attempt),
+                                         self._trace())
+
+    def _trace(self):
+        return self.latency_tracer.order_submitted() if self.latency_tracer is not None else None
+
+    def _batches(self, orders: List[Order]):
+        return [orders[idx:idx + self.MAX_BATCH_SIZE] for idx in range(0, len(orders), self.MAX_BATCH_SIZE)]
+
+    @staticmethod
+    def _keyed(orders: List[Order]) -> dict:
+        result = {}
+        for order in orders:
+            result[order.id] = order
+        return result
+
+    def orders_in_flight(self) -> List[Order]:
+        """orders with requests not yet confirmed by the exchange, in the state the bot wants them to be"""
+        return self.order_dispatcher.pending_orders()
+
+    def _send_idempotent(self, orders: List[Order], attempt: int, known: set = None):
+        ''' known: ids of the orders the exchange has, defaults to all orders of the exchange '''
+        if attempt > 1:
+            # a failed try might still have reached the exchange. the client order id is unique, so if the
+            # exchange knows it, we are done with that one
+            if known is None:
+                known = set([o.id for o in self.get_orders()])
+            for order in orders:
+                if order.id in known:
+                    self.logger.info("order %s already known to the exchange, not sending again" % order.id)
+            orders = [order for order in orders if order.id not in known]
+        if len(orders) == 1:
+            self.internal_send_order(orders[0])
+        elif len(orders) > 1:
+            self.internal_send_orders(orders)
+
+    def _update_idempotent(self, orders: List[Order], attempt: int):
+        ''' exchanges that can't update in place override this to resume a failed update where it stopped '''
+        if len(orders) == 1:
+            self.internal_update_order(orders[0])
+        elif len(orders) > 1:
+            self.internal_update_orders(orders)
+
+    def _order_request_done(self, request, error):
+        key = (request.action, "ok" if error is None else "failed")
+        self.order_requests[key] = self.order_requests.get(key, 0) + 1
+        if self.latency_tracer is not None:
+            self.latency_tracer.order_done(request.trace, request.action, error)
+        if error is not None:
+            self.logger.error("failed to %s order %s: %s" % (request.action, request.key_info(), str(error)))
+            if request.action == "send":
+                for order in request.orders.values():
+                    order.active = False
+            if request.action == "update":
+                # an update might have canceled the order before it failed (cancel + resend), then it is gone
+                open = set([o.id for o in self.get_orders() if o.active])
+                for order in request.orders.values():
+                    if order.id not in open:
+                        order.active = False
+        # trigger a tick so the bot syncs with the new state of the orders
+        if self.on_tick_callback is not None:
+            self.on_tick_callback(fromAccountAction=True)
 
     def exit(self):
-        pass
+        self.order_dispatcher.shutdown()
 
     def internal_cancel_order(self, order: Order):
         pass
@@ -294,6 +446,20 @@ class ExchangeInterface(OrderInterface):
     def internal_update_order(self, order: Order):
         pass
 
+    # batch requests, only called with up to MAX_BATCH_SIZE orders. override with the native batch endpoints
+
+    def internal_cancel_orders(self, orders: List[Order]):
+        for order in orders:
+            self.internal_cancel_order(order)
+
+    def internal_send_orders(self, orders: List[Order]):
+        for order in orders:
+            self.internal_send_order(order)
+
+    def internal_update_orders(self, orders: List[Order]):
+        for order in orders:
+            self.internal_update_order(order)
+
     def get_orders(self) -> List[Order]:
         return []
 
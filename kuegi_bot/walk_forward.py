@@ -0,0 +1,204 @@
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from kuegi_bot.backtest_engine import BackTest, StreamingBackTest
+from kuegi_bot.utils.trading_classes import Bar, Symbol
+
+
+def grid_params(min, max, steps):
+    ''' all combinations of the parameter ranges (inclusive), like runOpti in backtest.py '''
+    current = min[:]
+    while True:
+        yield current[:]
+        idx = 0
+        while idx < len(current):
+            current[idx] = round(current[idx] + steps[idx], 10)  # no float noise in the params
+            if current[idx] <= max[idx]:
+                break
+            current[idx] = min[idx]
+            idx += 1
+        if idx == len(current):
+            return
+
+
+def random_params(min, max, steps, count: int, seed=None):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        yield [min[i] + rnd.randint(0, int((max[i] - min[i]) / steps[i])) * steps[i] for i in range(len(min))]
+
+
+class EquityCurve:
+    ''' equity after every bar of one backtest over the full series, oldest first '''
+
+    def __init__(self, params, tstamps: List[int], equity: List[float]):
+        self.params = params
+        self.tstamps = tstamps
+        self.equity = equity
+
+    def stats(self, start: int, end: int):
+        ''' (profit, maxDD) between the bar indices start and end (inclusive), both relative to the equity at start '''
+        base = self.equity[start]
+        hh = base
+        maxDD = 0
+        for value in self.equity[start:end + 1]:
+            hh = max(hh, value)
+            maxDD = max(maxDD, hh - value)
+        return (self.equity[end] - base) / base, maxDD / base
+
+
+def score(profit: float, maxDD: float) -> float:
+    ''' the rel of the backtest: profit per drawdown '''
+    return profit / maxDD if maxDD > 0 else profit * 100
+
+
+class WalkForwardWindow:
+    def __init__(self, train_start: int, train_end: int, test_start: int, test_end: int):
+        # bar indices (oldest first), inclusive
+        self.train_start = train_start
+        self.train_end = train_end
+        self.test_start = test_start
+        self.test_end = test_end
+        self.params = None
+        self.train_score = None
+        self.test_profit = None
+        self.test_dd = None
+        self.test_equity: List[float] = None  # relative to the start of the test, if known
+
+
+_worker_bars: List[Bar] = None
+_worker_factory = None
+_worker_symbol: Symbol = None
+
+
+def _init_worker(bars, bot_factory, symbol):
+    global _worker_bars, _worker_factory, _worker_symbol
+    _worker_bars = bars
+    _worker_factory = bot_factory
+    _worker_symbol = symbol
+
+
+def _run_curve(params) -> EquityCurve:
+    tstamps = []
+    equity = []
+
+    def on_equity(tstamp, value):
+        tstamps.append(tstamp)
+        equity.append(value)
+
+    backtest = StreamingBackTest(_worker_factory(params), reversed(_worker_bars), symbol=_worker_symbol,
+                                 extra_lookback=len(_worker_bars), on_equity=on_equity)
+    # the bars used for the bot init got no equity yet
+    start = [bar.tstamp for bar in reversed(backtest.bars)]
+    backtest.run()
+    return EquityCurve(params, start + tstamps, [backtest.initialEquity] * len(start) + equity)
+
+
+def _run_test(params, start: int, end: int):
+    bot = _worker_factory(params)
+    # BackTest starts trading after min_bars_needed + 1 bars
+    first = max(0, start - bot.min_bars_needed() - 1)
+    bars = _worker_bars[len(_worker_bars) - 1 - end:len(_worker_bars) - first]
+    backtest = BackTest(bot, bars, symbol=_worker_symbol).run()
+    return backtest.account.equity / backtest.initialEquity - 1, backtest.maxDD / backtest.initialEquity
+
+
+class WalkForward:
+    ''' walk forward optimization: the bars are cut into rolling windows of train_bars followed by test_bars.
+    per window the params with the best score on the train part are chosen and evaluated on the test part.
+    every param set is backtested only once over the full series, the train and test stats of all windows are taken
+    from its equity curve, so overlapping windows reuse all indicator and bot results. the backtests run in parallel
+    processes, bot_factory(params) creates the bot for a param set (needs to be a module level function).
+    with exact_oos the chosen params are backtested again on each test window alone (with the bars the bot needs
+    before it) '''
+
+    def __init__(self, bars: List[Bar], bot_factory, train_bars: int, test_bars: int, symbol: Symbol = None,
+                 workers: int = None, logger=None, exact_oos: bool = False):
+        self.bars = bars  # newest first like everywhere else
+        self.bot_factory = bot_factory
+        self.train_bars = train_bars
+        self.test_bars = test_bars
+        self.symbol = symbol
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.logger = logger
+        self.exact_oos = exact_oos
+        self.curves: List[EquityCurve] = []
+        self.windows: List[WalkForwardWindow] = []
+
+    def create_windows(self) -> List[WalkForwardWindow]:
+        windows = []
+        start = 0
+        while start + self.train_bars + self.test_bars <= len(self.bars):
+            windows.append(WalkForwardWindow(start, start + self.train_bars - 1,
+                                             start + self.train_bars, start + self.train_bars + self.test_bars - 1))
+            start += self.test_bars
+        return windows
+
+    def run(self, param_sets):
+        param_sets = [list(params) for params in param_sets]
+        self.windows = self.create_windows()
+        if len(self.windows) == 0:
+            if self.logger is not None:
+                self.logger.error("not enough bars for one walk forward window")
+            return self
+        if self.logger is not None:
+            self.logger.info("walk forward with %i param sets on %i windows" % (len(param_sets), len(self.windows)))
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.bars, self.bot_factory, self.symbol)) as pool:
+            self.curves = list(pool.map(_run_curve, param_sets))
+
+            for window in self.windows:
+                best = None
+                for curve in self.curves:
+                    trainScore = score(*curve.stats(window.train_start, window.train_end))
+                    if best is None or trainScore > window.train_score:
+                        best = curve
+                        window.train_score = trainScore
+                window.params = best.params
+                # test from the close of the last train bar
+                window.test_profit, window.test_dd = best.stats(window.train_end, window.test_end)
+                base = best.equity[window.train_end]
+                window.test_equity = [value / base for value in best.equity[window.train_end:window.test_end + 1]]
+
+            if self.exact_oos:
+                results = pool.map(_run_test, [w.params for w in self.windows],
+                                   [w.test_start for w in self.windows], [w.test_end for w in self.windows])
+                for window, result in zip(self.windows, results):
+                    window.test_profit, window.test_dd = result
+                    window.test_equity = None
+
+        if self.logger is not None:
+            for window in self.windows:
+                self.logger.info("window %i-%i: %s train rel: %.2f | test profit: %.2f%% maxDD: %.2f%%" %
+                                 (window.test_start, window.test_end, str(window.params), window.train_score,
+                                  100 * window.test_profit, 100 * window.test_dd))
+            stats = self.oos_stats()
+            self.logger.info("walk forward OOS | windows: %i | profitable: %i | profit: %.2f%% | maxDD: %.2f%% | "
+                             "rel: %.2f" % (stats["windows"], stats["profitableWindows"], 100 * stats["profit"],
+                                            100 * stats["maxDD"], stats["rel"]))
+        return self
+
+    def oos_stats(self) -> dict:
+        ''' the test windows chained: compounded profit and the max drawdown of the chained OOS equity '''
+        equity = 1
+        hh = 1
+        maxDD = 0
+        for window in self.windows:
+            if window.test_equity is not None:
+                for value in window.test_equity:
+                    hh = max(hh, equity * value)
+                    maxDD = max(maxDD, (hh - equity * value) / hh)
+            else:
+                # only the stats are known: assume the drawdown of the window happened from the highest equity so far
+                maxDD = max(maxDD, (hh - equity * (1 - window.test_dd)) / hh)
+            equity *= 1 + window.test_profit
+            hh = max(hh, equity)
+        profit = equity - 1
+        return {
+            "windows": len(self.windows),
+            "profitableWindows": len([w for w in self.windows if w.test_profit > 0]),
+            "profit": profit,
+            "maxDD": maxDD,
+            "rel": score(profit, maxDD)
+        }
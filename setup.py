@@ -21,8 +21,12 @@ setup(name='kuegi-bot',
           'websocket-client',
           'future',
           'plotly',
-          'bybit'
+          'bybit',
+          'numpy'
       ],
+      extras_require={
+          'fastjson': ['orjson']
+      },
       packages=find_packages(),
       scripts=["backtest.py","history_crawler.py","cryptobot.py"],
       classifiers=["Development Status :: 3 - Alpha" ]